@@ -0,0 +1,108 @@
+"""
+Background execution of AI requests
+
+Perplexity answers take seconds, so the dashboard hands them to a small
+process-wide worker pool instead of waiting in the Streamlit script
+thread. submit() returns an AIJob handle that can be kept in session
+state and polled on later reruns; streamed text accumulates on the
+handle as it arrives, so partial answers can be shown while it runs.
+"""
+
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# AI requests running at once across all sessions; further jobs queue
+MAX_WORKERS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+_job_ids = itertools.count(1)
+
+
+def get_executor():
+    """Return the shared AI worker pool"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='ai-job')
+    return _executor
+
+
+class AIJob:
+    """Handle for one background AI request"""
+
+    def __init__(self, label):
+        self.id = next(_job_ids)
+        self.label = label
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.future = None
+        self._parts = []
+        self._lock = threading.Lock()
+
+    @property
+    def text(self):
+        """Answer text received so far"""
+        with self._lock:
+            return ''.join(self._parts)
+
+    @property
+    def status(self):
+        """'queued', 'running', 'done' or 'failed'"""
+        if self.finished_at is not None:
+            return 'failed' if self.error else 'done'
+        return 'running' if self.started_at is not None else 'queued'
+
+    def done(self):
+        return self.finished_at is not None
+
+    def result(self):
+        """Final answer, or an error message if the job failed"""
+        if self.error:
+            return f"Error: {self.error}"
+        return self.text
+
+    def cancel(self):
+        """Drop the job if it has not started yet"""
+        return self.future is not None and self.future.cancel()
+
+    def _run(self, fn, args, kwargs):
+        self.started_at = time.time()
+        try:
+            result = fn(*args, **kwargs)
+            # Generators are consumed here so the text grows as it streams
+            for part in [result] if isinstance(result, str) else result:
+                with self._lock:
+                    self._parts.append(part)
+        except Exception as e:
+            print(f"AI job '{self.label}' failed: {e}")
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+
+
+def submit(label, fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) on the AI worker pool
+
+    Args:
+        label (str): Short description shown while the job runs
+        fn: Callable returning the answer text or an iterator of text
+            fragments (e.g. PerplexityClient.stream_health_question)
+
+    Returns:
+        AIJob: Handle to poll for progress and the result
+    """
+    job = AIJob(label)
+    job.future = get_executor().submit(job._run, fn, args, kwargs)
+    return job
+
+
+def pending(jobs):
+    """True if any of the given jobs (None entries allowed) is unfinished"""
+    return any(job is not None and not job.done() for job in jobs)
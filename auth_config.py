@@ -1,3 +1,17 @@
+"""
+Dashboard login
+
+By default there is one shared password, `dashboard_password` in
+.streamlit/secrets.toml. To serve several ring owners from one
+deployment, give each a [users.<name>] table instead; their Oura token
+decides which storage shard they see (see user_shards.py):
+
+    [users.alice]
+    password = "..."
+    oura_access_token = "..."
+    oura_refresh_token = "..."
+"""
+
 import streamlit as st
 import hashlib
 
@@ -5,12 +19,45 @@ def make_password_hash(password):
     """Create a hash of the password"""
     return hashlib.sha256(password.encode()).hexdigest()
 
+def _users():
+    """The [users] table from secrets, or None for a single shared password"""
+    try:
+        users = st.secrets.get("users")
+    except Exception:
+        return None
+    return users or None
+
+def login_tokens(username):
+    """
+    Oura tokens configured for a user login
+    
+    Returns:
+        dict: access_token / refresh_token in TokenStore form, or None
+    """
+    user = (_users() or {}).get(username)
+    if not user or not user.get("oura_access_token"):
+        return None
+    return {
+        'access_token': user["oura_access_token"],
+        'refresh_token': user.get("oura_refresh_token"),
+        'expires_at': None,
+        'token_type': 'Bearer',
+    }
+
 def check_password():
     """Returns `True` if the user has entered the correct password."""
+    users = _users()
     
     def password_entered():
         """Checks whether a password entered by the user is correct."""
-        if st.session_state["password"] == st.secrets.get("dashboard_password", ""):
+        if users is not None:
+            user = users.get(st.session_state.get("username_input", ""))
+            correct = bool(user) and st.session_state["password"] == user.get("password")
+            if correct:
+                st.session_state["username"] = st.session_state["username_input"]
+        else:
+            correct = st.session_state["password"] == st.secrets.get("dashboard_password", "")
+        if correct:
             st.session_state["password_correct"] = True
             del st.session_state["password"]  # Don't store password
         else:
@@ -22,6 +69,8 @@ def check_password():
 
     # Show password input
     st.markdown("## 🔐 Health Dashboard Login")
+    if users is not None:
+        st.text_input("Username", key="username_input")
     st.text_input(
         "Password", 
         type="password", 
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for storage, analytics and the Oura fetch path
+
+Synthetic histories of 1, 5 and 20 years (with a few thousand tags
+each) are written to a temporary directory and timed through
+HealthDataStorage on every storage backend. get_oura_data is timed
+against a local FakeOuraServer with an injected per-request latency,
+both with an empty response cache and with a warm one.
+
+Every case reports the min / median / mean of several runs in
+milliseconds. The JSON report carries the commit it was measured on,
+so two reports can be compared to spot regressions.
+
+Usage:
+    python benchmarks.py
+    python benchmarks.py --years 1 5 --backends sqlite --json > bench.json
+    python benchmarks.py --output bench.json --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+YEARS = (1, 5, 20)
+BACKENDS = ('sqlite', 'journal', 'json')
+REPEAT = 5
+
+# Tags per logged day and distinct tag names in the synthetic histories
+TAGS_PER_DAY = 3
+TAG_NAMES = 1500
+TAG_CATEGORIES = ('stress', 'alcohol', 'caffeine', 'exercise', 'travel', 'diet', 'supplement')
+# Share of days with no entry (ring not worn)
+MISSING_DAYS = 0.05
+
+# Seconds added to every fake Oura response
+FETCH_LATENCY = 0.05
+
+# A case counts as a regression when its median is this much slower;
+# cases faster than MIN_COMPARE_MS are mostly timer noise and are skipped
+REGRESSION_THRESHOLD = 1.25
+MIN_COMPARE_MS = 1.0
+
+
+def synthetic_history(years, seed=0, today=None):
+    """
+    Deterministic daily entries and tags ending today
+
+    Returns:
+        dict: {'daily_entries', 'tags', 'sync_state'} as a backend stores it
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    stamp = datetime.now().isoformat()
+    names = [f"{TAG_CATEGORIES[i % len(TAG_CATEGORIES)]}-{i}" for i in range(TAG_NAMES)]
+    entries, tags = [], []
+    for offset in range(years * 365, 0, -1):
+        day = str(today - timedelta(days=offset))
+        if rng.random() < MISSING_DAYS:
+            continue
+        entries.append({
+            'date': day,
+            'sleep_score': rng.randint(55, 95),
+            'readiness_score': rng.randint(50, 95),
+            'activity_score': rng.randint(40, 100),
+            'heart_rate': rng.randint(48, 65),
+            'hrv': rng.randint(25, 90),
+            'temperature': f"{rng.uniform(-0.6, 0.6):+.2f}",
+            'total_sleep': round(rng.uniform(5, 9), 1),
+            'timestamp': stamp,
+        })
+        for _ in range(rng.randint(0, 2 * TAGS_PER_DAY)):
+            name = rng.choice(names)
+            tags.append({
+                'date': day,
+                'tag_name': name,
+                'tag_category': name.rsplit('-', 1)[0],
+                'impact': rng.choice(('positive', 'neutral', 'negative')),
+                'notes': '',
+                'timestamp': stamp,
+            })
+    return {'daily_entries': entries, 'tags': tags, 'sync_state': {}}
+
+
+def timed(fn, repeat=REPEAT, setup=None):
+    """
+    Time fn() `repeat` times; setup() runs untimed before each call
+
+    Returns:
+        dict: min_ms, median_ms, mean_ms and runs
+    """
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'min_ms': round(min(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'mean_ms': round(statistics.mean(samples), 3),
+        'runs': repeat,
+    }
+
+
+def bench_storage(history, backend, directory, repeat=REPEAT):
+    """
+    Time the HealthDataStorage paths on one backend
+
+    Returns:
+        dict: case name -> timing
+    """
+    from data_storage import HealthDataStorage
+    from storage_backends import BACKENDS as BACKEND_FILES, make_backend
+    # Loaded lazily by the storage; import now so the first cold case
+    # does not time numpy and pandas being imported
+    import rolling_aggregates  # noqa: F401
+    import timeseries  # noqa: F401
+
+    filename = os.path.join(directory, 'health_data.json')
+    stored = os.path.splitext(filename)[0] + BACKEND_FILES[backend][1]
+
+    def remove_files():
+        for suffix in ('', '-wal', '-shm', '.tmp'):
+            if os.path.exists(stored + suffix):
+                os.remove(stored + suffix)
+
+    def save_all():
+        store = make_backend(backend, filename)
+        store.commit(history['daily_entries'], history['tags'], history['sync_state'])
+        store.close()
+
+    results = {'save_all': timed(save_all, repeat, setup=remove_files)}
+    save_all()
+
+    opened = []
+    results['load'] = timed(lambda: opened.append(HealthDataStorage(filename, backend=backend)), repeat)
+    for storage in opened[:-1]:
+        storage.backend.close()
+    storage = opened[-1]
+
+    results['get_recent_entries'] = timed(lambda: storage.get_recent_entries(30), repeat)
+    # Cold builds the columnar view and rolling aggregates first
+    results['get_weekly_summary_cold'] = timed(storage.get_weekly_summary, repeat, setup=storage.reload)
+    results['get_weekly_summary'] = timed(storage.get_weekly_summary, repeat)
+    results['analyze_tag_impact'] = timed(storage.analyze_tag_impact, repeat)
+
+    latest = storage.get_all_entries()[-1]
+    results['add_daily_entry_unchanged'] = timed(
+        lambda: storage.add_daily_entry(**{k: v for k, v in latest.items() if k != 'timestamp'}), repeat)
+    new_days = iter(range(1, repeat + 1))
+    results['add_daily_entry'] = timed(
+        lambda: storage.add_daily_entry(date.today() + timedelta(days=next(new_days)), 80, 75, 70), repeat)
+    storage.backend.close()
+    return results
+
+
+def bench_fetch(directory, latency=FETCH_LATENCY, repeat=REPEAT):
+    """
+    Time get_oura_data against a FakeOuraServer
+
+    The response cache and rate limiter are swapped for local ones, a
+    fixed access token is passed in, and the run happens inside
+    `directory` (heart-rate samples land in ./hr_data), so nothing
+    touches the real API or the app's own files.
+
+    Returns:
+        dict: case name -> timing (plus requests sent per call)
+    """
+    import http_client
+    import oura_auth
+    import oura_client
+    from mock_servers import FakeOuraServer
+
+    saved = (oura_client.BASE_URL, oura_client.CACHE_FILE, oura_client._response_cache)
+    results = {}
+    cwd = os.getcwd()
+    os.chdir(directory)
+    with FakeOuraServer(latency=latency) as server:
+        host = server.httpd.server_address[0]
+        http_client.HOST_LIMITS[host] = (1000.0, 1000)
+        http_client._limiters.pop(host, None)
+        oura_client.BASE_URL = server.base_url
+        oura_client.CACHE_FILE = os.path.join(directory, 'responses.db')
+        oura_client._response_cache = None
+        try:
+            for case, setup in (('get_oura_data_cold', oura_client.get_response_cache().clear),
+                                ('get_oura_data_warm', None)):
+                sent = len(server.requests)
+                results[case] = timed(lambda: oura_auth.get_oura_data('benchmark'), repeat, setup=setup)
+                results[case]['requests_per_call'] = (len(server.requests) - sent) / repeat
+            results['latency_ms'] = latency * 1000
+        finally:
+            oura_client.BASE_URL, oura_client.CACHE_FILE, oura_client._response_cache = saved
+            http_client.HOST_LIMITS.pop(host, None)
+            http_client._limiters.pop(host, None)
+            os.chdir(cwd)
+    return results
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=HERE, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(years=YEARS, backends=BACKENDS, repeat=REPEAT, latency=FETCH_LATENCY, fetch=True):
+    """
+    Run every benchmark and return the report
+
+    Returns:
+        dict: {'meta': {...}, 'results': {case id: timing}}; case ids look
+        like 'storage/sqlite/5y/load' and 'fetch/get_oura_data_cold'
+    """
+    report = {
+        'meta': {
+            'commit': _git('rev-parse', 'HEAD'),
+            'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'datasets': {},
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='oura-bench-') as directory:
+        for n_years in years:
+            history = synthetic_history(n_years)
+            report['datasets'][f'{n_years}y'] = {
+                'entries': len(history['daily_entries']),
+                'tags': len(history['tags']),
+            }
+            for backend in backends:
+                path = os.path.join(directory, f'{n_years}y-{backend}')
+                os.makedirs(path)
+                for case, timing in bench_storage(history, backend, path, repeat).items():
+                    report['results'][f'storage/{backend}/{n_years}y/{case}'] = timing
+        if fetch:
+            timings = bench_fetch(directory, latency, repeat)
+            report['meta']['fetch_latency_ms'] = timings.pop('latency_ms')
+            for case, timing in timings.items():
+                report['results'][f'fetch/{case}'] = timing
+    return report
+
+
+def compare(baseline, report, threshold=REGRESSION_THRESHOLD):
+    """
+    Cases whose median got slower than threshold x the baseline's
+
+    Returns:
+        list: (case id, baseline median, current median) tuples
+    """
+    regressions = []
+    for case, timing in report['results'].items():
+        before = baseline.get('results', {}).get(case)
+        if not before or max(before['median_ms'], timing['median_ms']) < MIN_COMPARE_MS:
+            continue
+        if timing['median_ms'] > threshold * before['median_ms']:
+            regressions.append((case, before['median_ms'], timing['median_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, nargs='+', default=list(YEARS))
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--latency', type=float, default=FETCH_LATENCY,
+                        help='Seconds added to every fake Oura response')
+    parser.add_argument('--no-fetch', action='store_true', help='Skip the get_oura_data benchmarks')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--json', action='store_true', help='Print the JSON report instead of a table')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON report to check for regressions against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    report = run(args.years, args.backends, args.repeat, args.latency, fetch=not args.no_fetch)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for name, sizes in report['datasets'].items():
+            print(f"{name}: {sizes['entries']} entries, {sizes['tags']} tags")
+        for case, timing in report['results'].items():
+            print(f"{case:50} {timing['median_ms']:10.2f} ms  (min {timing['min_ms']:.2f})")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        for case, before, after in regressions:
+            print(f"REGRESSION {case}: {before:.2f} -> {after:.2f} ms", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
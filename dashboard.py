@@ -1,19 +1,11 @@
+# Only what the login screen needs is imported up here; everything else
+# loads after the password check (see import_budget.py)
 import streamlit as st
-import pandas as pd
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
-import os
-from dotenv import load_dotenv
-from oura_auth import get_oura_data
-from perplexity_integration import PerplexityClient
+from datetime import datetime, timedelta, timezone
 from auth_config import check_password
-from data_storage import HealthDataStorage
+import threading
 import time
 
-# ... your other imports ...
-
-load_dotenv()
-
 # INITIALIZE SESSION STATE FIRST (before password check)
 if 'last_refresh' not in st.session_state:
     st.session_state.last_refresh = time.time()
@@ -27,6 +19,97 @@ if not check_password():
 # Page config
 st.set_page_config(page_title="Personal Health Dashboard", page_icon="💍", layout="wide")
 
+import os
+from dotenv import load_dotenv
+from oura_auth import get_oura_data
+from data_storage import HealthDataStorage
+import ai_jobs
+import sync_daemon
+import tracing
+
+load_dotenv()
+# Timing of this script run (not recorded if it ends in st.rerun / st.stop)
+run_span = tracing.span('dashboard.run').start()
+# Serves /metrics when OURA_METRICS_PORT is set; started once per process
+tracing.start_metrics_server()
+
+# Login name when [users] are configured; None with the single shared password
+username = st.session_state.get("username")
+
+# Process-wide resources, shared by every session and rerun (per user where
+# they hold user data)
+@st.cache_resource
+def get_shard(username):
+    """
+    Where a login's data lives: the working directory for the single shared
+    password, otherwise the shard of the Oura user behind the login's token
+    """
+    import user_shards
+    if username is None:
+        return user_shards.shard_for(None)
+    from auth_config import login_tokens
+    tokens = login_tokens(username)
+    if tokens is None:
+        raise ValueError(f"No Oura token is configured for {username}")
+    return user_shards.shard_for_tokens(tokens)
+
+@st.cache_resource
+def get_storage(username):
+    """
+    Storage engine of a user's shard with its in-memory indexes, loaded from
+    disk once per process; writes are flushed in the background so reruns
+    never wait on disk
+    """
+    return HealthDataStorage(get_shard(username).storage_file, write_behind=True)
+
+@st.cache_resource
+def get_hr_store(username):
+    from hr_store import HeartRateStore
+    return HeartRateStore(get_shard(username).hr_directory)
+
+@st.cache_resource
+def get_perplexity_client():
+    """Shared Perplexity client, or None if no API key is configured"""
+    try:
+        from perplexity_integration import PerplexityClient
+        return PerplexityClient()
+    except:
+        return None
+
+try:
+    shard = get_shard(username)
+except Exception as e:
+    st.error(f"Could not find your Oura account: {e}")
+    st.stop()
+
+# Seconds between checks on a running "Refresh Now" sync
+SYNC_POLL_SECONDS = 1.0
+
+def start_refresh(shard, storage, hr_store):
+    """
+    Sync a shard on a background thread, so a long backfill or another
+    process's run never blocks the script; a sync already running for the
+    shard is waited for instead of starting a second one
+    """
+    def run():
+        try:
+            sync_daemon.sync_shard(shard, storage, hr_store, wait=True)
+        except Exception as e:
+            print(f"Refresh failed: {e}")
+    thread = threading.Thread(target=run, daemon=True, name='refresh-sync')
+    thread.start()
+    return thread
+
+def watch_refresh():
+    """Say a refresh is running; once it has finished, rerun with the new data"""
+    if st.session_state.refresh_sync.is_alive():
+        st.caption("🔄 Syncing with Oura...")
+        return
+    del st.session_state.refresh_sync
+    st.cache_data.clear()
+    get_storage(username).reload()
+    st.rerun()
+
 # AUTO-REFRESH FEATURE (Move this AFTER page config and password)
 with st.sidebar:
     st.markdown("### ⚙️ Auto-Refresh Settings")
@@ -54,10 +137,14 @@ with st.sidebar:
     
     st.markdown("---")
     st.markdown("### 📱 Quick Actions")
-    if st.button("🔄 Refresh Now", use_container_width=True):
+    if st.button("🔄 Refresh Now", use_container_width=True) and 'refresh_sync' not in st.session_state:
         st.session_state.last_refresh = time.time()
-        st.cache_data.clear()
-        st.rerun()
+        st.session_state.refresh_sync = start_refresh(shard, get_storage(username), get_hr_store(username))
+    if 'refresh_sync' in st.session_state:
+        st.fragment(watch_refresh, run_every=SYNC_POLL_SECONDS)()
+    sync_state = sync_daemon.read_state(shard)
+    if sync_state and sync_state.get('fetched_at'):
+        st.caption(f"🛰️ Last synced {int(time.time() - sync_state['fetched_at']) // 60} min ago")
 
 # Custom CSS
 st.markdown("""
@@ -72,25 +159,194 @@ st.markdown("""
 
 st.markdown('<h1 class="main-header">💍 Personal Health Dashboard</h1>', unsafe_allow_html=True)
 
+@st.cache_resource(ttl=3600)
+def start_history_sync(_storage, _hr_store, _shard, username):
+    """
+    Backfill / incrementally sync a user's past days into storage (at most
+    hourly per user) unless sync_daemon.py is already keeping them current
+    
+    Runs on a background thread so the first paint does not wait for it;
+    new days show up on a later rerun.
+    """
+    def run():
+        try:
+            if sync_daemon.read_snapshot(_shard) is None:
+                sync_daemon.sync_shard(_shard, _storage, _hr_store)
+        except Exception as e:
+            print(f"History sync failed: {e}")
+    thread = threading.Thread(target=run, daemon=True, name='history-sync')
+    thread.start()
+    return thread
+
 # Initialize
-storage = HealthDataStorage()
+storage = get_storage(username)
+# Pick up writes made outside this process (one stat / PRAGMA per rerun)
+storage.reload_if_changed()
+hr_store = get_hr_store(username)
+start_history_sync(storage, hr_store, shard, username)
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
-if 'perplexity_client' not in st.session_state:
-    try:
-        st.session_state.perplexity_client = PerplexityClient()
-    except:
-        st.session_state.perplexity_client = None
+if 'ai_panels' not in st.session_state:
+    st.session_state.ai_panels = {}
+
+# Seconds between checks on running AI jobs
+AI_POLL_SECONDS = 0.5
+
+def session_ai_jobs():
+    """AI jobs this session is displaying"""
+    jobs = list(st.session_state.ai_panels.values())
+    jobs += [message.get('job') for message in st.session_state.chat_history]
+    return jobs
+
+def ai_fragment(render, *args):
+    """
+    Call render(*args) in a fragment that re-runs on its own while AI jobs
+    are in flight, so answers appear without blocking the rest of the page
+    """
+    polling = ai_jobs.pending(session_ai_jobs())
+    def body():
+        render(*args)
+        if polling and not ai_jobs.pending(session_ai_jobs()):
+            # Everything finished: one full rerun switches polling off
+            st.rerun()
+    st.fragment(body, run_every=AI_POLL_SECONDS if polling else None)()
+
+def render_ai_job(job):
+    """Show a job's answer, or its partial text while it is still running"""
+    if job.done():
+        st.markdown(job.result())
+    else:
+        if job.text:
+            st.markdown(job.text + " ▌")
+        st.caption(f"⏳ {job.label}...")
+
+def render_ai_panel(slot, heading):
+    job = st.session_state.ai_panels.get(slot)
+    if job is not None:
+        st.markdown(heading)
+        render_ai_job(job)
+
+def render_chat_history():
+    for message in st.session_state.chat_history:
+        job = message.get('job')
+        if job is not None and job.done():
+            message['content'] = job.result()
+            del message['job']
+            job = None
+        if message["role"] == "user":
+            st.markdown(f"**You:** {message['content']}")
+        elif job is not None:
+            st.markdown("**AI Coach:**")
+            render_ai_job(job)
+        else:
+            st.markdown(f"**AI Coach:** {message['content']}")
+        st.markdown("---")
 
 @st.cache_data(ttl=3600)
-def load_oura_data():
+def load_oura_data(username, sync_version, snapshot_fresh):
+    """
+    Today's metrics: the last sync's snapshot while it is fresh, otherwise
+    fetched now; sync_version (the sync state file's mtime) and snapshot_fresh
+    are cache keys only, so a snapshot is not served past its fresh_until
+    """
+    snapshot = sync_daemon.read_snapshot(get_shard(username))
+    if snapshot is not None:
+        return snapshot
     try:
-        return get_oura_data()
+        return get_oura_data(get_shard(username).access_token(), get_hr_store(username))
     except Exception as e:
         st.error(f"Error loading Oura data: {str(e)}")
         return None
 
-data = load_oura_data()
+# Charts span the wide layout; keep about one point per 3 px (one bar per 6 px),
+# so long periods are downsampled and the payload stays the same size. The
+# server never learns the real width, so this is an assumed width (a typical
+# laptop browser), set OURA_CHART_WIDTH_PX for larger or smaller screens
+CHART_WIDTH_PX = int(os.getenv('OURA_CHART_WIDTH_PX', 1200))
+TREND_MAX_POINTS = CHART_WIDTH_PX // 3
+SLEEP_MAX_BARS = CHART_WIDTH_PX // 6
+HR_MAX_POINTS = CHART_WIDTH_PX // 2
+
+@st.cache_data(max_entries=8)
+def trend_frame(_storage, username, days, max_points, version, today):
+    """
+    (DataFrame, calendar days per row) for the last N days; username, version and
+    today are cache keys only, so it is rebuilt when storage changes or the
+    date rolls over and never shared between users
+    """
+    return _storage.get_trend_frame(days, max_points)
+
+@st.cache_resource(max_entries=8)
+@tracing.traced('dashboard.trend_figures')
+def trend_figures(_storage, username, days, period, version, today):
+    """(scores figure, sleep-hours figure or None) for a period, memoized like trend_frame"""
+    import plotly.graph_objects as go
+    df, per_point = trend_frame(_storage, username, days, TREND_MAX_POINTS, version, today)
+    # Markers only mean something for individual days
+    mode = 'lines+markers' if per_point == 1 else 'lines'
+    title = f"Health Scores - {period}" + (f" (~{per_point}-day averages)" if per_point > 1 else "")
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=df['date'], y=df['sleep_score'], name='Sleep Score', line=dict(color='#4A90E2', width=2), mode=mode))
+    fig.add_trace(go.Scatter(x=df['date'], y=df['readiness_score'], name='Readiness Score', line=dict(color='#50C878', width=2), mode=mode))
+    fig.add_trace(go.Scatter(x=df['date'], y=df['activity_score'], name='Activity Score', line=dict(color='#FF6B6B', width=2), mode=mode))
+    fig.update_layout(title=title, xaxis_title="Date", yaxis_title="Score", hovermode='x unified', height=500)
+    
+    fig2 = None
+    df_sleep, per_bar = trend_frame(_storage, username, days, SLEEP_MAX_BARS, version, today)
+    if any(df_sleep['total_sleep'].notna()):
+        fig2 = go.Figure(data=[go.Bar(x=df_sleep['date'], y=df_sleep['total_sleep'], marker_color='#9B59B6')])
+        title = "Total Sleep Hours" + (f" (~{per_bar}-day averages)" if per_bar > 1 else "")
+        fig2.update_layout(title=title, xaxis_title="Date", yaxis_title="Hours", height=350)
+    return fig, fig2
+
+@st.cache_resource(max_entries=4)
+@tracing.traced('dashboard.intraday_hr_figure')
+def intraday_hr_figure(_hr_store, username, day, version):
+    """(figure or None, resting HR) for one UTC day of a user; version is the day file's mtime"""
+    import plotly.graph_objects as go
+    from downsampling import minmax_indices
+    hr_frame = _hr_store.get_day_frame(day)
+    if hr_frame.empty:
+        return None, None
+    if len(hr_frame) > HR_MAX_POINTS:
+        # Dense (e.g. workout) sampling: keep each bucket's low and high
+        hr_frame = hr_frame.iloc[minmax_indices(hr_frame['bpm'], HR_MAX_POINTS // 2)]
+    fig_hr = go.Figure(go.Scatter(x=hr_frame['time'], y=hr_frame['bpm'], mode='lines', line=dict(color='#E74C3C', width=1)))
+    fig_hr.update_layout(xaxis_title="Time (UTC)", yaxis_title="BPM", height=300)
+    return fig_hr, _hr_store.resting_heart_rate(day)
+
+@st.fragment
+@tracing.traced('dashboard.trends_fragment')
+def render_trends():
+    """Trend Graphs tab; changing the period reruns only this fragment"""
+    st.header("📈 Health Trends")
+    period = st.selectbox("View Period", ["7 Days", "30 Days", "90 Days", "All Time"])
+    days_map = {"7 Days": 7, "30 Days": 30, "90 Days": 90, "All Time": 36500}
+    selected_days = days_map[period]
+    today = datetime.now().date()
+    df, _ = trend_frame(storage, username, selected_days, TREND_MAX_POINTS, storage.version, today)
+    
+    if len(df) > 1:
+        fig, fig2 = trend_figures(storage, username, selected_days, period, storage.version, today)
+        # Figure-to-JSON serialization happens inside st.plotly_chart
+        with tracing.span('dashboard.plotly_chart'):
+            st.plotly_chart(fig, use_container_width=True)
+            if fig2 is not None:
+                st.plotly_chart(fig2, use_container_width=True)
+        
+        st.subheader("📊 Period Statistics")
+        period_summary = storage.get_window_summary(selected_days)
+        col_stat1, col_stat2, col_stat3 = st.columns(3)
+        with col_stat1:
+            st.metric("Avg Sleep Score", f"{period_summary['sleep_avg']}")
+        with col_stat2:
+            st.metric("Avg Readiness", f"{period_summary['readiness_avg']}")
+        with col_stat3:
+            st.metric("Avg Activity", f"{period_summary['activity_avg']}")
+    else:
+        st.info(f"Not enough data for {period} view. Keep using the dashboard daily to build your trends!")
+
+data = load_oura_data(username, sync_daemon.state_version(shard), sync_daemon.snapshot_fresh(shard))
 
 if data:
     today = datetime.now().date()
@@ -188,8 +444,13 @@ if data:
         st.caption("💡 Refresh this page every few hours for updated guidance based on time of day and energy levels.")
     
     # TABS
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📊 Today's Metrics", "🍽️ Smart Meal Recommendations", "📈 Trend Graphs", "📋 Weekly Summary", "🤖 AI Coach"])    # TAB 1: TODAY'S METRICS
-    with tab1:
+    # Only the selected tab is rendered, so the others cost nothing on a rerun
+    TABS = ["📊 Today's Metrics", "🍽️ Smart Meal Recommendations", "📈 Trend Graphs", "📋 Weekly Summary", "🤖 AI Coach"]
+    active_tab = st.radio("Section", TABS, horizontal=True, key="active_tab", label_visibility="collapsed")
+    tab_span = tracing.span('dashboard.tab', tab=active_tab).start()
+    
+    # TAB 1: TODAY'S METRICS
+    if active_tab == TABS[0]:
         st.header("Today's Health Metrics")
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -207,9 +468,20 @@ if data:
         with col5:
             st.info(f"🌡️ **Temperature**: {data.get('temperature', 'N/A')}°F")
             st.info(f"😴 **Total Sleep**: {data.get('total_sleep', 'N/A')} hours")
+        
+        hr_day = datetime.now(timezone.utc).date()
+        if not hr_store.day_version(hr_day):
+            hr_day = hr_day - timedelta(days=1)
+        fig_hr, resting_hr = intraday_hr_figure(hr_store, username, hr_day, hr_store.day_version(hr_day))
+        if fig_hr is not None:
+            st.subheader("💓 Intraday Heart Rate")
+            if resting_hr:
+                st.caption(f"Resting HR (lowest 30-min average): {resting_hr} bpm")
+            with tracing.span('dashboard.plotly_chart'):
+                st.plotly_chart(fig_hr, use_container_width=True)
     
         # TAB 2: MEAL RECOMMENDATIONS
-    with tab2:
+    elif active_tab == TABS[1]:
         st.header("🍽️ Smart Meal Recommendations")
         st.write("Personalized nutrition suggestions based on your health data and recovery needs.")
         
@@ -265,37 +537,38 @@ if data:
         st.markdown("---")
         st.subheader("🤖 AI-Powered Restaurant Finder")
         
-        if st.session_state.perplexity_client:
+        perplexity_client = get_perplexity_client()
+        if perplexity_client:
             col_ai1, col_ai2 = st.columns(2)
             
             with col_ai1:
                 if st.button("🍴 Find Healthy Restaurants Near Me", use_container_width=True):
-                    with st.spinner("Searching for healthy options in Plano, TX..."):
-                        context = {
-                            "Location": "Plano, Texas",
-                            "Readiness Score": readiness,
-                            "Meal Strategy": meal_strategy
-                        }
-                        prompt = f"I'm in Plano, Texas and my fitness readiness score is {readiness}/100. Recommend 5 healthy restaurants or meal options available for delivery (DoorDash, Uber Eats) that would support my current health state. Include restaurant names and what to order."
-                        
-                        recommendations = st.session_state.perplexity_client.ask_health_question(prompt, context)
-                        st.markdown("### 📍 Restaurant Recommendations:")
-                        st.markdown(recommendations)
+                    context = {
+                        "Location": "Plano, Texas",
+                        "Readiness Score": readiness,
+                        "Meal Strategy": meal_strategy
+                    }
+                    prompt = f"I'm in Plano, Texas and my fitness readiness score is {readiness}/100. Recommend 5 healthy restaurants or meal options available for delivery (DoorDash, Uber Eats) that would support my current health state. Include restaurant names and what to order."
+                    
+                    st.session_state.ai_panels['restaurants'] = ai_jobs.submit(
+                        "Searching for healthy options in Plano, TX",
+                        perplexity_client.stream_health_question, prompt, context)
+                ai_fragment(render_ai_panel, 'restaurants', "### 📍 Restaurant Recommendations:")
             
             with col_ai2:
                 if st.button("🥗 What Should I Eat Today?", use_container_width=True):
-                    with st.spinner("Analyzing your health data..."):
-                        context = {
-                            "Sleep Score": sleep_score,
-                            "Readiness Score": readiness,
-                            "Activity Score": activity_score,
-                            "Location": "Plano, Texas"
-                        }
-                        prompt = f"Based on my health scores (Sleep: {sleep_score}, Readiness: {readiness}, Activity: {activity_score}), what specific meals should I prioritize today? Give me 3 specific meal ideas for breakfast, lunch, and dinner that support my recovery and performance."
-                        
-                        meal_plan = st.session_state.perplexity_client.ask_health_question(prompt, context)
-                        st.markdown("### 🍱 Today's Personalized Meal Plan:")
-                        st.markdown(meal_plan)
+                    context = {
+                        "Sleep Score": sleep_score,
+                        "Readiness Score": readiness,
+                        "Activity Score": activity_score,
+                        "Location": "Plano, Texas"
+                    }
+                    prompt = f"Based on my health scores (Sleep: {sleep_score}, Readiness: {readiness}, Activity: {activity_score}), what specific meals should I prioritize today? Give me 3 specific meal ideas for breakfast, lunch, and dinner that support my recovery and performance."
+                    
+                    st.session_state.ai_panels['meal_plan'] = ai_jobs.submit(
+                        "Analyzing your health data",
+                        perplexity_client.stream_health_question, prompt, context)
+                ai_fragment(render_ai_panel, 'meal_plan', "### 🍱 Today's Personalized Meal Plan:")
         else:
             st.warning("⚠️ Perplexity AI not configured. AI recommendations unavailable.")
         
@@ -322,42 +595,11 @@ if data:
         st.info("💧 **Hydration Reminder:** Based on your activity score of " + str(activity_score) + ", aim for at least " + 
                ("10 cups" if activity_score >= 75 else "8 cups" if activity_score >= 60 else "6-8 cups") + " of water today.")
     # TAB 3: TREND GRAPHS
-    with tab3:
-        st.header("📈 Health Trends")
-        period = st.selectbox("View Period", ["7 Days", "30 Days", "90 Days", "All Time"])
-        days_map = {"7 Days": 7, "30 Days": 30, "90 Days": 90, "All Time": 36500}
-        selected_days = days_map[period]
-        entries = storage.get_recent_entries(selected_days)
-        
-        if len(entries) > 1:
-            df = pd.DataFrame(entries)
-            df['date'] = pd.to_datetime(df['date'])
-            
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(x=df['date'], y=df['sleep_score'], name='Sleep Score', line=dict(color='#4A90E2', width=2), mode='lines+markers'))
-            fig.add_trace(go.Scatter(x=df['date'], y=df['readiness_score'], name='Readiness Score', line=dict(color='#50C878', width=2), mode='lines+markers'))
-            fig.add_trace(go.Scatter(x=df['date'], y=df['activity_score'], name='Activity Score', line=dict(color='#FF6B6B', width=2), mode='lines+markers'))
-            fig.update_layout(title=f"Health Scores - {period}", xaxis_title="Date", yaxis_title="Score", hovermode='x unified', height=500)
-            st.plotly_chart(fig, use_container_width=True)
-            
-            if any(df['total_sleep'].notna()):
-                fig2 = go.Figure(data=[go.Bar(x=df['date'], y=df['total_sleep'], marker_color='#9B59B6')])
-                fig2.update_layout(title="Total Sleep Hours", xaxis_title="Date", yaxis_title="Hours", height=350)
-                st.plotly_chart(fig2, use_container_width=True)
-            
-            st.subheader("📊 Period Statistics")
-            col_stat1, col_stat2, col_stat3 = st.columns(3)
-            with col_stat1:
-                st.metric("Avg Sleep Score", f"{df['sleep_score'].mean():.0f}")
-            with col_stat2:
-                st.metric("Avg Readiness", f"{df['readiness_score'].mean():.0f}")
-            with col_stat3:
-                st.metric("Avg Activity", f"{df['activity_score'].mean():.0f}")
-        else:
-            st.info(f"Not enough data for {period} view. Keep using the dashboard daily to build your trends!")
+    elif active_tab == TABS[2]:
+        render_trends()
     
     # TAB 4: WEEKLY SUMMARY
-    with tab4:
+    elif active_tab == TABS[3]:
         st.header("📋 Weekly Executive Summary")
         st.caption(f"Summary for the week ending {today}")
         summary = storage.get_weekly_summary()
@@ -394,26 +636,30 @@ if data:
             st.markdown('</div>', unsafe_allow_html=True)
         else:
             st.info("Use the dashboard for at least 3 days to see your weekly summary!")
+        
+        tag_impact = storage.get_tag_impact()
+        if tag_impact:
+            st.subheader("🏷️ Tag Impact on Next-Day Readiness")
+            st.caption("Change versus your 28-day baseline, with 95% confidence interval")
+            st.dataframe(tag_impact, use_container_width=True, hide_index=True)
     # TAB 5: AI COACH
-    with tab5:
+    elif active_tab == TABS[4]:
         st.header("🤖 AI Health Coach powered by Perplexity")
-        if st.session_state.perplexity_client is None:
+        perplexity_client = get_perplexity_client()
+        if perplexity_client is None:
             st.warning("⚠️ Perplexity API key not configured.")
         else:
             if st.button("🎯 Get Today's Health Insights", use_container_width=True):
-                with st.spinner("Analyzing your health data..."):
-                    insights = st.session_state.perplexity_client.get_health_insights(sleep_score, readiness, activity_score)
-                    st.session_state.chat_history.append({"role": "assistant", "content": insights})
+                job = ai_jobs.submit("Analyzing your health data",
+                                     perplexity_client.stream_health_insights,
+                                     sleep_score, readiness, activity_score)
+                st.session_state.chat_history.append({"role": "assistant", "content": "", "job": job})
+                st.rerun()
             
             st.markdown("---")
             st.subheader("💬 Ask Your Health Questions")
             
-            for message in st.session_state.chat_history:
-                if message["role"] == "user":
-                    st.markdown(f"**You:** {message['content']}")
-                else:
-                    st.markdown(f"**AI Coach:** {message['content']}")
-                st.markdown("---")
+            ai_fragment(render_chat_history)
             
             user_question = st.text_input("Ask a question about your health data:", placeholder="e.g., Why is my readiness score low today?")
             
@@ -421,22 +667,25 @@ if data:
             with col_send:
                 if st.button("Send", use_container_width=True) and user_question:
                     st.session_state.chat_history.append({"role": "user", "content": user_question})
-                    with st.spinner("Thinking..."):
-                        context = {
-                            "Sleep Score": sleep_score,
-                            "Readiness Score": readiness,
-                            "Activity Score": activity_score,
-                            "Heart Rate": data.get('heart_rate', 'N/A'),
-                            "HRV": data.get('hrv', 'N/A')
-                        }
-                        response = st.session_state.perplexity_client.ask_health_question(user_question, context)
-                        st.session_state.chat_history.append({"role": "assistant", "content": response})
+                    context = {
+                        "Sleep Score": sleep_score,
+                        "Readiness Score": readiness,
+                        "Activity Score": activity_score,
+                        "Heart Rate": data.get('heart_rate', 'N/A'),
+                        "HRV": data.get('hrv', 'N/A')
+                    }
+                    job = ai_jobs.submit("Thinking",
+                                         perplexity_client.stream_health_question,
+                                         user_question, context)
+                    st.session_state.chat_history.append({"role": "assistant", "content": "", "job": job})
                     st.rerun()
             
             with col_clear:
                 if st.button("Clear Chat", use_container_width=True):
                     st.session_state.chat_history = []
                     st.rerun()
+    
+    tab_span.stop()
 
 else:
     st.error("Unable to load Oura data. Please check your authentication.")
@@ -445,3 +694,39 @@ else:
 st.markdown("---")
 st.caption("🔒 Your data is private and secure. All processing happens with encrypted credentials.")
 
+run_span.stop()
+
+def render_tracing_panel():
+    """Sidebar panel with span latencies and cache hit rates (only with OURA_TRACING=1)"""
+    snapshot = tracing.snapshot()
+    with st.sidebar.expander("⏱️ Performance", expanded=False):
+        st.caption(f"Latency over the last {tracing.WINDOW} calls of each span")
+        st.dataframe([
+            {
+                "Span": " ".join([row['name']] + [f"{k}={v}" for k, v in row['labels'].items()]),
+                "Calls": row['count'],
+                "p50 ms": row['p50_ms'],
+                "p95 ms": row['p95_ms'],
+                "Max ms": row['max_ms'],
+            }
+            for row in snapshot['spans']
+        ], use_container_width=True, hide_index=True)
+        if snapshot['caches']:
+            st.dataframe([
+                {"Cache": row['name'], "Hits": row['hits'], "Misses": row['misses'],
+                 "Hit rate": f"{row['hit_rate']:.0%}" if row['hit_rate'] is not None else "-"}
+                for row in snapshot['caches']
+            ], use_container_width=True, hide_index=True)
+        col_json, col_prom = st.columns(2)
+        with col_json:
+            st.download_button("JSON", tracing.to_json(), file_name="oura-metrics.json",
+                               mime="application/json", use_container_width=True)
+        with col_prom:
+            st.download_button("Prometheus", tracing.to_prometheus(), file_name="oura-metrics.prom",
+                               mime="text/plain", use_container_width=True)
+        if st.button("Reset timings", use_container_width=True):
+            tracing.reset()
+            st.rerun()
+
+if tracing.ENABLED:
+    render_tracing_panel()
@@ -1,32 +1,259 @@
-import json
-import os
+import threading
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime, timedelta
+from storage_backends import StorageBackend, WriteBehindBackend, make_backend
+import tracing
+
+def _same_entry(old, new):
+    """True if two entries hold the same data, ignoring when they were written"""
+    return old is not None and all(
+        old.get(key) == value for key, value in new.items() if key != 'timestamp'
+    )
 
 class HealthDataStorage:
-    """Store and retrieve historical health data and tags"""
+    """
+    Store and retrieve historical health data and tags
+    
+    One instance can be shared by many threads (e.g. every Streamlit
+    session): writes and the lazily built views are guarded by a lock.
+    Several processes can share one store too: writes are validated
+    against what else was committed since this copy was loaded (see
+    _write), so they never overwrite each other with stale data.
+    """
     
-    def __init__(self, filename='health_data.json'):
+    def __init__(self, filename='health_data.json', backend='sqlite', write_behind=False):
+        """
+        Args:
+            filename (str): Legacy JSON file; other backends are stored next
+                to it (health_data.db, health_data.jsonl) and import it once
+            backend: 'sqlite', 'journal', 'json' or a StorageBackend instance
+            write_behind (bool): Buffer writes and flush them in the
+                background instead of writing on the caller's thread
+        """
         self.filename = filename
-        self.data = self._load_data()
+        if isinstance(backend, StorageBackend):
+            self.backend = backend
+        else:
+            self.backend = make_backend(backend, filename)
+        if write_behind and not isinstance(self.backend, WriteBehindBackend):
+            self.backend = WriteBehindBackend(self.backend)
+        self._lock = threading.RLock()
+        self.version = 0
+        self.reload()
+    
+    def reload(self):
+        """Re-read everything from the backend and drop the derived views"""
+        with self._lock, tracing.span('storage.reload'):
+            self._fingerprint = self.backend.fingerprint()
+            data = self._load_data()
+            index = self._build_index(data['daily_entries'])
+            self._columns = None
+            self._aggregates = None
+            self._rollups = None
+            self._tag_analyzer = None
+            self.data = data
+            # One assignment, so lock-free readers see the old index or the new one
+            self._index = index
+            self.version += 1
+    
+    def reload_if_changed(self):
+        """
+        Reload if the backend was written by someone else (another process
+        or storage instance) since this copy was loaded
+        
+        Returns:
+            bool: True if the data was reloaded
+        """
+        fingerprint = self.backend.fingerprint()
+        if fingerprint is None or fingerprint == self._fingerprint:
+            return False
+        self.reload()
+        return True
+    
+    def _write(self, prepare):
+        """
+        Apply and commit a change with optimistic concurrency control
+        
+        prepare() looks at the in-memory copy and returns the batch to
+        write ({'entries', 'tags', 'sync_state'} keys, all optional), or
+        None if nothing would change; it must not modify anything. It
+        runs without the cross-process lock. The batch is then validated
+        under the backend's lock: if another process has committed since
+        this copy was loaded, the copy is reloaded and prepare() runs
+        again on the fresh data before anything is applied or written.
+        With write_behind the batch is only buffered here; the flush
+        repeats the check and keeps other processes' newer fields.
+        
+        Returns:
+            dict: The batch that was written, or None
+        """
+        with self._lock:
+            batch = prepare()
+            if batch is None:
+                return None
+            with self.backend.lock():
+                fingerprint = self.backend.fingerprint()
+                if fingerprint is not None and fingerprint != self._fingerprint:
+                    tracing.count('storage.write_conflicts')
+                    self.reload()
+                    batch = prepare()
+                    if batch is None:
+                        return None
+                if isinstance(self.backend, WriteBehindBackend):
+                    # What each entry was derived from, for merging at flush time
+                    batch['bases'] = {entry['date']: self.get_entry(entry['date'])
+                                      for entry in batch.get('entries', ())}
+                self._apply(batch)
+                self._commit(**batch)
+            return batch
+    
+    def _apply(self, batch):
+        """Apply a prepared batch to the in-memory copy"""
+        for entry in batch.get('entries', ()):
+            self._upsert_entry(entry)
+        if batch.get('tags'):
+            self.data['tags'].extend(batch['tags'])
+            self.version += 1
+        if batch.get('sync_state'):
+            self.data.setdefault('sync_state', {}).update(batch['sync_state'])
+    
+    def _commit(self, **changes):
+        """Write a batch to the backend, remembering it as our own change"""
+        with tracing.span('storage.commit'):
+            self.backend.commit(**changes)
+        self._fingerprint = self.backend.fingerprint()
+    
+    def flush(self):
+        """Wait until buffered writes (with write_behind) are on disk"""
+        self.backend.flush()
     
     def _load_data(self):
-        """Load existing data from JSON file"""
-        if os.path.exists(self.filename):
-            try:
-                with open(self.filename, 'r') as f:
-                    return json.load(f)
-            except:
-                return {'daily_entries': [], 'tags': []}
-        return {'daily_entries': [], 'tags': []}
-    
-    def _save_data(self):
-        """Save data to JSON file"""
-        with open(self.filename, 'w') as f:
-            json.dump(self.data, f, indent=2)
+        """Load existing data from the storage backend"""
+        try:
+            return self.backend.load()
+        except Exception as e:
+            print(f"Error loading health data: {e}")
+            return {'daily_entries': [], 'tags': [], 'sync_state': {}}
+    
+    @staticmethod
+    def _build_index(entries):
+        """
+        Index daily entries by date
+        
+        Returns:
+            tuple: (entries, positions, dates). positions maps a date
+            string to its slot in entries and dates holds the same dates in
+            sorted order, so lookups are O(1) and range queries are a binary
+            search. ISO dates sort as strings.
+        """
+        positions = {}
+        for i, entry in enumerate(entries):
+            positions[entry['date']] = i
+        return entries, positions, sorted(positions)
+    
+    def _upsert_entry(self, entry):
+        """Insert or replace an entry in the list and keep the index in sync"""
+        entries, positions, dates = self._index
+        position = positions.get(entry['date'])
+        if position is not None:
+            entries[position] = entry
+        else:
+            # Append before indexing so lock-free readers never see a dangling slot
+            entries.append(entry)
+            positions[entry['date']] = len(entries) - 1
+            insort(dates, entry['date'])
+        self._entry_changed(entry)
+    
+    def _entry_changed(self, entry):
+        """Propagate an entry change to derived views"""
+        self.version += 1
+        self._rollups = None
+        if self._columns is not None:
+            index, inserted = self._columns.upsert(entry)
+            if self._aggregates is not None:
+                self._aggregates.on_upsert(index, inserted)
+    
+    def get_columns(self):
+        """
+        Get the columnar view of all entries (built once, then kept up to date)
+        
+        Returns:
+            ColumnarSeries: datetime64 dates plus one float array per metric
+        """
+        with self._lock:
+            tracing.cache('storage.columns', self._columns is not None)
+            if self._columns is None:
+                from timeseries import ColumnarSeries
+                with tracing.span('storage.build_columns'):
+                    self._columns = ColumnarSeries(self.get_all_entries())
+            return self._columns
+    
+    def get_aggregates(self):
+        """Get the rolling-window aggregates over the columnar view"""
+        with self._lock:
+            if self._aggregates is None:
+                from rolling_aggregates import RollingAggregates
+                columns = self.get_columns()
+                with tracing.span('storage.build_aggregates'):
+                    self._aggregates = RollingAggregates(columns)
+            return self._aggregates
+    
+    def get_rollups(self):
+        """Get the multi-resolution rollups used to downsample long ranges (rebuilt after writes)"""
+        with self._lock:
+            if self._rollups is None:
+                from downsampling import RollupPyramid
+                columns = self.get_columns()
+                with tracing.span('storage.build_rollups'):
+                    self._rollups = RollupPyramid(columns)
+            return self._rollups
+    
+    @tracing.traced('storage.trend_frame')
+    def get_trend_frame(self, days, max_points):
+        """
+        Get the last N days as a DataFrame of at most max_points rows
+        
+        Periods with more days than that are served from the rollups, one
+        row per bucket of days with mean / min / max columns.
+        
+        Returns:
+            tuple: (DataFrame, calendar days per row)
+        """
+        cutoff_date = datetime.now().date() - timedelta(days=days)
+        with self._lock:
+            columns = self.get_columns()
+            lo, hi = columns.bounds(start=cutoff_date)
+            if hi - lo <= max_points:
+                return columns.frame(start=cutoff_date), 1
+            return self.get_rollups().frame(lo, hi, max_points)
+    
+    def get_recent_frame(self, days=7):
+        """Get the last N days as a DataFrame sliced from the columnar view"""
+        cutoff_date = datetime.now().date() - timedelta(days=days)
+        with self._lock:
+            return self.get_columns().frame(start=cutoff_date)
+    
+    def get_entry(self, date):
+        """Get the entry for a date, or None"""
+        entries, positions, _ = self._index
+        position = positions.get(str(date))
+        return entries[position] if position is not None else None
+    
+    def get_entries_between(self, start_date, end_date):
+        """Get entries with start_date <= date <= end_date, sorted by date"""
+        entries, positions, dates = self._index
+        lo = bisect_left(dates, str(start_date))
+        hi = bisect_right(dates, str(end_date))
+        return [entries[positions[date]] for date in dates[lo:hi]]
     
     def add_daily_entry(self, date, sleep_score, readiness_score, activity_score, 
                        heart_rate=None, hrv=None, temperature=None, total_sleep=None):
-        """Add a daily health entry"""
+        """
+        Add a daily health entry
+        
+        Returns:
+            bool: False if the stored entry already had these values (nothing written)
+        """
         # Convert 'N/A' to None for proper handling
         entry = {
             'date': str(date),
@@ -40,19 +267,64 @@ class HealthDataStorage:
             'timestamp': datetime.now().isoformat()
         }
         
-        # Check if entry for this date already exists
-        existing_index = None
-        for i, existing_entry in enumerate(self.data['daily_entries']):
-            if existing_entry['date'] == str(date):
-                existing_index = i
-                break
+        def prepare():
+            if _same_entry(self.get_entry(entry['date']), entry):
+                return None
+            return {'entries': [entry]}
         
-        if existing_index is not None:
-            self.data['daily_entries'][existing_index] = entry
-        else:
-            self.data['daily_entries'].append(entry)
+        return self._write(prepare) is not None
+    
+    def upsert_daily_fields(self, updates, sync_state=None):
+        """
+        Merge partial daily entries in one batch and save once
+        
+        Days whose fields already hold these values are skipped, and
+        nothing is written if no day or mark actually changes.
+        
+        Args:
+            updates (dict): date string -> dict of metric fields to set
+            sync_state (dict): Optional collection -> high-water mark date,
+                saved in the same write as the entries
+        
+        Returns:
+            int: Number of days that changed
+        """
+        if not updates and not sync_state:
+            return 0
+        
+        now = datetime.now().isoformat()
+        sync_state = {collection: str(last_date) for collection, last_date in (sync_state or {}).items()}
+        
+        def prepare():
+            changed = []
+            for date, fields in updates.items():
+                existing = self.get_entry(date)
+                if _same_entry(existing, fields):
+                    continue
+                entry = existing or {
+                    'date': str(date),
+                    'sleep_score': 0,
+                    'readiness_score': 0,
+                    'activity_score': 0,
+                    'heart_rate': None,
+                    'hrv': None,
+                    'temperature': None,
+                    'total_sleep': None
+                }
+                changed.append(dict(entry, **fields, timestamp=now))
+            
+            stored_state = self.data.get('sync_state', {})
+            marks = {c: d for c, d in sync_state.items() if stored_state.get(c) != d}
+            if not changed and not marks:
+                return None
+            return {'entries': changed, 'sync_state': marks}
         
-        self._save_data()
+        batch = self._write(prepare)
+        return len(batch['entries']) if batch else 0
+    
+    def get_sync_state(self, collection):
+        """Get the sync high-water mark (last finalized date) for a collection"""
+        return self.data.get('sync_state', {}).get(collection)
     
     def add_tag(self, date, tag_name, tag_category='stress', impact='neutral', notes=''):
         """Add a tag/event for tracking experiments"""
@@ -64,27 +336,22 @@ class HealthDataStorage:
             'notes': notes,
             'timestamp': datetime.now().isoformat()
         }
-        self.data['tags'].append(tag)
-        self._save_data()
+        self._write(lambda: {'tags': [tag]})
         return True
     
     def get_recent_entries(self, days=7):
         """Get entries from the last N days"""
-        if not self.data['daily_entries']:
-            return []
-        
         today = datetime.now().date()
         cutoff_date = today - timedelta(days=days)
         
-        recent = [
-            entry for entry in self.data['daily_entries']
-            if datetime.fromisoformat(entry['date']).date() >= cutoff_date
-        ]
-        return sorted(recent, key=lambda x: x['date'])
+        entries, positions, dates = self._index
+        start = bisect_left(dates, str(cutoff_date))
+        return [entries[positions[date]] for date in dates[start:]]
     
     def get_all_entries(self):
         """Get all daily entries"""
-        return sorted(self.data['daily_entries'], key=lambda x: x['date'])
+        entries, positions, dates = self._index
+        return [entries[positions[date]] for date in dates]
     
     def get_tags_by_date_range(self, days=30):
         """Get tags from the last N days"""
@@ -106,49 +373,73 @@ class HealthDataStorage:
     
     def get_weekly_summary(self):
         """Calculate weekly averages and insights"""
-        recent = self.get_recent_entries(7)
-        if not recent:
-            return None
-        
-        valid_sleep = [e['sleep_score'] for e in recent if e['sleep_score'] and e['sleep_score'] > 0]
-        valid_readiness = [e['readiness_score'] for e in recent if e['readiness_score'] and e['readiness_score'] > 0]
-        valid_activity = [e['activity_score'] for e in recent if e['activity_score'] and e['activity_score'] > 0]
-        valid_hours = [e['total_sleep'] for e in recent if e['total_sleep'] and e['total_sleep'] > 0]
-        
-        return {
-            'sleep_avg': round(sum(valid_sleep) / len(valid_sleep)) if valid_sleep else 0,
-            'readiness_avg': round(sum(valid_readiness) / len(valid_readiness)) if valid_readiness else 0,
-            'activity_avg': round(sum(valid_activity) / len(valid_activity)) if valid_activity else 0,
-            'avg_sleep_hours': round(sum(valid_hours) / len(valid_hours), 1) if valid_hours else 0,
-            'best_day': max(recent, key=lambda x: x['readiness_score'] if x['readiness_score'] else 0) if recent else None,
-            'worst_day': min(recent, key=lambda x: x['readiness_score'] if x['readiness_score'] else 100) if recent else None,
-            'total_days': len(recent)
-        }
+        return self.get_window_summary(7)
     
+    @tracing.traced('storage.window_summary')
+    def get_window_summary(self, days):
+        """
+        Averages, best and worst day for the last N days
+        
+        Served from the rolling aggregates, so any window is a constant-time
+        lookup after a binary search for its first day.
+        """
+        cutoff_date = datetime.now().date() - timedelta(days=days)
+        with self._lock:
+            columns = self.get_columns()
+            lo, hi = columns.bounds(start=cutoff_date)
+            if hi <= lo:
+                return None
+            
+            aggregates = self.get_aggregates()
+            sleep = aggregates.window('sleep_score', lo, hi)
+            readiness = aggregates.window('readiness_score', lo, hi)
+            activity = aggregates.window('activity_score', lo, hi)
+            hours = aggregates.window('total_sleep', lo, hi)
+            
+            return {
+                'sleep_avg': round(sleep['mean']) if sleep['count'] else 0,
+                'readiness_avg': round(readiness['mean']) if readiness['count'] else 0,
+                'activity_avg': round(activity['mean']) if activity['count'] else 0,
+                'avg_sleep_hours': round(hours['mean'], 1) if hours['count'] else 0,
+                'best_day': self.get_entry(columns.dates[readiness['argmax']]),
+                'worst_day': self.get_entry(columns.dates[readiness['argmin']]),
+                'total_days': hi - lo
+            }
+    
+    @tracing.traced('storage.analyze_tag_impact')
     def analyze_tag_impact(self, tag_category=None):
         """Analyze how tags correlate with next-day readiness"""
         results = []
         
         for tag in self.data['tags']:
-            tag_date = datetime.fromisoformat(tag['date']).date()
-            next_day = tag_date + timedelta(days=1)
+            if tag_category is not None and tag['tag_category'] != tag_category:
+                continue
             
             # Find readiness score for next day
-            next_day_entry = None
-            for entry in self.data['daily_entries']:
-                entry_date = datetime.fromisoformat(entry['date']).date()
-                if entry_date == next_day:
-                    next_day_entry = entry
-                    break
+            next_day = datetime.fromisoformat(tag['date']).date() + timedelta(days=1)
+            next_day_entry = self.get_entry(next_day)
             
             if next_day_entry and next_day_entry['readiness_score']:
-                if tag_category is None or tag['tag_category'] == tag_category:
-                    results.append({
-                        'tag': tag['tag_name'],
-                        'category': tag['tag_category'],
-                        'date': tag['date'],
-                        'next_day_readiness': next_day_entry['readiness_score'],
-                        'next_day_sleep': next_day_entry['sleep_score']
-                    })
+                results.append({
+                    'tag': tag['tag_name'],
+                    'category': tag['tag_category'],
+                    'date': tag['date'],
+                    'next_day_readiness': next_day_entry['readiness_score'],
+                    'next_day_sleep': next_day_entry['sleep_score']
+                })
         
         return results
+    
+    @tracing.traced('storage.tag_impact')
+    def get_tag_impact(self, metric='readiness_score', window_days=1, baseline_days=28, tag_category=None):
+        """
+        Per-tag change in a metric over the following days versus a rolling
+        personal baseline, with bootstrap confidence intervals
+        
+        Results are cached until the next entry or tag is written.
+        """
+        with self._lock:
+            if self._tag_analyzer is None:
+                from tag_analytics import TagImpactAnalyzer
+                self._tag_analyzer = TagImpactAnalyzer(self)
+            return self._tag_analyzer.analyze(metric, window_days, baseline_days, tag_category)
@@ -0,0 +1,105 @@
+"""
+Persistent key/value cache backed by SQLite
+
+Used to keep API responses across reruns and restarts. Each row stores
+the value, an absolute expiry time and, for HTTP responses, the ETag /
+Last-Modified validators needed for conditional requests. Expired rows
+are kept (not returned as fresh) so they can still be revalidated.
+With max_entries set, the least recently used rows are evicted.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class DiskCache:
+    """SQLite-backed cache safe to share between threads"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            expires_at REAL NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            stored_at REAL NOT NULL,
+            last_access REAL NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access);
+    """
+
+    def __init__(self, filename, max_entries=None):
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.filename = filename
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(self.SCHEMA)
+
+    def get(self, key):
+        """
+        Look up a key, fresh or not
+
+        Returns:
+            dict: value, expires_at, etag, last_modified and fresh,
+            or None if the key is not cached
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at, etag, last_modified FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and self.max_entries:
+                with self._conn:
+                    self._conn.execute('UPDATE cache SET last_access = ? WHERE key = ?',
+                                       (time.time(), key))
+        if row is None:
+            return None
+        value, expires_at, etag, last_modified = row
+        return {
+            'value': value,
+            'expires_at': expires_at,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': expires_at > time.time(),
+        }
+
+    def set(self, key, value, expires_at, etag=None, last_modified=None):
+        """Store a value until expires_at (epoch seconds)"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache '
+                '(key, value, expires_at, etag, last_modified, stored_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, value, expires_at, etag, last_modified, now, now)
+            )
+            if self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM cache WHERE key IN ('
+                    'SELECT key FROM cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,)
+                )
+
+    def touch(self, key, expires_at):
+        """Extend a key's expiry, e.g. after a 304 Not Modified"""
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE cache SET expires_at = ? WHERE key = ?', (expires_at, key))
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM cache')
+
+    def purge_expired(self, older_than=0):
+        """Drop rows that expired more than older_than seconds ago"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM cache WHERE expires_at < ?', (time.time() - older_than,))
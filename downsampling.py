@@ -0,0 +1,160 @@
+"""
+Downsampling for long-range charts
+
+Plotting every point of a multi-year history makes the browser payload
+grow without bound. RollupPyramid precomputes per-metric sum / count /
+min / max over buckets of 1, 2, 4, 8, ... consecutive days, so any date
+range can be served at the finest resolution that fits a point budget
+by slicing one level instead of re-aggregating the raw series.
+minmax_indices thins a dense series (e.g. intraday heart rate) while
+keeping its peaks and troughs.
+"""
+
+import numpy as np
+import pandas as pd
+
+from timeseries import METRICS, valid_mask
+
+
+def minmax_indices(values, n_buckets):
+    """
+    Indices of the minimum and maximum of each of n_buckets equal-count
+    buckets, in ascending order (at most 2 * n_buckets points)
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    starts = edges[:-1]
+    # Pad to a rectangle so every bucket is reduced in one call
+    width = int(np.max(np.diff(edges)))
+    offsets = starts[:, None] + np.arange(width)[None, :]
+    inside = offsets < edges[1:, None]
+    offsets = np.minimum(offsets, n - 1)
+    window = values[offsets]
+    lows = starts + np.argmin(np.where(inside, window, np.inf), axis=1)
+    highs = starts + np.argmax(np.where(inside, window, -np.inf), axis=1)
+    return np.unique(np.concatenate([lows, highs]))
+
+
+class RollupPyramid:
+    """
+    Mean/min/max rollups of the columnar series at power-of-two bucket sizes
+
+    Level k aggregates runs of base**k consecutive rows. Like the rolling
+    aggregates, only valid values (see timeseries.valid_mask) count
+    towards a bucket.
+    """
+
+    def __init__(self, columns, metrics=METRICS, base=2):
+        self.base = base
+        self.metrics = metrics
+        days = columns.dates.astype('int64').astype(float)
+        level = {'x_sum': days, 'rows': np.ones(len(days))}
+        for metric in metrics:
+            values = columns.column(metric)
+            valid = valid_mask(metric, values)
+            level[metric] = (
+                np.where(valid, values, 0.0),
+                valid.astype(float),
+                np.where(valid, values, np.inf),
+                np.where(valid, values, -np.inf),
+            )
+        self.levels = [level]
+        while len(level['rows']) > 1:
+            level = self._coarsen(level)
+            self.levels.append(level)
+
+    def _coarsen(self, level):
+        n = len(level['rows'])
+        padded = -(-n // self.base) * self.base
+
+        def fold(array, reduce, fill):
+            out = np.full(padded, fill)
+            out[:n] = array
+            return reduce(out.reshape(-1, self.base), axis=1)
+
+        coarse = {
+            'x_sum': fold(level['x_sum'], np.sum, 0.0),
+            'rows': fold(level['rows'], np.sum, 0.0),
+        }
+        for metric in self.metrics:
+            sums, counts, lows, highs = level[metric]
+            coarse[metric] = (
+                fold(sums, np.sum, 0.0),
+                fold(counts, np.sum, 0.0),
+                fold(lows, np.min, np.inf),
+                fold(highs, np.max, -np.inf),
+            )
+        return coarse
+
+    def select(self, lo, hi, max_points):
+        """Finest level whose buckets overlapping rows [lo, hi) number at most max_points"""
+        for k in range(len(self.levels)):
+            size = self.base ** k
+            if -(-hi // size) - lo // size <= max_points:
+                return k
+        return len(self.levels) - 1
+
+    def _clipped(self, k, lo, hi):
+        """
+        Level k's buckets over rows [lo, hi), with the buckets at either end
+        clipped to the range so they never take in rows outside it
+        """
+        size = self.base ** k
+        base, level = self.levels[0], self.levels[k]
+        # Whole buckets come from level k, the partial ones are reduced from the rows
+        first, end = -(-lo // size), hi // size
+        head_end = min(first * size, hi)
+        tail_start = max(end * size, head_end)
+
+        def join(key, reduce, i=None):
+            rows, buckets = base[key], level[key]
+            if i is not None:
+                rows, buckets = rows[i], buckets[i]
+            parts = [buckets[first:end]]
+            if lo < head_end:
+                parts.insert(0, [reduce(rows[lo:head_end])])
+            if tail_start < hi:
+                parts.append([reduce(rows[tail_start:hi])])
+            return np.concatenate(parts)
+
+        clipped = {'x_sum': join('x_sum', np.sum), 'rows': join('rows', np.sum)}
+        for metric in self.metrics:
+            clipped[metric] = tuple(join(metric, reduce, i)
+                                    for i, reduce in enumerate((np.sum, np.sum, np.min, np.max)))
+        return clipped
+
+    def frame(self, lo, hi, max_points):
+        """
+        Rows [lo, hi) of the series with at most max_points rows
+
+        Each row is one bucket: 'date' is the mean date of its days and
+        each metric column is the bucket mean (NaN if it had no valid
+        value), with '<metric>_min' / '<metric>_max' alongside.
+
+        Returns:
+            tuple: (DataFrame, calendar days per row, on average; 1 if
+            rows are single days)
+        """
+        k = self.select(lo, hi, max_points)
+        level = self._clipped(k, lo, hi)
+        rows = level['rows']
+        days = np.round(level['x_sum'] / rows).astype('int64')
+        data = {'date': days.astype('datetime64[D]').astype('datetime64[ns]')}
+        for metric in self.metrics:
+            sums, counts, lows, highs = level[metric]
+            has_values = counts > 0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                data[metric] = np.where(has_values, sums / counts, np.nan)
+            data[f'{metric}_min'] = np.where(has_values, lows, np.nan)
+            data[f'{metric}_max'] = np.where(has_values, highs, np.nan)
+        return pd.DataFrame(data), self._days_per_row(k, lo, hi, len(rows))
+
+    def _days_per_row(self, k, lo, hi, n_rows):
+        """Calendar days spanned per row (more than base**k where days are missing)"""
+        if k == 0:
+            return 1
+        dates = self.levels[0]['x_sum']
+        return max(1, int(round((dates[hi - 1] - dates[lo] + 1) / n_rows)))
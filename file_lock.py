@@ -0,0 +1,40 @@
+"""
+Cross-process file locks
+
+An exclusive advisory flock on a side file (e.g. health_data.db.lock),
+held for the duration of a with block. Every process that writes the
+same token store or storage shard takes the same lock, so their
+read-check-write sequences do not interleave. Threads in one process
+need their own lock as well; flock is per open file, not per thread.
+
+With blocking=False, entering raises BlockingIOError instead of waiting
+when another holder has the lock.
+"""
+
+
+class FileLock:
+    """Advisory flock on a lock file (a no-op where fcntl is unavailable)"""
+
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self._file = None
+
+    def __enter__(self):
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        self._file = open(self.path, 'a')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BaseException:
+            self._file.close()
+            self._file = None
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,170 @@
+"""
+Intraday heart-rate store
+
+Keeps every heart-rate sample from the Oura heartrate endpoint in one
+small binary file per UTC day: a NumPy structured array of uint32
+epoch seconds and uint8 bpm (5 bytes a sample), sorted by time. Reads
+memory-map the day files, so months of samples load without any JSON
+parsing. Writers (the dashboard, sync_daemon.py and webhook_server.py
+may all write one user's files) merge under a file lock on the
+directory.
+"""
+
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from file_lock import FileLock
+
+SAMPLE_DTYPE = np.dtype([('ts', '<u4'), ('bpm', 'u1')])
+
+
+def _to_epoch(timestamp):
+    """ISO 8601 timestamp (with offset or 'Z') -> epoch seconds"""
+    parsed = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def record_to_sample(record):
+    """Oura heartrate record -> (epoch seconds, bpm) tuple, or None if incomplete"""
+    if record.get('bpm') is None or not record.get('timestamp'):
+        return None
+    return _to_epoch(record['timestamp']), min(max(int(record['bpm']), 0), 255)
+
+
+def _as_epoch(value):
+    """datetime (naive = UTC) or number -> epoch seconds"""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    return int(value)
+
+
+def _day_of(epoch_seconds):
+    """UTC day (datetime64[D]) for epoch second values"""
+    return np.asarray(epoch_seconds, dtype='datetime64[s]').astype('datetime64[D]')
+
+
+class HeartRateStore:
+    """Per-day, memory-mapped heart-rate sample files"""
+
+    def __init__(self, directory='hr_data'):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, day):
+        return os.path.join(self.directory, f"{day}.npy")
+
+    def load_day(self, day):
+        """Samples for one UTC day as a read-only memory-mapped structured array"""
+        path = self._path(str(day)[:10])
+        if not os.path.exists(path):
+            return np.empty(0, dtype=SAMPLE_DTYPE)
+        return np.load(path, mmap_mode='r')
+
+    def add_samples(self, records):
+        """
+        Merge Oura heartrate records into the day files
+
+        Args:
+            records: Dicts with 'timestamp' and 'bpm' keys
+
+        Returns:
+            int: Samples now stored for the affected days (after de-duplication)
+        """
+        samples = [record_to_sample(r) for r in records]
+        samples = np.array([s for s in samples if s is not None], dtype=SAMPLE_DTYPE)
+        return self.add_array(samples)
+
+    def add_array(self, samples):
+        """Merge a SAMPLE_DTYPE array into the day files; see add_samples"""
+        if len(samples) == 0:
+            return 0
+        days = _day_of(samples['ts'])
+        written = 0
+        # Read-merge-write per day; serialized so concurrent writers (threads
+        # and other processes) don't drop samples
+        with self._lock, FileLock(os.path.join(self.directory, '.lock')):
+            for day in np.unique(days):
+                merged = np.concatenate([np.asarray(self.load_day(day)), samples[days == day]])
+                # Keep the newest value for a repeated timestamp
+                _, last = np.unique(merged['ts'][::-1], return_index=True)
+                merged = merged[len(merged) - 1 - last]
+                self._write_day(day, merged)
+                written += len(merged)
+        return written
+
+    def _write_day(self, day, samples):
+        path = self._path(day)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(samples, dtype=SAMPLE_DTYPE))
+        os.replace(tmp_path, path)
+
+    def day_version(self, day):
+        """Modification time of a day's file (0 if it has no samples); changes on every write"""
+        try:
+            return os.stat(self._path(str(day)[:10])).st_mtime_ns
+        except OSError:
+            return 0
+    
+    def get_samples(self, start, end):
+        """
+        Samples with start <= time < end
+
+        Args:
+            start, end: datetime (naive = UTC) or epoch seconds
+
+        Returns:
+            tuple: (epoch seconds uint32 array, bpm uint8 array)
+        """
+        start_ts, end_ts = _as_epoch(start), _as_epoch(end)
+        first_day, last_day = _day_of([start_ts, end_ts - 1])
+        chunks = []
+        day = first_day
+        while day <= last_day:
+            samples = self.load_day(day)
+            if len(samples):
+                ts = samples['ts']
+                lo, hi = np.searchsorted(ts, [start_ts, end_ts])
+                chunks.append(samples[lo:hi])
+            day += np.timedelta64(1, 'D')
+        if not chunks:
+            return np.empty(0, dtype='<u4'), np.empty(0, dtype='u1')
+        merged = np.concatenate(chunks)
+        return merged['ts'], merged['bpm']
+
+    def get_day_frame(self, day):
+        """One UTC day of samples as a DataFrame with 'time' and 'bpm' columns"""
+        import pandas as pd
+        samples = self.load_day(day)
+        return pd.DataFrame({
+            'time': pd.to_datetime(np.asarray(samples['ts'], dtype='int64'), unit='s', utc=True),
+            'bpm': np.asarray(samples['bpm']),
+        })
+
+    def resting_heart_rate(self, day, window=6):
+        """
+        Resting HR for a UTC day: the lowest rolling mean over `window`
+        consecutive samples (6 samples ~ 30 minutes at 5-minute sampling)
+
+        Returns:
+            float or None if the day has too few samples
+        """
+        bpm = np.asarray(self.load_day(day)['bpm'], dtype=float)
+        if len(bpm) < window:
+            return None
+        sums = np.cumsum(np.concatenate(([0.0], bpm)))
+        rolling = (sums[window:] - sums[:-window]) / window
+        return round(float(rolling.min()), 1)
+
+    def days(self):
+        """Sorted list of days that have samples"""
+        return sorted(name[:-4] for name in os.listdir(self.directory) if name.endswith('.npy'))
+
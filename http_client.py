@@ -0,0 +1,211 @@
+"""
+Shared HTTP client for all outbound API calls
+
+Oura and Perplexity requests go through one keep-alive session, so
+connections (and TLS handshakes) are reused across calls, threads and
+Streamlit sessions. Every request first takes a token from a per-host
+rate limiter, and failures that are worth retrying (429, 5xx, dropped
+connections) are retried with jittered exponential backoff. POSTs are
+only resent when the server cannot have acted on them (a 429 or a
+connect timeout), never after a 5xx, so a refresh-token grant or a
+Perplexity completion is not sent twice. A Retry-After header from a
+429 pauses the whole host, not just the request that got it, so
+concurrent workers back off together.
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import tracing
+
+# Keep-alive connections kept open per host
+POOL_MAXSIZE = 16
+
+# Retry policy
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+MAX_BACKOFF = 30
+# A Retry-After longer than this is not waited out; the response is returned
+MAX_RETRY_AFTER = 120
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+# host -> (requests per second, burst). Oura allows 5000 requests per
+# 5 minutes; Perplexity limits are per minute and much lower.
+HOST_LIMITS = {
+    'api.ouraring.com': (15.0, 30),
+    'api.perplexity.ai': (1.0, 5),
+}
+DEFAULT_LIMIT = (10.0, 20)
+
+_session = None
+_limiters = {}
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token if one is free; otherwise return seconds to wait"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            delay = self._reserve()
+            if not delay:
+                return
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Hold every caller back for `seconds` (e.g. after a Retry-After)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+def get_session():
+    """Return the shared keep-alive session"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=len(HOST_LIMITS) + 2, pool_maxsize=POOL_MAXSIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def get_limiter(host):
+    """Return the rate limiter for a host, creating it on first use"""
+    limiter = _limiters.get(host)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(host)
+            if limiter is None:
+                limiter = TokenBucket(*HOST_LIMITS.get(host, DEFAULT_LIMIT))
+                _limiters[host] = limiter
+    return limiter
+
+
+def _retry_after(response):
+    """Seconds requested by a Retry-After header, or None"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff for the given retry number (0-based)"""
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt))
+
+
+def request(method, url, retries=MAX_RETRIES, deadline=None, **kwargs):
+    """
+    Send a request through the shared session with rate limiting and retries
+
+    Args:
+        method (str): HTTP method
+        url (str): Full URL
+        retries (int): Retries allowed after the first attempt
+        deadline (float): time.monotonic() value after which no retry
+            starts; the last response (or error) is returned instead of
+            waiting out a backoff or Retry-After that would pass it
+        **kwargs: Passed to requests.Session.request (params, json,
+            headers, timeout, stream, ...)
+
+    Returns:
+        requests.Response: The final response, which may still be an
+        error status once retries are used up
+
+    Raises:
+        requests.exceptions.RequestException: If the last attempt failed
+        to get a response at all
+    """
+    method = method.upper()
+    host = urlsplit(url).hostname
+    limiter = get_limiter(host)
+    attempt = 0
+    while True:
+        if attempt:
+            tracing.count('http.retries', host=host)
+        with tracing.span('http.limiter_wait', host=host):
+            limiter.acquire()
+        try:
+            # Up to the response headers; streamed bodies are read later
+            with tracing.span('http.request', host=host, method=method):
+                response = get_session().request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            # A connect timeout never reached the server, so it is safe to
+            # resend anything; other failures only for idempotent methods
+            retryable = isinstance(e, requests.exceptions.ConnectTimeout) or (
+                method in IDEMPOTENT_METHODS
+                and isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+            )
+            if not retryable or attempt >= retries:
+                raise
+            delay = _backoff(attempt)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise
+        else:
+            tracing.count('http.responses', host=host, status=response.status_code)
+            # A 5xx may come after the server already acted on the request,
+            # so only a 429 (which it refused) is resent for other methods
+            retryable = response.status_code in RETRY_STATUSES and (
+                method in IDEMPOTENT_METHODS or response.status_code == 429)
+            if not retryable or attempt >= retries:
+                return response
+            delay = _retry_after(response)
+            if delay is None:
+                delay = _backoff(attempt)
+            elif delay > MAX_RETRY_AFTER:
+                return response
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                return response
+            if response.status_code == 429:
+                limiter.pause(delay)
+            response.close()
+        attempt += 1
+        time.sleep(delay)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
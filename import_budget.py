@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for the dashboard's cold start
+
+Each stage runs in a fresh interpreter, so nothing is already cached in
+sys.modules:
+
+- login: dashboard.py up to the password check (st.stop is patched to
+  end the run there), measured against rendering the bare password
+  screen, so only what the dashboard adds in front of the gate counts.
+- first_paint: the modules dashboard.py imports right after login,
+  before any tab is drawn.
+
+Modules that `import streamlit` already loads (it pulls in parts of
+plotly, for one) are not counted. A stage fails if it exceeds its
+budget or newly loads one of its forbidden (heavy or deferred) modules.
+
+Usage:
+    python import_budget.py          # exits 1 if a budget is blown
+    python import_budget.py --json
+    python import_budget.py --no-timing   # forbidden modules only (noisy machines)
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Milliseconds (best of REPEAT runs); login is on top of the bare password
+# screen, first_paint on top of `import streamlit`
+BUDGETS_MS = {
+    'login': 50,
+    'first_paint': 400,
+}
+
+FORBIDDEN = {
+    'login': ['pandas', 'numpy', 'plotly.graph_objects', 'requests', 'dotenv', 'webbrowser',
+              'http.server', 'oura_auth', 'perplexity_integration', 'data_storage', 'hr_store'],
+    'first_paint': ['plotly.graph_objects', 'pandas', 'perplexity_integration', 'webbrowser',
+                    'http.server'],
+}
+
+REPEAT = 3
+
+FIRST_PAINT_MODULES = ['dotenv', 'oura_auth', 'data_storage', 'ai_jobs', 'tracing', 'user_shards', 'sync_daemon', 'hr_store']
+
+# Runs inside the child interpreter; prints one JSON line
+_PROBE = r'''
+import json, runpy, sys, time
+sys.path.insert(0, {here!r})
+import streamlit as st
+preloaded = set(sys.modules)
+stage = {stage!r}
+start = time.perf_counter()
+if stage == 'password_screen':
+    from auth_config import check_password
+    st.session_state.password_correct = False  # as dashboard.py initializes it
+    check_password()
+    reached = True
+elif stage == 'login':
+    class _Gate(BaseException):
+        pass
+    def _stop():
+        raise _Gate
+    st.stop = _stop
+    try:
+        runpy.run_path({dashboard!r}, run_name='__main__')
+        reached = False
+    except _Gate:
+        reached = True
+else:
+    import importlib
+    for name in {modules!r}:
+        importlib.import_module(name)
+    reached = True
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{'ms': elapsed, 'reached': reached, 'modules': sorted(set(sys.modules) - preloaded)}}))
+'''
+
+
+def _probe(stage):
+    """Run one stage in a fresh interpreter and return its probe result"""
+    code = _PROBE.format(here=HERE, stage=stage, dashboard=os.path.join(HERE, 'dashboard.py'),
+                         modules=FIRST_PAINT_MODULES)
+    env = dict(os.environ, STREAMLIT_SERVER_HEADLESS='true')
+    result = subprocess.run([sys.executable, '-c', code], cwd=HERE, env=env,
+                            capture_output=True, text=True, timeout=120)
+    lines = [line for line in result.stdout.splitlines() if line.startswith('{')]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"{stage} probe failed:\n{result.stderr[-2000:]}")
+    return json.loads(lines[-1])
+
+
+def measure(stage, repeat=REPEAT):
+    """Fastest of `repeat` fresh-interpreter runs of a stage"""
+    return min((_probe(stage) for _ in range(repeat)), key=lambda result: result['ms'])
+
+
+def check(stage, result, timing=True):
+    """List of problems with a stage result (empty if within budget; timing=False skips the time check)"""
+    problems = []
+    if not result['reached']:
+        problems.append("the run never reached the login gate")
+    if timing and result['ms'] > BUDGETS_MS[stage]:
+        problems.append(f"{result['ms']:.0f} ms is over the {BUDGETS_MS[stage]} ms budget")
+    loaded = set(result['modules'])
+    heavy = [name for name in FORBIDDEN[stage] if name in loaded]
+    if heavy:
+        problems.append(f"loads {', '.join(heavy)}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    parser.add_argument('--no-timing', action='store_true',
+                        help='Report times without failing on them; only forbidden modules fail')
+    args = parser.parse_args()
+
+    report = {}
+    failed = False
+    baseline = measure('password_screen')['ms']
+    for stage in BUDGETS_MS:
+        result = measure(stage)
+        if stage == 'login':
+            result['ms'] = max(0.0, result['ms'] - baseline)
+        problems = check(stage, result, timing=not args.no_timing)
+        failed = failed or bool(problems)
+        report[stage] = {'ms': round(result['ms'], 1), 'budget_ms': BUDGETS_MS[stage], 'problems': problems}
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for stage, row in report.items():
+            status = 'FAIL' if row['problems'] else 'ok'
+            print(f"{stage:12} {row['ms']:8.1f} ms / {row['budget_ms']} ms  {status}")
+            for problem in row['problems']:
+                print(f"    - {problem}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
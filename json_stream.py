@@ -0,0 +1,113 @@
+"""
+Incremental JSON parsing for large API responses
+
+Oura list endpoints return {"data": [...], "next_token": ...}. For long
+date ranges (months of 5-minute heart-rate samples) the "data" array is
+large, so instead of materializing the whole body this parser walks the
+top-level object as text chunks arrive and yields the array elements
+one at a time. Only the current record and one chunk are held in memory.
+"""
+
+import codecs
+import json
+
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = '0123456789.eE+-'
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """Text buffer over an iterator of byte chunks"""
+
+    def __init__(self, byte_chunks):
+        self._chunks = iter(byte_chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read another chunk; returns False at end of stream"""
+        while not self.eof:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.eof = True
+                text = self._utf8.decode(b'', final=True)
+            elif isinstance(chunk, str):
+                text = chunk
+            else:
+                text = self._utf8.decode(chunk)
+            if text:
+                self.buf = self.buf[self.pos:] + text
+                self.pos = 0
+                return True
+        return False
+
+    def peek(self):
+        """Next non-whitespace character (not consumed), or '' at end"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise json.JSONDecodeError(f"Expected one of {chars!r}", self.buf, self.pos)
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number that runs up to the end of the buffer ("12", "1.", "3e")
+            # may continue in the next chunk
+            if (isinstance(value, (int, float)) and not self.eof
+                    and self.buf[end:].strip(_NUMBER_CHARS) == '' and self.fill()):
+                continue
+            self.pos = end
+            return value
+
+
+def iter_array_items(byte_chunks, array_key='data', extras=None):
+    """
+    Yield the elements of one top-level array from a streamed JSON object
+
+    Args:
+        byte_chunks: Iterable of bytes (or str) making up the JSON body
+        array_key (str): Top-level key whose array elements are yielded
+        extras (dict): If given, receives every other top-level key/value
+            (e.g. next_token) once the stream has been consumed
+    """
+    reader = _Reader(byte_chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == array_key and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        else:
+            value = reader.value()
+            if extras is not None:
+                extras[key] = value
+        if reader.expect(',}') == '}':
+            return
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""
+Local stand-in servers for development and testing
+
+FakePerplexityServer answers chat completion requests like the
+Perplexity API, including the server-sent events streaming mode, with
+a configurable per-token delay. FakeOuraServer serves the v2
+usercollection endpoints with deterministic synthetic records, paging
+and an injected per-request latency, plus webhook subscriptions it can
+notify of changed documents. post_webhook_event posts a single event to
+a receiver on its own. No API key or network access needed.
+
+Usage:
+    python mock_servers.py perplexity --port 8765
+    PERPLEXITY_BASE_URL=http://localhost:8765/chat/completions streamlit run dashboard.py
+
+    python mock_servers.py oura --port 8766 --latency 0.1
+    OURA_BASE_URL=http://localhost:8766/v2/usercollection streamlit run dashboard.py
+
+    python mock_servers.py webhook --callback http://localhost:8090/ --user-id <oura user id>
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+
+class _LocalServer:
+    """Run a handler class on a background thread; usable as a context manager"""
+
+    handler_class = None
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class)
+        self.httpd.owner = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _PerplexityHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server.owner
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        server.requests.append(payload)
+        tokens = server.answer_tokens(payload)
+
+        if server.first_token_delay:
+            time.sleep(server.first_token_delay)
+
+        if not payload.get('stream'):
+            time.sleep(server.token_delay * len(tokens))
+            body = json.dumps({
+                'model': payload.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)}}],
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            if i == server.disconnect_after:
+                # Drop the connection mid-body, as a proxy timeout would
+                self.close_connection = True
+                return
+            event = {'choices': [{'index': 0, 'delta': {'content': token}}]}
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+            time.sleep(server.token_delay)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakePerplexityServer(_LocalServer):
+    """
+    Fake Perplexity chat completions endpoint
+
+    Args:
+        answer (str): Text to answer with; split into word tokens
+        token_delay (float): Seconds between streamed tokens
+        first_token_delay (float): Seconds before the first token
+        disconnect_after (int): Close a stream after this many tokens,
+            without finishing the body; None to always finish
+    """
+
+    handler_class = _PerplexityHandler
+
+    def __init__(self, answer=None, token_delay=0.02, first_token_delay=0.0, disconnect_after=None, **kwargs):
+        super().__init__(**kwargs)
+        self.answer = answer
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.disconnect_after = disconnect_after
+        self.requests = []
+
+    @property
+    def completions_url(self):
+        return f"{self.url}/chat/completions"
+
+    def answer_tokens(self, payload):
+        answer = self.answer
+        if answer is None:
+            question = payload.get('messages', [{}])[-1].get('content', '')
+            answer = f"This is a local test answer to: {question}"
+        words = answer.split(' ')
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+
+class _OuraHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server.owner
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        server.requests.append((url.path, query))
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if url.path == server.SUBSCRIPTION_PATH:
+            if self._client_secret() is not None:
+                self._send_json(200, list(server.subscriptions))
+            return
+
+        prefix = '/v2/usercollection/'
+        collection = url.path[len(prefix):] if url.path.startswith(prefix) else None
+        collection, _, object_id = (collection or '').partition('/')
+        authorization = self.headers.get('Authorization', '')
+        if not authorization.startswith('Bearer '):
+            self._send_json(401, {'detail': 'Missing bearer token'})
+        elif collection == 'personal_info':
+            self._send_json(200, server.personal_info(authorization[len('Bearer '):]))
+        elif collection not in server.COLLECTIONS:
+            self._send_json(404, {'detail': 'Not found'})
+        elif object_id:
+            record = server.document(collection, object_id)
+            if record is None:
+                self._send_json(404, {'detail': 'Document not found'})
+            else:
+                self._send_json(200, record)
+        else:
+            try:
+                self._send_json(200, server.page(collection, query))
+            except ValueError as e:
+                self._send_json(400, {'detail': str(e)})
+
+    def do_POST(self):
+        server = self.server.owner
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        server.requests.append((self.path, payload))
+        if self.path != server.SUBSCRIPTION_PATH:
+            self._send_json(404, {'detail': 'Not found'})
+            return
+        secret = self._client_secret()
+        if secret is None:
+            return
+        try:
+            subscription = server.subscribe(payload, secret)
+        except ValueError as e:
+            self._send_json(422, {'detail': str(e)})
+            return
+        self._send_json(201, {key: value for key, value in subscription.items() if key != 'secret'})
+
+    def _client_secret(self):
+        """The caller's client secret, or None after answering 401"""
+        secret = self.headers.get('x-client-secret')
+        if not self.headers.get('x-client-id') or not secret:
+            self._send_json(401, {'detail': 'Missing client credentials'})
+            return None
+        return secret
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def post_webhook_event(callback_url, event, secret=None, timeout=10):
+    """
+    POST one Oura webhook event to a receiver, signed like Oura signs them
+
+    Args:
+        event (dict): event_type, data_type, object_id and user_id
+        secret (str): Signs the request (x-oura-timestamp / x-oura-signature)
+
+    Returns:
+        (int, dict): Status code and JSON body of the response
+    """
+    body = json.dumps(event).encode()
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        timestamp = str(int(time.time()))
+        headers['x-oura-timestamp'] = timestamp
+        headers['x-oura-signature'] = hmac.new(secret.encode(), timestamp.encode() + body,
+                                               hashlib.sha256).hexdigest().upper()
+    request = Request(callback_url, data=body, headers=headers, method='POST')
+    return _open_json(request, timeout)
+
+
+def _open_json(request, timeout):
+    from urllib.error import HTTPError
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b'null')
+    except HTTPError as e:
+        body = e.read()
+        try:
+            return e.code, json.loads(body or b'null')
+        except ValueError:
+            return e.code, None
+
+
+class FakeOuraServer(_LocalServer):
+    """
+    Fake Oura v2 usercollection API
+
+    Records are generated from the requested date range with a seeded
+    random generator, so the same query always returns the same data.
+    Any bearer token is accepted; personal_info reports a user id derived
+    from the token unless `users` maps it to one. set_record() changes a
+    day's document, and notify() posts the matching event to every
+    webhook subscription, which is verified with the GET challenge when
+    it is created, as Oura does.
+
+    Args:
+        latency (float): Seconds to wait before answering each request
+        page_size (int): Records per page before a next_token is returned
+        hr_interval (int): Seconds between heart-rate samples
+        seed (int): Seed for the synthetic values
+        users (dict): access token -> user id for personal_info
+    """
+
+    handler_class = _OuraHandler
+
+    COLLECTIONS = ('daily_sleep', 'daily_readiness', 'daily_activity', 'heartrate')
+    # Daily documents have ids like 'sleep-2024-01-31'
+    DOCUMENT_PREFIXES = {'daily_sleep': 'sleep', 'daily_readiness': 'readiness', 'daily_activity': 'activity'}
+    SUBSCRIPTION_PATH = '/v2/webhook/subscription'
+
+    def __init__(self, latency=0.0, page_size=1000, hr_interval=300, seed=0, users=None, **kwargs):
+        super().__init__(**kwargs)
+        self.users = dict(users or {})
+        self.latency = latency
+        self.page_size = page_size
+        self.hr_interval = hr_interval
+        self.seed = seed
+        self.requests = []
+        self.subscriptions = []
+        self._overrides = {}  # (collection, day) -> changed fields
+
+    @property
+    def base_url(self):
+        """Value for OURA_BASE_URL / oura_client.BASE_URL"""
+        return f"{self.url}/v2/usercollection"
+
+    def personal_info(self, access_token):
+        user_id = self.users.get(access_token) or hashlib.sha256(access_token.encode()).hexdigest()[:12]
+        return {'id': user_id, 'age': 35, 'weight': 70.0, 'height': 1.75,
+                'biological_sex': 'female', 'email': f'{user_id}@example.com'}
+
+    def _rng(self, *key):
+        return random.Random(f"{self.seed}:{':'.join(map(str, key))}")
+
+    def _daily_sleep_record(self, day):
+        rng = self._rng('sleep', day)
+        return {
+            'id': f"sleep-{day}",
+            'day': str(day),
+            'score': rng.randint(55, 95),
+            'total_sleep_duration': rng.randint(5 * 3600, 9 * 3600),
+            'average_heart_rate': round(rng.uniform(48, 65), 1),
+            'average_hrv': rng.randint(25, 90),
+        }
+
+    def _daily_readiness_record(self, day):
+        rng = self._rng('readiness', day)
+        return {
+            'id': f"readiness-{day}",
+            'day': str(day),
+            'score': rng.randint(50, 95),
+            'temperature_deviation': round(rng.uniform(-0.6, 0.6), 2),
+        }
+
+    def _daily_activity_record(self, day):
+        rng = self._rng('activity', day)
+        return {
+            'id': f"activity-{day}",
+            'day': str(day),
+            'score': rng.randint(40, 100),
+            'steps': rng.randint(2000, 16000),
+        }
+
+    def _record(self, collection, day):
+        record = getattr(self, f'_{collection}_record')(day)
+        record.update(self._overrides.get((collection, str(day)), {}))
+        return record
+
+    def set_record(self, collection, day, **fields):
+        """
+        Change fields of one day's document, e.g. set_record('daily_sleep', day, score=91)
+
+        Returns:
+            str: The document's id
+        """
+        self._overrides.setdefault((collection, str(day)), {}).update(fields)
+        return f"{self.DOCUMENT_PREFIXES[collection]}-{day}"
+
+    def document(self, collection, object_id):
+        """One daily document by id, or None if there is no such document"""
+        prefix, _, day = object_id.partition('-')
+        if self.DOCUMENT_PREFIXES.get(collection) != prefix:
+            return None
+        try:
+            return self._record(collection, date.fromisoformat(day))
+        except ValueError:
+            return None
+
+    def subscribe(self, payload, secret):
+        """
+        Register a webhook subscription after checking its callback answers
+        the verification challenge
+
+        Raises:
+            ValueError: If a field is missing or the callback fails the check
+        """
+        missing = [key for key in ('callback_url', 'verification_token', 'event_type', 'data_type')
+                   if not payload.get(key)]
+        if missing:
+            raise ValueError(f"Missing {', '.join(missing)}")
+        challenge = hashlib.sha256(f"{time.time()}:{len(self.subscriptions)}".encode()).hexdigest()[:16]
+        query = urlencode({'verification_token': payload['verification_token'], 'challenge': challenge})
+        separator = '&' if '?' in payload['callback_url'] else '?'
+        status, body = _open_json(Request(f"{payload['callback_url']}{separator}{query}"), timeout=10)
+        if status != 200 or not isinstance(body, dict) or body.get('challenge') != challenge:
+            raise ValueError(f"Callback verification failed ({status})")
+        subscription = {
+            'id': f"sub-{len(self.subscriptions) + 1}",
+            'callback_url': payload['callback_url'],
+            'event_type': payload['event_type'],
+            'data_type': payload['data_type'],
+            'expiration_time': (datetime.now() + timedelta(days=90)).isoformat(),
+            'secret': secret,
+        }
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def notify(self, event_type, collection, object_id, user_id):
+        """
+        Post an event to every subscription for it
+
+        Returns:
+            list: (status, body) of each receiver's response
+        """
+        event = {'event_type': event_type, 'data_type': collection, 'object_id': object_id,
+                 'user_id': user_id, 'event_time': datetime.now().isoformat()}
+        return [post_webhook_event(subscription['callback_url'], event, subscription['secret'])
+                for subscription in self.subscriptions
+                if (subscription['event_type'], subscription['data_type']) == (event_type, collection)]
+
+    def records(self, collection, query):
+        """All records of a collection within the query's date range"""
+        if collection == 'heartrate':
+            start = datetime.fromisoformat(query['start_datetime'])
+            end = datetime.fromisoformat(query.get('end_datetime') or datetime.now().isoformat())
+            rng = self._rng('heartrate', start.isoformat())
+            samples = []
+            moment = start
+            while moment <= end:
+                samples.append({'bpm': rng.randint(50, 120), 'source': 'awake',
+                                'timestamp': moment.isoformat() + '+00:00'})
+                moment += timedelta(seconds=self.hr_interval)
+            return samples
+
+        start = date.fromisoformat(query['start_date'])
+        end = date.fromisoformat(query.get('end_date') or str(date.today()))
+        return [self._record(collection, start + timedelta(days=i)) for i in range((end - start).days + 1)]
+
+    def page(self, collection, query):
+        """One page of records; next_token is the offset of the next page"""
+        try:
+            records = self.records(collection, query)
+            offset = int(query.get('next_token') or 0)
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"Bad query: {e}")
+        end = offset + self.page_size
+        return {
+            'data': records[offset:end],
+            'next_token': str(end) if end < len(records) else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('server', choices=['perplexity', 'oura', 'webhook'])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--token-delay', type=float, default=0.05)
+    parser.add_argument('--latency', type=float, default=0.0, help='Oura: seconds added to every request')
+    parser.add_argument('--callback', help='Webhook: receiver URL to post an event to')
+    parser.add_argument('--user-id', help='Webhook: Oura user id the event is about')
+    parser.add_argument('--data-type', default='daily_sleep', choices=list(FakeOuraServer.DOCUMENT_PREFIXES))
+    parser.add_argument('--event-type', default='update', choices=['create', 'update', 'delete'])
+    parser.add_argument('--day', default=str(date.today()), help='Webhook: day of the changed document')
+    parser.add_argument('--secret', help='Webhook: sign the event with this secret')
+    args = parser.parse_args()
+
+    if args.server == 'webhook':
+        if not args.callback or not args.user_id:
+            parser.error('webhook needs --callback and --user-id')
+        event = {'event_type': args.event_type, 'data_type': args.data_type, 'user_id': args.user_id,
+                 'object_id': f"{FakeOuraServer.DOCUMENT_PREFIXES[args.data_type]}-{args.day}",
+                 'event_time': datetime.now().isoformat()}
+        print(*post_webhook_event(args.callback, event, args.secret))
+        return
+
+    if args.server == 'oura':
+        server = FakeOuraServer(port=args.port, latency=args.latency).start()
+        print(f"Fake Oura API on {server.base_url} (Ctrl+C to stop)")
+    else:
+        server = FakePerplexityServer(port=args.port, token_delay=args.token_delay).start()
+        print(f"Fake Perplexity API on {server.completions_url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,12 +13,15 @@ IMPORTANT: Your credentials and tokens stay LOCAL.
 Never commit your .env file to GitHub!
 """
 
+import json
 import os
-import webbrowser
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+import threading
+import time
 import requests
 from dotenv import load_dotenv, set_key
+import http_client
+import tracing
+from file_lock import FileLock
 
 # Load environment variables
 load_dotenv()
@@ -31,28 +34,47 @@ REDIRECT_URI = os.getenv('REDIRECT_URI', 'http://localhost:8080')
 AUTHORIZE_URL = 'https://cloud.ouraring.com/oauth/authorize'
 TOKEN_URL = 'https://api.ouraring.com/oauth/token'
 
-class OAuthCallbackHandler(BaseHTTPRequestHandler):
-    """Handles the OAuth callback from Oura"""
+# Local token store, kept up to date as tokens are refreshed
+TOKEN_FILE = os.getenv('OURA_TOKEN_FILE', '.oura_tokens.json')
+
+# Refresh this many seconds before the access token expires
+REFRESH_MARGIN = 10 * 60
+
+# After a failed refresh, keep using the current token this long before trying again
+REFRESH_RETRY_INTERVAL = 60
+
+def _callback_handler_class():
+    """
+    Build the OAuth callback handler; http.server is only imported when the
+    interactive flow actually runs, not by the dashboard
+    """
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
     
-    def do_GET(self):
-        # Parse the authorization code from the callback URL
-        query_components = parse_qs(urlparse(self.path).query)
+    class OAuthCallbackHandler(BaseHTTPRequestHandler):
+        """Handles the OAuth callback from Oura"""
         
-        if 'code' in query_components:
-            self.server.auth_code = query_components['code'][0]
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(b'<html><body><h1>Authorization successful!</h1><p>You can close this window and return to your terminal.</p></body></html>')
-        else:
-            self.send_response(400)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(b'<html><body><h1>Authorization failed</h1><p>No authorization code received.</p></body></html>')
+        def do_GET(self):
+            # Parse the authorization code from the callback URL
+            query_components = parse_qs(urlparse(self.path).query)
+            
+            if 'code' in query_components:
+                self.server.auth_code = query_components['code'][0]
+                self.send_response(200)
+                self.send_header('Content-type', 'text/html')
+                self.end_headers()
+                self.wfile.write(b'<html><body><h1>Authorization successful!</h1><p>You can close this window and return to your terminal.</p></body></html>')
+            else:
+                self.send_response(400)
+                self.send_header('Content-type', 'text/html')
+                self.end_headers()
+                self.wfile.write(b'<html><body><h1>Authorization failed</h1><p>No authorization code received.</p></body></html>')
+        
+        def log_message(self, format, *args):
+            # Suppress log messages
+            pass
     
-    def log_message(self, format, *args):
-        # Suppress log messages
-        pass
+    return OAuthCallbackHandler
 
 def get_authorization_url():
     """Generate the OAuth authorization URL"""
@@ -76,7 +98,7 @@ def exchange_code_for_tokens(auth_code):
         'client_secret': CLIENT_SECRET
     }
     
-    response = requests.post(TOKEN_URL, data=data)
+    response = http_client.post(TOKEN_URL, data=data, timeout=30)
     
     if response.status_code == 200:
         return response.json()
@@ -101,8 +123,282 @@ def save_tokens_to_env(access_token, refresh_token):
     set_key(env_file, 'REFRESH_TOKEN', refresh_token)
     print(f"\n✓ Tokens saved to {env_file}")
 
+class TokenStore:
+    """
+    Oura tokens in a local JSON file
+    
+    Writes go through a temp file + rename with owner-only permissions,
+    so a crash mid-write never leaves a half-written token file behind.
+    """
+    
+    def __init__(self, path=TOKEN_FILE):
+        self.path = path
+    
+    def load(self):
+        """Stored tokens as a dict, or None if there are none"""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def save(self, tokens):
+        tmp_path = f"{self.path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(tokens, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+    
+    def mtime(self):
+        """Modification time of the token file, or None if it does not exist"""
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+    
+    def lock(self):
+        """Exclusive lock shared with other processes using the same store"""
+        return FileLock(f"{self.path}.lock")
+
+class TokenManager:
+    """
+    Hands out a valid Oura access token, refreshing it when needed
+    
+    Tokens come from the TokenStore, seeded on first use from
+    initial_tokens if given, else from Streamlit secrets / .env. An access
+    token within REFRESH_MARGIN of its expiry is exchanged for a new one
+    through the refresh_token grant before it is returned. One with an
+    unknown expiry (e.g. pasted into .env) is used until the API rejects
+    it with a 401; oura_client then calls token_rejected(), which
+    refreshes it. Refreshes are serialized by a thread lock plus a file
+    lock, and the store is re-read inside the lock, so concurrent callers
+    share one refresh instead of each spending the single-use refresh
+    token.
+    """
+    
+    def __init__(self, store=None, client_id=CLIENT_ID, client_secret=CLIENT_SECRET,
+                 token_url=TOKEN_URL, refresh_margin=REFRESH_MARGIN, initial_tokens=None):
+        self.store = store or TokenStore()
+        self.initial_tokens = initial_tokens
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.refresh_margin = refresh_margin
+        self._tokens = None
+        self._previous_access_token = None
+        self._loaded_mtime = None
+        self._failed_at = 0.0
+        self._lock = threading.Lock()
+    
+    def _needs_refresh(self, tokens):
+        if not tokens.get('refresh_token'):
+            return False
+        expires_at = tokens.get('expires_at')
+        return expires_at is not None and expires_at - time.time() < self.refresh_margin
+    
+    def issued(self, access_token):
+        """Whether access_token is this manager's current token, or the one its last refresh replaced"""
+        tokens = self._tokens
+        current = tokens.get('access_token') if tokens else None
+        return access_token is not None and access_token in (current, self._previous_access_token)
+    
+    def _load(self):
+        tokens = self.store.load()
+        if tokens is None:
+            tokens = self.initial_tokens or _configured_tokens()
+            if tokens:
+                self.store.save(tokens)
+        return tokens
+    
+    def get_access_token(self):
+        """
+        Return an access token that is valid for at least REFRESH_MARGIN
+        
+        Raises ValueError if there is no token and none can be obtained
+        """
+        tokens = self._tokens
+        if self.store.mtime() != self._loaded_mtime:
+            # Refreshed by another process; pick up the new pair
+            tokens = None
+        if tokens is None or (self._needs_refresh(tokens)
+                              and time.time() - self._failed_at > REFRESH_RETRY_INTERVAL):
+            tokens = self.refresh()
+        return tokens['access_token']
+    
+    def refresh(self, force=False, rejected=None):
+        """
+        Refresh the access token if it is (nearly) expired, or always with force
+        
+        Args:
+            rejected (str): An access token the API refused with a 401; it
+                is refreshed unless it has already been replaced (or a
+                refresh failed less than REFRESH_RETRY_INTERVAL ago)
+        
+        Returns:
+            dict: Current tokens
+        """
+        with self._lock, self.store.lock():
+            # Another thread or process may have refreshed while we waited
+            tokens = self._load()
+            if not tokens or not tokens.get('access_token'):
+                raise ValueError("No Oura access token found. Please run authentication first.")
+            stale = (rejected is not None and tokens['access_token'] == rejected
+                     and time.time() - self._failed_at > REFRESH_RETRY_INTERVAL)
+            if force or stale or self._needs_refresh(tokens):
+                try:
+                    tokens = self._refresh_grant(tokens)
+                    self.store.save(tokens)
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    print(f"Error refreshing Oura token: {e}")
+                    self._failed_at = time.time()
+                    expires_at = tokens.get('expires_at')
+                    if stale or (expires_at is not None and expires_at <= time.time()):
+                        raise ValueError("Oura access token expired and could not be refreshed. "
+                                         "Please run authentication again.")
+            if self._tokens and self._tokens['access_token'] != tokens['access_token']:
+                self._previous_access_token = self._tokens['access_token']
+            self._tokens = tokens
+            self._loaded_mtime = self.store.mtime()
+            return tokens
+    
+    def replace_rejected(self, access_token):
+        """
+        Refresh access_token after the API refused it, if it is still current
+        
+        Returns:
+            str: The token to retry with, or None if this manager did not
+            hand out access_token or could not replace it
+        
+        Raises ValueError if the token expired and could not be refreshed
+        """
+        # A request may still be using the token the last refresh replaced
+        if not self.issued(access_token):
+            return None
+        tokens = self.refresh(rejected=access_token)
+        return tokens['access_token'] if tokens['access_token'] != access_token else None
+    
+    def _refresh_grant(self, tokens):
+        """Exchange the refresh token for a new token pair"""
+        response = http_client.post(self.token_url, data={
+            'grant_type': 'refresh_token',
+            'refresh_token': tokens['refresh_token'],
+            'client_id': self.client_id,
+            'client_secret': self.client_secret
+        }, timeout=30)
+        if response.status_code != 200:
+            raise ValueError(f"token endpoint returned {response.status_code}: {response.text[:200]}")
+        return _token_record(response.json(), previous=tokens)
+    
+    def save_tokens(self, response_json):
+        """Store tokens from a token endpoint response (e.g. the initial code exchange)"""
+        with self._lock, self.store.lock():
+            self._tokens = _token_record(response_json)
+            self.store.save(self._tokens)
+            self._loaded_mtime = self.store.mtime()
+
+def _token_record(response_json, previous=None):
+    """Token endpoint response -> stored record with an absolute expires_at"""
+    previous = previous or {}
+    expires_in = response_json.get('expires_in')
+    return {
+        'access_token': response_json['access_token'],
+        # Keep the old refresh token if the server did not rotate it
+        'refresh_token': response_json.get('refresh_token') or previous.get('refresh_token'),
+        'expires_at': time.time() + float(expires_in) if expires_in else None,
+        'token_type': response_json.get('token_type', 'Bearer'),
+    }
+
+def _configured_value(*names):
+    """The first of the settings found in Streamlit secrets, else in .env"""
+    try:
+        import streamlit as st
+        for name in names:
+            if st.secrets.get(name):
+                return st.secrets[name]
+    except Exception:
+        pass
+    for name in names:
+        if os.getenv(name):
+            return os.getenv(name)
+    return None
+
+def _configured_tokens():
+    """Tokens from Streamlit secrets or .env, or None"""
+    access_token = _configured_value('OURA_ACCESS_TOKEN', 'ACCESS_TOKEN')
+    if not access_token:
+        return None
+    return {
+        'access_token': access_token,
+        'refresh_token': _configured_value('OURA_REFRESH_TOKEN', 'REFRESH_TOKEN'),
+        # Unknown: used until the API answers 401
+        'expires_at': None,
+        'token_type': 'Bearer',
+    }
+
+# user id -> TokenManager; None is the single-user default
+_token_managers = {}
+_token_manager_lock = threading.Lock()
+
+def get_token_manager(user_id=None, token_file=None, initial_tokens=None):
+    """
+    Return the shared TokenManager for a user
+    
+    Args:
+        user_id: Oura user id, or None for the single-user token file
+        token_file (str): Where this user's tokens are kept (TOKEN_FILE by default)
+        initial_tokens (dict): Seed for an empty token file, e.g. from the
+            user's login; only used when the manager is first created
+    """
+    manager = _token_managers.get(user_id)
+    if manager is None:
+        with _token_manager_lock:
+            manager = _token_managers.get(user_id)
+            if manager is None:
+                manager = TokenManager(TokenStore(token_file or TOKEN_FILE), initial_tokens=initial_tokens)
+                _token_managers[user_id] = manager
+    return manager
+
+def token_owner(access_token):
+    """
+    Stable id of the user an access token was issued to
+    
+    Unlike the token, it survives refreshes, so it can key caches.
+    
+    Returns:
+        str: The Oura user id of its shard ('default' for the single-user
+        token), or None if no TokenManager handed the token out
+    """
+    for user_id, manager in list(_token_managers.items()):
+        if manager.issued(access_token):
+            return 'default' if user_id is None else user_id
+    return None
+
+def token_rejected(access_token):
+    """
+    Refresh an access token the Oura API refused with a 401
+    
+    Returns:
+        str: The token to retry with, or None if it is not one of the
+        managed tokens or could not be replaced
+    """
+    for manager in list(_token_managers.values()):
+        if not manager.issued(access_token):
+            continue
+        try:
+            return manager.replace_rejected(access_token)
+        except ValueError as e:
+            print(f"Oura rejected the access token: {e}")
+            return None
+    return None
+
 def main():
     """Main OAuth flow"""
+    import webbrowser
+    from http.server import HTTPServer
+    from urllib.parse import urlparse
+    
     print("\n🔐 Oura OAuth Authentication\n")
     
     if not CLIENT_ID or not CLIENT_SECRET:
@@ -120,7 +416,7 @@ def main():
     
     # Step 2: Start local server to receive callback
     port = int(urlparse(REDIRECT_URI).port or 8080)
-    server = HTTPServer(('localhost', port), OAuthCallbackHandler)
+    server = HTTPServer(('localhost', port), _callback_handler_class())
     server.auth_code = None
     
     print(f"Waiting for authorization callback on {REDIRECT_URI}...")
@@ -141,6 +437,7 @@ def main():
                 tokens['access_token'],
                 tokens['refresh_token']
             )
+            get_token_manager().save_tokens(tokens)
             
             print("\n🎉 Authentication complete!")
             print("\nYou can now use oura_fetch_data.py to retrieve your health data.")
@@ -151,28 +448,28 @@ def main():
 
 if __name__ == '__main__':
     main()
-def get_oura_data():
+def get_access_token():
+    """
+    Return a valid Oura access token, refreshing it first if it is about to expire
+    Raises ValueError if no token is configured
+    """
+    return get_token_manager().get_access_token()
+
+@tracing.traced('oura.get_oura_data')
+def get_oura_data(access_token=None, hr_store=None):
     """
     Fetch today's health data from Oura API
     Returns a dictionary with key health metrics
+    
+    Without arguments this uses the single-user token and ./hr_data;
+    a user shard passes its own access token and HeartRateStore.
     """
-    import os
     from datetime import datetime, timedelta
     import requests
-    from dotenv import load_dotenv
-    import streamlit as st  # ADD THIS LINE
-    
-    # Load environment variables from .env
-    load_dotenv()
+    from oura_client import fetch_collections
     
-    # CHANGE THIS LINE:
-    access_token = st.secrets.get('OURA_ACCESS_TOKEN', os.getenv('OURA_ACCESS_TOKEN'))
-    if not access_token:
-        raise ValueError("OURA_ACCESS_TOKEN not found in .env file. Please run authentication first.")
-    
-    headers = {
-        'Authorization': f'Bearer {access_token}'
-    }
+    if access_token is None:
+        access_token = get_access_token()
     
     # Get date range (last 2 days to ensure we get data)
     today = datetime.now().date()
@@ -189,12 +486,24 @@ def get_oura_data():
         'total_sleep': 'N/A'
     }
     
+    date_range = {'start_date': str(two_days_ago), 'end_date': str(today)}
+    specs = {
+        'sleep': ('daily_sleep', date_range),
+        'readiness': ('daily_readiness', date_range),
+        'activity': ('daily_activity', date_range),
+        'heart_rate': ('heartrate', {
+            'start_datetime': f'{two_days_ago}T00:00:00',
+            'end_datetime': f'{today}T23:59:59'
+        }),
+    }
+    
     try:
-        # Fetch daily sleep data
-        sleep_url = f'https://api.ouraring.com/v2/usercollection/daily_sleep?start_date={two_days_ago}&end_date={today}'
-        sleep_response = requests.get(sleep_url, headers=headers)
-        if sleep_response.status_code == 200:
-            sleep_data = sleep_response.json()
+        # Fetch all four collections concurrently; a slow endpoint comes back as None
+        responses = fetch_collections(access_token, specs)
+        
+        # Daily sleep data
+        sleep_data = responses['sleep']
+        if sleep_data:
             if sleep_data.get('data') and len(sleep_data['data']) > 0:
                 latest_sleep = sleep_data['data'][-1]  # Get most recent
                 result['sleep_score'] = latest_sleep.get('score', 'N/A')
@@ -214,11 +523,9 @@ def get_oura_data():
                 if hrv_avg:
                     result['hrv'] = round(hrv_avg)
         
-        # Fetch daily readiness data
-        readiness_url = f'https://api.ouraring.com/v2/usercollection/daily_readiness?start_date={two_days_ago}&end_date={today}'
-        readiness_response = requests.get(readiness_url, headers=headers)
-        if readiness_response.status_code == 200:
-            readiness_data = readiness_response.json()
+        # Daily readiness data
+        readiness_data = responses['readiness']
+        if readiness_data:
             if readiness_data.get('data') and len(readiness_data['data']) > 0:
                 latest_readiness = readiness_data['data'][-1]
                 result['readiness_score'] = latest_readiness.get('score', 'N/A')
@@ -228,28 +535,32 @@ def get_oura_data():
                 if temp_deviation is not None:
                     result['temperature'] = f"{temp_deviation:+.2f}"
         
-        # Fetch daily activity data
-        activity_url = f'https://api.ouraring.com/v2/usercollection/daily_activity?start_date={two_days_ago}&end_date={today}'
-        activity_response = requests.get(activity_url, headers=headers)
-        if activity_response.status_code == 200:
-            activity_data = activity_response.json()
+        # Daily activity data
+        activity_data = responses['activity']
+        if activity_data:
             if activity_data.get('data') and len(activity_data['data']) > 0:
                 latest_activity = activity_data['data'][-1]
                 result['activity_score'] = latest_activity.get('score', 'N/A')
                 
                 # Override heart rate with activity data if available
-                avg_hr_activity = latest_activity.get('average_met_minutes')
                 if not result['heart_rate'] or result['heart_rate'] == 'N/A':
                     low_hr = latest_activity.get('low_activity_met_minutes')
                     if low_hr:
                         result['heart_rate'] = 'Activity tracked'
         
-        # Fetch heart rate data for more accurate HR
-        heart_rate_url = f'https://api.ouraring.com/v2/usercollection/heartrate?start_datetime={two_days_ago}T00:00:00&end_datetime={today}T23:59:59'
-        hr_response = requests.get(heart_rate_url, headers=headers)
-        if hr_response.status_code == 200:
-            hr_data = hr_response.json()
+        # Heart rate data for more accurate HR
+        hr_data = responses['heart_rate']
+        if hr_data:
             if hr_data.get('data') and len(hr_data['data']) > 0:
+                # Keep every intraday sample, not just the latest one
+                try:
+                    if hr_store is None:
+                        from hr_store import HeartRateStore
+                        hr_store = HeartRateStore()
+                    hr_store.add_samples(hr_data['data'])
+                except Exception as e:
+                    print(f"Error storing heart rate samples: {e}")
+                
                 # Get most recent heart rate
                 recent_hr = hr_data['data'][-1].get('bpm')
                 if recent_hr:
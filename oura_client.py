@@ -0,0 +1,302 @@
+"""
+Oura API Fetch Engine
+
+Fetches several Oura v2 usercollection endpoints at once. All requests
+go through the shared http_client session (keep-alive pooling, rate
+limiting and retries), each request has its own timeout,
+and the batch as a whole has a deadline: collections that are not back
+in time are reported as missing instead of holding up the others.
+
+Responses are kept in an on-disk cache keyed by endpoint and date
+range, so refreshes only go to the network for days that can change.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlencode
+
+import requests
+
+import http_client
+import tracing
+from json_stream import iter_array_items
+
+BASE_URL = os.getenv('OURA_BASE_URL', 'https://api.ouraring.com/v2/usercollection')
+
+# (connect, read) timeout for a single request, in seconds
+REQUEST_TIMEOUT = (3.05, 10)
+
+# Total time budget for one batch of requests, in seconds
+TOTAL_DEADLINE = 12
+
+MAX_WORKERS = 8
+
+# On-disk response cache. Days before the last RECENT_DAYS are finalized
+# and kept for a week; ranges that include today or the days before it,
+# which Oura still revises after late ring uploads, are reused for 5
+# minutes and then revalidated.
+CACHE_FILE = '.oura_cache/responses.db'
+PAST_TTL = 7 * 24 * 3600
+TODAY_TTL = 5 * 60
+RECENT_DAYS = 3
+# The recent window moves daily, leaving old keys behind; the least
+# recently used pages beyond this are evicted (see also purge_response_cache)
+CACHE_MAX_ENTRIES = 20000
+
+_response_cache = None
+_cache_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='oura-fetch')
+
+
+def get_response_cache():
+    """Return the shared on-disk response cache"""
+    global _response_cache
+    if _response_cache is None:
+        with _cache_lock:
+            if _response_cache is None:
+                from disk_cache import DiskCache
+                _response_cache = DiskCache(CACHE_FILE, max_entries=CACHE_MAX_ENTRIES)
+    return _response_cache
+
+
+def purge_response_cache():
+    """Drop cached pages that expired more than PAST_TTL ago; they are not worth revalidating"""
+    get_response_cache().purge_expired(older_than=PAST_TTL)
+
+
+def _split_recent(params, today):
+    """
+    Split a date range into (finalized past, recent days) parts
+
+    Older days almost never change and get the long TTL; only the part
+    covering today and the RECENT_DAYS before it needs to go back to the
+    network on refresh. That window matches the days oura_sync fetches
+    again on every run, so those re-fetches are not served from cache.
+
+    Returns:
+        list: (params, ttl) pairs
+    """
+    first_recent = today - timedelta(days=RECENT_DAYS)
+    if 'start_date' in params:
+        start_key, end_key = 'start_date', 'end_date'
+        recent_start, past_end = str(first_recent), str(first_recent - timedelta(days=1))
+    elif 'start_datetime' in params:
+        start_key, end_key = 'start_datetime', 'end_datetime'
+        recent_start = f'{first_recent}T00:00:00'
+        past_end = f'{first_recent - timedelta(days=1)}T23:59:59'
+    else:
+        return [(params, TODAY_TTL)]
+
+    start, end = str(params[start_key]), str(params.get(end_key) or f'{today}T23:59:59')
+    if end < recent_start:
+        return [(params, PAST_TTL)]
+    if start >= recent_start:
+        return [(params, TODAY_TTL)]
+    return [
+        (dict(params, **{end_key: past_end}), PAST_TTL),
+        (dict(params, **{start_key: recent_start}), TODAY_TTL),
+    ]
+
+
+def _cache_key(access_token, collection, params):
+    """
+    Cache key: owner + endpoint + sorted query
+
+    The owner is the user the token belongs to (see oura_auth.token_owner),
+    so cached days stay reachable after the token is refreshed. A token
+    no TokenManager handed out is keyed by its fingerprint.
+    """
+    from oura_auth import token_owner
+    owner = token_owner(access_token)
+    if owner is None:
+        owner = hashlib.sha256(access_token.encode()).hexdigest()[:16]
+    else:
+        owner = f"user:{owner}"
+    return f"{owner}:{collection}?{urlencode(sorted(params.items()))}"
+
+
+def _get(url, access_token, headers=None, **kwargs):
+    """
+    GET with the access token; after a 401 the token is refreshed (see
+    oura_auth.token_rejected) and the request sent once more
+    """
+    response = http_client.get(url, headers=dict(headers or {}, Authorization=f'Bearer {access_token}'), **kwargs)
+    if response.status_code == 401:
+        from oura_auth import token_rejected
+        new_token = token_rejected(access_token)
+        if new_token:
+            tracing.count('oura.token_rejected')
+            response.close()
+            response = http_client.get(url, headers=dict(headers or {}, Authorization=f'Bearer {new_token}'),
+                                       **kwargs)
+    return response
+
+
+def _page_chunks(access_token, collection, params, ttl, timeout, chunk_size, deadline=None):
+    """
+    Yield the raw body of one page, from the cache when fresh
+
+    A stale cache entry is revalidated with If-None-Match /
+    If-Modified-Since; a 304 extends it without downloading the body.
+    A fresh download is streamed to the caller and stored once complete.
+    """
+    cache = get_response_cache() if ttl else None
+    key = _cache_key(access_token, collection, params)
+    cached = cache.get(key) if cache else None
+    if cached and cached['fresh']:
+        tracing.cache('oura.responses', True)
+        yield cached['value']
+        return
+
+    headers = {}
+    if cached and cached['etag']:
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached['last_modified']:
+        headers['If-Modified-Since'] = cached['last_modified']
+
+    response = _get(
+        f'{BASE_URL}/{collection}',
+        access_token,
+        params=params,
+        headers=headers,
+        timeout=timeout,
+        stream=True,
+        deadline=deadline
+    )
+    with response:
+        if response.status_code == 304 and cached:
+            tracing.cache('oura.responses', True)
+            tracing.count('oura.revalidated')
+            cache.touch(key, time.time() + ttl)
+            yield cached['value']
+            return
+        response.raise_for_status()
+        if cache:
+            tracing.cache('oura.responses', False)
+        body = bytearray()
+        for chunk in response.iter_content(chunk_size):
+            body += chunk
+            yield chunk
+
+    if cache:
+        cache.set(key, bytes(body), time.time() + ttl,
+                  etag=response.headers.get('ETag'),
+                  last_modified=response.headers.get('Last-Modified'))
+
+
+def iter_collection(access_token, collection, params, timeout=REQUEST_TIMEOUT,
+                    chunk_size=64 * 1024, use_cache=True, deadline=None):
+    """
+    Stream the records of a usercollection endpoint
+
+    The body is parsed incrementally as it downloads and next_token
+    pages are followed transparently, so memory use stays flat however
+    long the date range is. Pages go through the on-disk response cache
+    unless use_cache is False. With a deadline (a time.monotonic()
+    value) no page request or retry starts once it has passed.
+
+    Yields:
+        dict: One record from each page's 'data' array
+
+    Raises:
+        requests.exceptions.HTTPError: On a non-200 response
+        requests.exceptions.Timeout: If the deadline passed before the
+            last page was requested
+    """
+    for part, ttl in _split_recent(dict(params), datetime.now().date()):
+        if not use_cache:
+            ttl = 0
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise requests.exceptions.Timeout(f"deadline passed before all of {collection} was fetched")
+            extras = {}
+            chunks = _page_chunks(access_token, collection, part, ttl, timeout, chunk_size, deadline)
+            yield from iter_array_items(chunks, extras=extras)
+            # Drain the body so the page is stored in the cache
+            for _ in chunks:
+                pass
+            next_token = extras.get('next_token')
+            if not next_token:
+                break
+            part = dict(part, next_token=next_token)
+
+
+def fetch_collection(access_token, collection, params, timeout=REQUEST_TIMEOUT, deadline=None):
+    """
+    Fetch every page of a usercollection endpoint
+
+    Args:
+        deadline (float): time.monotonic() value after which no page
+            request or retry starts (see iter_collection)
+
+    Returns:
+        dict: {'data': [records...]}
+    """
+    with tracing.span('oura.fetch_collection', collection=collection):
+        return {'data': list(iter_collection(access_token, collection, params, timeout, deadline=deadline))}
+
+
+def fetch_document(access_token, collection, object_id, timeout=REQUEST_TIMEOUT):
+    """
+    Fetch one record of a usercollection endpoint by its id
+
+    Used when a webhook names a document that just changed, so the
+    response cache is bypassed.
+
+    Returns:
+        dict: The record
+
+    Raises:
+        requests.exceptions.HTTPError: On a non-200 response
+    """
+    with tracing.span('oura.fetch_document', collection=collection):
+        response = _get(
+            f'{BASE_URL}/{collection}/{quote(object_id, safe="")}',
+            access_token,
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+def fetch_collections(access_token, specs, timeout=REQUEST_TIMEOUT, deadline=TOTAL_DEADLINE):
+    """
+    Fetch several collections concurrently
+
+    Args:
+        access_token (str): Oura OAuth access token
+        specs (dict): name -> (collection, params)
+        timeout: Per-request timeout passed to requests
+        deadline (float): Seconds to wait for the whole batch
+
+    Returns:
+        dict: name -> {'data': [...]} with all pages, or None if that request failed
+        or did not finish before the deadline
+
+    The deadline is passed down, so a fetch that misses it stops at its
+    next page or retry instead of holding a worker; only a request
+    already on the wire runs on, up to its own timeout.
+    """
+    ends_at = time.monotonic() + deadline
+    futures = {
+        name: _executor.submit(fetch_collection, access_token, collection, params, timeout, ends_at)
+        for name, (collection, params) in specs.items()
+    }
+    wait(futures.values(), timeout=deadline)
+
+    results = {}
+    for name, future in futures.items():
+        if not future.done():
+            print(f"Oura {specs[name][0]} missed the {deadline}s deadline")
+            results[name] = None
+            continue
+        try:
+            results[name] = future.result()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error fetching Oura {specs[name][0]}: {e}")
+            results[name] = None
+    return results
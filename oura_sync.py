@@ -0,0 +1,204 @@
+"""
+Incremental Oura Sync
+
+Keeps HealthDataStorage up to date with the Oura daily collections.
+Each collection has a high-water mark: the last day whose data is
+considered final. The first sync backfills history in date-range
+chunks; after that only the days after the mark (plus today, which
+is never final) are requested, together with the last LOOKBACK_DAYS up
+to the mark: the ring can upload a night or a workout days late, and
+Oura then revises scores it had already returned. Every chunk is
+written in one batch, and re-fetched days that did not change are not
+rewritten.
+"""
+
+from datetime import datetime, timedelta
+
+from oura_client import RECENT_DAYS, fetch_collections, iter_collection
+
+# How far back the first sync reaches
+BACKFILL_DAYS = 3 * 365
+
+# Days requested per API call while backfilling
+CHUNK_DAYS = 90
+
+# Days up to the mark that every incremental sync fetches again; the
+# response cache keeps these short-lived so they do reach the API
+LOOKBACK_DAYS = RECENT_DAYS
+
+# Intraday heart rate is much denser, so it gets a shorter history and
+# smaller request windows
+HR_BACKFILL_DAYS = 90
+HR_CHUNK_DAYS = 30
+
+# Samples buffered before they are merged into the heart-rate store
+HR_FLUSH_SAMPLES = 10000
+
+
+def _resume_date(last_final):
+    """First day an incremental sync requests, given the stored mark"""
+    return datetime.fromisoformat(last_final).date() - timedelta(days=LOOKBACK_DAYS - 1)
+
+
+def _sleep_fields(record):
+    """Map a daily_sleep record to storage fields"""
+    fields = {'sleep_score': record.get('score') or 0}
+    total_sleep_seconds = record.get('total_sleep_duration')
+    if total_sleep_seconds and total_sleep_seconds > 0:
+        fields['total_sleep'] = round(total_sleep_seconds / 3600, 1)
+    avg_hr = record.get('average_heart_rate')
+    if avg_hr:
+        fields['heart_rate'] = round(avg_hr)
+    hrv_avg = record.get('average_hrv')
+    if hrv_avg:
+        fields['hrv'] = round(hrv_avg)
+    return fields
+
+
+def _readiness_fields(record):
+    """Map a daily_readiness record to storage fields"""
+    fields = {'readiness_score': record.get('score') or 0}
+    temp_deviation = record.get('temperature_deviation')
+    if temp_deviation is not None:
+        fields['temperature'] = f"{temp_deviation:+.2f}"
+    return fields
+
+
+def _activity_fields(record):
+    """Map a daily_activity record to storage fields"""
+    return {'activity_score': record.get('score') or 0}
+
+
+COLLECTIONS = {
+    'daily_sleep': _sleep_fields,
+    'daily_readiness': _readiness_fields,
+    'daily_activity': _activity_fields,
+}
+
+
+class OuraSync:
+    """Backfill and incrementally sync Oura daily collections into storage"""
+
+    def __init__(self, storage, access_token, backfill_days=BACKFILL_DAYS, chunk_days=CHUNK_DAYS):
+        self.storage = storage
+        self.access_token = access_token
+        self.backfill_days = backfill_days
+        self.chunk_days = chunk_days
+
+    def _next_start(self, collection, today):
+        """First day that still needs fetching for a collection"""
+        last_final = self.storage.get_sync_state(collection)
+        if last_final is None:
+            return today - timedelta(days=self.backfill_days)
+        return _resume_date(last_final)
+
+    def run(self, today=None):
+        """
+        Sync every collection up to today
+
+        Returns:
+            int: Number of day records written
+        """
+        today = today or datetime.now().date()
+        yesterday = today - timedelta(days=1)
+        starts = {name: self._next_start(name, today) for name in COLLECTIONS}
+        written = 0
+
+        chunk_start = min(starts.values())
+        while chunk_start <= today:
+            chunk_end = min(chunk_start + timedelta(days=self.chunk_days - 1), today)
+            wanted = [name for name, start in starts.items() if start <= chunk_end]
+            specs = {
+                name: (name, {
+                    'start_date': str(max(starts[name], chunk_start)),
+                    'end_date': str(chunk_end)
+                })
+                for name in wanted
+            }
+            responses = fetch_collections(self.access_token, specs)
+
+            updates = {}
+            sync_state = {}
+            for name in wanted:
+                body = responses[name]
+                if body is None:
+                    # Leave the mark alone so this range is retried next run
+                    continue
+                for record in body.get('data', []):
+                    day = record.get('day')
+                    if day:
+                        updates.setdefault(day, {}).update(COLLECTIONS[name](record))
+                # Today can still change, so the mark never passes yesterday
+                sync_state[name] = min(chunk_end, yesterday)
+
+            written += self.storage.upsert_daily_fields(updates, sync_state)
+
+            if len(sync_state) < len(wanted):
+                break
+            chunk_start = chunk_end + timedelta(days=1)
+
+        return written
+
+    def run_heart_rate(self, hr_store, today=None, backfill_days=HR_BACKFILL_DAYS):
+        """
+        Stream intraday heart-rate samples since the 'heartrate' mark into hr_store
+
+        Samples are parsed as they download and flushed to the store in
+        fixed-size batches, so memory stays flat for long backfills. The
+        LOOKBACK_DAYS before the mark are fetched again; the store drops
+        samples it already has.
+
+        Returns:
+            int: Number of samples received
+        """
+        import numpy as np
+        from hr_store import SAMPLE_DTYPE, record_to_sample
+
+        today = today or datetime.now().date()
+        last_final = self.storage.get_sync_state('heartrate')
+        if last_final is None:
+            chunk_start = today - timedelta(days=backfill_days)
+        else:
+            chunk_start = _resume_date(last_final)
+
+        received = 0
+        while chunk_start <= today:
+            chunk_end = min(chunk_start + timedelta(days=HR_CHUNK_DAYS - 1), today)
+            buffer = np.empty(HR_FLUSH_SAMPLES, dtype=SAMPLE_DTYPE)
+            filled = 0
+            for record in iter_collection(self.access_token, 'heartrate', {
+                'start_datetime': f'{chunk_start}T00:00:00',
+                'end_datetime': f'{chunk_end}T23:59:59'
+            }):
+                sample = record_to_sample(record)
+                if sample is None:
+                    continue
+                buffer[filled] = sample
+                filled += 1
+                if filled == HR_FLUSH_SAMPLES:
+                    hr_store.add_array(buffer)
+                    received += filled
+                    filled = 0
+            hr_store.add_array(buffer[:filled])
+            received += filled
+
+            self.storage.upsert_daily_fields({}, {'heartrate': min(chunk_end, today - timedelta(days=1))})
+            chunk_start = chunk_end + timedelta(days=1)
+
+        return received
+
+
+def sync_storage(storage, access_token=None, hr_store=None):
+    """
+    Run one incremental sync, looking up the access token if not given
+
+    Intraday heart rate is synced too when an hr_store is passed.
+    """
+    if access_token is None:
+        from oura_auth import get_access_token
+        access_token = get_access_token()
+    sync = OuraSync(storage, access_token)
+    written = sync.run()
+    if hr_store is not None:
+        sync.run_heart_rate(hr_store)
+    return written
@@ -1,11 +1,109 @@
+import hashlib
+import json
 import os
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta
 import requests
 import streamlit as st
 from dotenv import load_dotenv
+import http_client
+import tracing
 
 # Load environment variables
 load_dotenv()
 
+MODEL = "llama-3.1-sonar-small-128k-online"
+SYSTEM_PROMPT = "You are a helpful health and wellness assistant. Provide personalized insights based on the user's health data. Always remind users to consult healthcare professionals for medical advice."
+
+# Answers are cached until local midnight, since the health context
+# they are based on changes day to day
+CACHE_FILE = '.oura_cache/perplexity.db'
+CACHE_MAX_ENTRIES = 500
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# key -> Future for requests currently in flight, shared by all sessions
+_inflight = {}
+# key -> _Broadcast for streams currently in flight
+_streams = {}
+_inflight_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the shared Perplexity answer cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from disk_cache import DiskCache
+                _cache = DiskCache(CACHE_FILE, max_entries=CACHE_MAX_ENTRIES)
+    return _cache
+
+
+def _end_of_day():
+    """Epoch seconds of the next local midnight"""
+    tomorrow = datetime.now().date() + timedelta(days=1)
+    return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+
+def _normalize(text):
+    """Collapse whitespace and case so trivially different prompts share a key"""
+    return ' '.join(str(text).split()).casefold()
+
+
+def _iter_sse_data(lines):
+    """
+    Yield the data payload of each server-sent event
+    
+    Args:
+        lines: Raw lines (bytes) of a text/event-stream body
+    """
+    data = []
+    for line in lines:
+        line = line.decode('utf-8') if isinstance(line, bytes) else line
+        if not line:
+            if data:
+                yield "\n".join(data)
+                data = []
+        elif line.startswith('data:'):
+            value = line[5:]
+            data.append(value[1:] if value.startswith(' ') else value)
+    if data:
+        yield "\n".join(data)
+
+
+class _Broadcast:
+    """Fragments of one in-flight stream, replayed to every reader that joins"""
+    
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+        self._changed = threading.Condition()
+    
+    def append(self, part):
+        with self._changed:
+            self.parts.append(part)
+            self._changed.notify_all()
+    
+    def close(self):
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+    
+    def __iter__(self):
+        seen = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: seen < len(self.parts) or self.closed)
+                new = self.parts[seen:]
+            if not new:
+                return
+            seen += len(new)
+            yield from new
+
+
 class PerplexityClient:
     """Client for interacting with Perplexity API"""
     
@@ -14,7 +112,7 @@ class PerplexityClient:
         if not self.api_key:
             raise ValueError("PERPLEXITY_API_KEY not found in environment variables")
         
-        self.base_url = "https://api.perplexity.ai/chat/completions"
+        self.base_url = os.getenv('PERPLEXITY_BASE_URL', "https://api.perplexity.ai/chat/completions")
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -30,19 +128,134 @@ class PerplexityClient:
         
         Returns:
             str: The AI response
+        
+        Answers are cached until midnight and identical requests already in
+        flight (e.g. from another session) are shared rather than re-sent.
         """
-        # Build the prompt with health context if provided
+        payload = self._build_payload(question, context)
+        key = self._cache_key(payload)
+        cache = get_response_cache()
+        cached = cache.get(key)
+        tracing.cache('perplexity.answers', bool(cached and cached['fresh']))
+        if cached and cached['fresh']:
+            return cached['value']
+        
+        # Coalesce identical concurrent requests into one API call
+        with _inflight_lock:
+            future = _inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                _inflight[key] = future
+        if not owner:
+            tracing.count('perplexity.coalesced')
+            return future.result()
+        
+        try:
+            answer = self._complete(payload)
+            cache.set(key, answer, _end_of_day())
+            future.set_result(answer)
+        except requests.exceptions.RequestException as e:
+            future.set_result(f"Error communicating with Perplexity API: {str(e)}")
+        except (KeyError, IndexError) as e:
+            future.set_result(f"Error parsing API response: {str(e)}")
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+        return future.result()
+    
+    def stream_health_question(self, question, context=None):
+        """
+        Ask a health-related question and yield the answer as it is generated
+        
+        Uses the API's server-sent events mode, so the UI can render text
+        from the first token on (e.g. with st.write_stream). A cached
+        answer is yielded in one piece; a completed stream is cached.
+        A reader asking while the same stream is in flight (e.g. from
+        another session) is replayed its fragments instead of sending a
+        second request.
+        
+        Yields:
+            str: Text fragments of the AI response
+        """
+        payload = self._build_payload(question, context)
+        key = self._cache_key(payload)
+        cache = get_response_cache()
+        cached = cache.get(key)
+        tracing.cache('perplexity.answers', bool(cached and cached['fresh']))
+        if cached and cached['fresh']:
+            yield cached['value']
+            return
+        
+        # Identical streams already in flight are replayed, not re-sent
+        with _inflight_lock:
+            stream = _streams.get(key)
+            owner = stream is None
+            if owner:
+                stream = _Broadcast()
+                _streams[key] = stream
+        if not owner:
+            tracing.count('perplexity.coalesced')
+            yield from stream
+            return
+        
+        parts = []
+        error = None
+        try:
+            try:
+                for delta in self._stream(payload):
+                    parts.append(delta)
+                    stream.append(delta)
+                    yield delta
+            except requests.exceptions.RequestException as e:
+                error = f"Error communicating with Perplexity API: {str(e)}"
+            except (KeyError, IndexError, ValueError) as e:
+                error = f"Error parsing API response: {str(e)}"
+            else:
+                if parts:
+                    cache.set(key, ''.join(parts), _end_of_day())
+            if error:
+                stream.append(error)
+                yield error
+        finally:
+            # Also reached if our reader stops early; the others keep what they got
+            with _inflight_lock:
+                _streams.pop(key, None)
+            stream.close()
+    
+    def _stream(self, payload):
+        """Send one streaming completion request and yield the text deltas"""
+        # Times the whole stream, so it includes the reader's pace
+        with tracing.span('perplexity.stream'), http_client.post(
+            self.base_url,
+            json=dict(payload, stream=True),
+            headers=dict(self.headers, Accept="text/event-stream"),
+            timeout=30,
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            for event in _iter_sse_data(response.iter_lines()):
+                if event == "[DONE]":
+                    break
+                delta = json.loads(event)['choices'][0].get('delta', {}).get('content')
+                if delta:
+                    yield delta
+    
+    def _build_payload(self, question, context=None):
+        """Build the chat completion request, with health context if provided"""
         prompt = question
         if context:
             context_str = "\n".join([f"{key}: {value}" for key, value in context.items()])
             prompt = f"Based on this health data:\n{context_str}\n\nQuestion: {question}"
         
-        payload = {
-            "model": "llama-3.1-sonar-small-128k-online",
+        return {
+            "model": MODEL,
             "messages": [
                 {
                     "role": "system",
-                    "content": "You are a helpful health and wellness assistant. Provide personalized insights based on the user's health data. Always remind users to consult healthcare professionals for medical advice."
+                    "content": SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
@@ -52,23 +265,29 @@ class PerplexityClient:
             "temperature": 0.7,
             "max_tokens": 1000
         }
-        
-        try:
-            response = requests.post(
+    
+    @staticmethod
+    def _cache_key(payload):
+        """Hash of the model, settings and normalized messages"""
+        normalized = dict(payload, messages=[
+            {"role": m["role"], "content": _normalize(m["content"])}
+            for m in payload["messages"]
+        ])
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+    
+    def _complete(self, payload):
+        """Send one chat completion request and return the answer text"""
+        with tracing.span('perplexity.complete'):
+            response = http_client.post(
                 self.base_url,
                 json=payload,
                 headers=self.headers,
                 timeout=30
             )
-            response.raise_for_status()
-            
-            result = response.json()
-            return result['choices'][0]['message']['content']
+        response.raise_for_status()
         
-        except requests.exceptions.RequestException as e:
-            return f"Error communicating with Perplexity API: {str(e)}"
-        except (KeyError, IndexError) as e:
-            return f"Error parsing API response: {str(e)}"
+        result = response.json()
+        return result['choices'][0]['message']['content']
     
     def get_health_insights(self, sleep_score, readiness_score, activity_score):
         """
@@ -82,6 +301,15 @@ class PerplexityClient:
         Returns:
             str: Personalized health insights
         """
+        return self.ask_health_question(*self._insights_question(sleep_score, readiness_score, activity_score))
+    
+    def stream_health_insights(self, sleep_score, readiness_score, activity_score):
+        """Streaming version of get_health_insights; yields text fragments"""
+        return self.stream_health_question(*self._insights_question(sleep_score, readiness_score, activity_score))
+    
+    @staticmethod
+    def _insights_question(sleep_score, readiness_score, activity_score):
+        """(question, context) used for the daily insights"""
         context = {
             "Sleep Score": sleep_score,
             "Readiness Score": readiness_score,
@@ -90,4 +318,4 @@ class PerplexityClient:
         
         question = "Based on these scores, what are the top 3 actionable recommendations to improve my health today?"
         
-        return self.ask_health_question(question, context)
+        return question, context
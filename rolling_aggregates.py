@@ -0,0 +1,164 @@
+"""
+Rolling-window aggregates over the columnar time series
+
+For every metric this keeps prefix sums and counts of the valid values
+(see timeseries.valid_mask) plus sparse tables of the running argmin / argmax. Sum, count,
+mean, min, max and best / worst day for any window are then O(1) after
+a binary search for the window bounds. Appending or updating the newest
+day (the common write) extends the tables in O(log n); edits further
+back mark them dirty and they are rebuilt, vectorized, on the next read.
+"""
+
+import numpy as np
+
+from timeseries import METRICS, valid_mask
+
+
+class _MetricAggregates:
+    """Prefix sums and argmin/argmax sparse tables for one metric"""
+
+    def __init__(self, values, metric):
+        self.metric = metric
+        self.build(values)
+
+    def build(self, values):
+        n = len(values)
+        capacity = max(16, n * 2)
+        valid = valid_mask(self.metric, values)
+        self.size = n
+        self._sum = np.zeros(capacity + 1)
+        self._sum[1:n + 1] = np.cumsum(np.where(valid, values, 0.0))
+        self._count = np.zeros(capacity + 1, dtype=np.int64)
+        self._count[1:n + 1] = np.cumsum(valid)
+        self._max_key = np.full(capacity, -np.inf)
+        self._max_key[:n] = np.where(valid, values, -np.inf)
+        self._min_key = np.full(capacity, np.inf)
+        self._min_key[:n] = np.where(valid, values, np.inf)
+        self._argmax = self._build_table(self._max_key, n, capacity, np.greater)
+        self._argmin = self._build_table(self._min_key, n, capacity, np.less)
+
+    @staticmethod
+    def _build_table(keys, n, capacity, better):
+        """table[k][j] is the earliest best index in [j, j + 2**k)"""
+        table = [np.arange(capacity)]
+        k = 1
+        while (1 << k) <= n:
+            prev = table[-1]
+            width = n - (1 << k) + 1
+            left = prev[:width]
+            right = prev[(1 << (k - 1)):(1 << (k - 1)) + width]
+            level = np.zeros(capacity, dtype=np.int64)
+            level[:width] = np.where(better(keys[right], keys[left]), right, left)
+            table.append(level)
+            k += 1
+        return table
+
+    def _grow(self):
+        capacity = len(self._max_key) * 2
+        for name in ('_sum', '_count'):
+            old = getattr(self, name)
+            new = np.zeros(capacity + 1, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        for name, fill in (('_max_key', -np.inf), ('_min_key', np.inf)):
+            old = getattr(self, name)
+            new = np.full(capacity, fill)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        for name in ('_argmax', '_argmin'):
+            grown = []
+            for level in getattr(self, name):
+                new = np.zeros(capacity, dtype=np.int64)
+                new[:len(level)] = level
+                grown.append(new)
+            grown[0] = np.arange(capacity)
+            setattr(self, name, grown)
+
+    def append(self, value):
+        """Add a value after the current last one in O(log n)"""
+        if self.size == len(self._max_key):
+            self._grow()
+        i = self.size
+        valid = bool(valid_mask(self.metric, value))
+        self._sum[i + 1] = self._sum[i] + (value if valid else 0.0)
+        self._count[i + 1] = self._count[i] + valid
+        self._max_key[i] = value if valid else -np.inf
+        self._min_key[i] = value if valid else np.inf
+        self.size += 1
+
+        n = self.size
+        for table, keys, better in ((self._argmax, self._max_key, np.greater),
+                                    (self._argmin, self._min_key, np.less)):
+            k = 1
+            while (1 << k) <= n:
+                if k == len(table):
+                    table.append(np.zeros(len(keys), dtype=np.int64))
+                j = n - (1 << k)
+                left = table[k - 1][j]
+                right = table[k - 1][j + (1 << (k - 1))]
+                table[k][j] = right if better(keys[right], keys[left]) else left
+                k += 1
+
+    def set_last(self, value):
+        """Replace the last value in O(log n)"""
+        self.size -= 1
+        self.append(value)
+
+    def _best(self, table, keys, better, lo, hi):
+        k = (hi - lo).bit_length() - 1
+        a = table[k][lo]
+        b = table[k][hi - (1 << k)]
+        return int(b) if better(keys[b], keys[a]) else int(a)
+
+    def window(self, lo, hi):
+        """Aggregates over rows [lo, hi); hi > lo"""
+        # Rounding drops the float noise left by differencing prefix sums
+        total = round(float(self._sum[hi] - self._sum[lo]), 6)
+        count = int(self._count[hi] - self._count[lo])
+        argmax = self._best(self._argmax, self._max_key, np.greater, lo, hi)
+        argmin = self._best(self._argmin, self._min_key, np.less, lo, hi)
+        return {
+            'sum': total,
+            'count': count,
+            'mean': total / count if count else None,
+            'max': float(self._max_key[argmax]) if count else None,
+            'min': float(self._min_key[argmin]) if count else None,
+            'argmax': argmax,
+            'argmin': argmin,
+        }
+
+
+class RollingAggregates:
+    """Window aggregates for every metric of a ColumnarSeries"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._metrics = {}
+        self._dirty = True
+
+    def _rebuild(self):
+        self._metrics = {
+            metric: _MetricAggregates(self.columns.column(metric), metric)
+            for metric in METRICS
+        }
+        self._dirty = False
+
+    def on_upsert(self, index, inserted):
+        """Keep the tables in step with ColumnarSeries.upsert"""
+        if self._dirty:
+            return
+        if index != self.columns.size - 1:
+            self._dirty = True
+            return
+        for metric, aggregates in self._metrics.items():
+            value = self.columns.column(metric)[index]
+            if inserted:
+                aggregates.append(value)
+            else:
+                aggregates.set_last(value)
+
+    def window(self, metric, lo, hi):
+        """Aggregates for one metric over rows [lo, hi) of the series"""
+        if self._dirty:
+            self._rebuild()
+        return self._metrics[metric].window(lo, hi)
@@ -0,0 +1,561 @@
+"""
+Storage backends for HealthDataStorage
+
+A backend persists daily entries, tags and sync state. HealthDataStorage
+keeps the working copy in memory and hands each mutation to the backend
+through commit(), which writes only what changed in one transaction.
+
+- SQLiteBackend: WAL-mode SQLite database indexed on date (default)
+- JournalBackend: append-only JSON-lines journal with periodic compaction
+- JSONFileBackend: the original single JSON file, written atomically
+
+WriteBehindBackend wraps any of these to buffer commits in memory and
+write them in batches from a background thread.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+
+from file_lock import FileLock
+
+
+def empty_data():
+    """Return a fresh, empty data dict"""
+    return {'daily_entries': [], 'tags': [], 'sync_state': {}}
+
+
+def _atomic_write(path, write):
+    """Write a file through a temp file + rename so readers never see a torn file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class StorageBackend:
+    """Interface every storage backend implements"""
+
+    def load(self):
+        """Return the stored data as {'daily_entries', 'tags', 'sync_state'}"""
+        raise NotImplementedError
+
+    def commit(self, entries=(), tags=(), sync_state=None):
+        """
+        Persist a batch of changes in one transaction
+
+        Args:
+            entries: Daily entries to insert or replace (keyed by date)
+            tags: New tags to append
+            sync_state (dict): collection -> high-water mark to set
+        """
+        raise NotImplementedError
+
+    def is_empty(self):
+        """True if nothing has been stored yet"""
+        data = self.load()
+        return not (data['daily_entries'] or data['tags'] or data['sync_state'])
+
+    def fingerprint(self):
+        """
+        Cheap token that changes when the stored data changes, so a cached
+        copy can tell whether it needs reloading; None if unknown
+        """
+        try:
+            stat = os.stat(self.filename)
+        except (AttributeError, OSError):
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def lock(self):
+        """
+        Exclusive write lock on the store, shared with other processes
+
+        HealthDataStorage holds it from checking that nobody else has
+        written since its copy was loaded until its own commit is done.
+        """
+        return FileLock(f"{self.filename}.lock")
+
+    def flush(self):
+        """Write out anything buffered (only buffering backends buffer)"""
+
+    def close(self):
+        """Release any open handles"""
+
+
+class JSONFileBackend(StorageBackend):
+    """Whole-file JSON storage, kept for compatibility with health_data.json"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._data = None
+
+    def load(self):
+        with self._lock:
+            self._data = empty_data()
+            if os.path.exists(self.filename):
+                try:
+                    with open(self.filename, 'r') as f:
+                        self._data.update(json.load(f))
+                except (OSError, ValueError):
+                    pass
+            return json.loads(json.dumps(self._data))
+
+    def commit(self, entries=(), tags=(), sync_state=None):
+        with self._lock:
+            if self._data is None:
+                self._data = empty_data()
+            by_date = {e['date']: i for i, e in enumerate(self._data['daily_entries'])}
+            for entry in entries:
+                if entry['date'] in by_date:
+                    self._data['daily_entries'][by_date[entry['date']]] = dict(entry)
+                else:
+                    by_date[entry['date']] = len(self._data['daily_entries'])
+                    self._data['daily_entries'].append(dict(entry))
+            self._data['tags'].extend(dict(tag) for tag in tags)
+            self._data['sync_state'].update(sync_state or {})
+            _atomic_write(self.filename, lambda f: json.dump(self._data, f, indent=2))
+
+
+class SQLiteBackend(StorageBackend):
+    """SQLite storage in WAL mode; each commit is a single transaction"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS daily_entries (
+            date TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS tags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tags_date ON tags (date);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            collection TEXT PRIMARY KEY,
+            last_date TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(self.SCHEMA)
+
+    def load(self):
+        with self._lock:
+            conn = self._conn
+            return {
+                'daily_entries': [
+                    json.loads(row[0])
+                    for row in conn.execute('SELECT data FROM daily_entries ORDER BY date')
+                ],
+                'tags': [
+                    json.loads(row[0])
+                    for row in conn.execute('SELECT data FROM tags ORDER BY id')
+                ],
+                'sync_state': dict(conn.execute('SELECT collection, last_date FROM sync_state')),
+            }
+
+    def commit(self, entries=(), tags=(), sync_state=None):
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO daily_entries (date, data) VALUES (?, ?)',
+                    [(e['date'], json.dumps(e)) for e in entries]
+                )
+                conn.executemany(
+                    'INSERT INTO tags (date, data) VALUES (?, ?)',
+                    [(t['date'], json.dumps(t)) for t in tags]
+                )
+                conn.executemany(
+                    'INSERT OR REPLACE INTO sync_state (collection, last_date) VALUES (?, ?)',
+                    list((sync_state or {}).items())
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def fingerprint(self):
+        # Changes only when another connection commits, which is exactly
+        # when a copy loaded through this connection goes stale
+        with self._lock:
+            return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def is_empty(self):
+        with self._lock:
+            for table in ('daily_entries', 'tags', 'sync_state'):
+                if self._conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone():
+                    return False
+            return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JournalBackend(StorageBackend):
+    """
+    Append-only JSON-lines journal
+
+    Every commit appends one line per change. When the journal holds
+    more than compact_ratio times as many lines as live records, it is
+    rewritten as a snapshot of the current state.
+    """
+
+    def __init__(self, filename, compact_ratio=4, min_compact_lines=1000):
+        self.filename = filename
+        self.compact_ratio = compact_ratio
+        self.min_compact_lines = min_compact_lines
+        self._lock = threading.Lock()
+        self._data = None
+        self._lines = 0
+        self._size = 0
+
+    def _replay(self):
+        data = empty_data()
+        by_date = {}
+        lines = 0
+        size = 0
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from an interrupted append
+                        continue
+                    lines += 1
+                    self._apply(data, by_date, record)
+                size = os.fstat(f.fileno()).st_size
+        self._data, self._by_date, self._lines, self._size = data, by_date, lines, size
+
+    @staticmethod
+    def _apply(data, by_date, record):
+        kind, value = record['op'], record['value']
+        if kind == 'entry':
+            if value['date'] in by_date:
+                data['daily_entries'][by_date[value['date']]] = value
+            else:
+                by_date[value['date']] = len(data['daily_entries'])
+                data['daily_entries'].append(value)
+        elif kind == 'tag':
+            data['tags'].append(value)
+        elif kind == 'sync_state':
+            data['sync_state'].update(value)
+
+    def load(self):
+        with self._lock:
+            self._replay()
+            return json.loads(json.dumps(self._data))
+
+    def commit(self, entries=(), tags=(), sync_state=None):
+        records = [{'op': 'entry', 'value': dict(e)} for e in entries]
+        records += [{'op': 'tag', 'value': dict(t)} for t in tags]
+        if sync_state:
+            records.append({'op': 'sync_state', 'value': dict(sync_state)})
+        if not records:
+            return
+
+        with self._lock:
+            # Another process may have appended or compacted since we last
+            # read it; catch up so a compaction never drops its records
+            if self._data is None or self._file_size() != self._size:
+                self._replay()
+            # One write call per commit keeps the batch together on disk
+            payload = ''.join(json.dumps(r) + '\n' for r in records)
+            with open(self.filename, 'a') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+                self._size = os.fstat(f.fileno()).st_size
+            for record in records:
+                self._apply(self._data, self._by_date, record)
+            self._lines += len(records)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        live = len(self._data['daily_entries']) + len(self._data['tags']) + 1
+        if self._lines >= self.min_compact_lines and self._lines > self.compact_ratio * live:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the journal as a snapshot of the current state"""
+        records = [{'op': 'entry', 'value': e} for e in self._data['daily_entries']]
+        records += [{'op': 'tag', 'value': t} for t in self._data['tags']]
+        if self._data['sync_state']:
+            records.append({'op': 'sync_state', 'value': self._data['sync_state']})
+        _atomic_write(self.filename,
+                      lambda f: f.writelines(json.dumps(r) + '\n' for r in records))
+        self._lines = len(records)
+        self._size = self._file_size()
+
+    def _file_size(self):
+        try:
+            return os.path.getsize(self.filename)
+        except OSError:
+            return 0
+
+
+class WriteBehindBackend(StorageBackend):
+    """
+    Buffer commits and write them to another backend in the background
+
+    commit() only merges the changes into a pending batch (later values
+    for the same date or collection replace earlier ones) and returns.
+    A daemon thread writes the batch in one backend commit flush_interval
+    seconds after the first pending change, or straight away once
+    max_pending records are waiting. Reads flush first, and pending
+    changes are flushed on close() and at interpreter exit. A failed
+    flush keeps its batch pending and is retried.
+
+    Other processes may commit to the same store while a batch waits.
+    Flushes run under the wrapped backend's lock, and if the store
+    changed since the last flush, each pending entry only overwrites the
+    fields its commits changed (see commit's bases), on top of the
+    entry as it is now stored. Sync marks never move backwards.
+    """
+
+    def __init__(self, backend, flush_interval=1.0, max_pending=500):
+        self.backend = backend
+        self.filename = getattr(backend, 'filename', None)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._entries = {}
+        self._fields = {}  # date -> names of the fields pending commits changed; None for all
+        self._tags = []
+        self._sync_state = {}
+        # lock() is re-entrant within this process, so a flush can run
+        # under a lock HealthDataStorage already holds
+        self._process_lock = threading.RLock()
+        self._lock_depth = 0
+        self._held_lock = None
+        self._dirty = threading.Event()
+        self._full = threading.Event()
+        self._closing = False
+        self._own_fingerprint = backend.fingerprint()
+        self._flushed_fingerprint = self._own_fingerprint
+        self._external_changes = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name='storage-write-behind')
+        self._thread.start()
+        atexit.register(self.flush)  # unregistered again by close()
+
+    def load(self):
+        self.flush()
+        return self.backend.load()
+
+    def commit(self, entries=(), tags=(), sync_state=None, bases=None):
+        """
+        Buffer a batch (see StorageBackend.commit)
+
+        Args:
+            bases (dict): date -> the entry each new entry was derived
+                from (None for a new day), so only the fields that really
+                changed are written over a concurrently updated entry;
+                without it the whole entry is
+        """
+        with self._lock:
+            for entry in entries:
+                date = entry['date']
+                changed = None if bases is None else _changed_fields(entry, bases.get(date))
+                if date in self._entries:
+                    previous = self._fields.get(date)
+                    changed = None if previous is None or changed is None else previous | changed
+                self._entries[date] = dict(entry)
+                self._fields[date] = changed
+            self._tags.extend(dict(tag) for tag in tags)
+            self._sync_state.update(sync_state or {})
+            pending = len(self._entries) + len(self._tags)
+        self._dirty.set()
+        if pending >= self.max_pending:
+            self._full.set()
+
+    def _run(self):
+        while not self._closing:
+            # The timeout only bounds how long a missed close() can go unnoticed
+            if not self._dirty.wait(self.flush_interval):
+                continue
+            if not self._closing:
+                # Let further changes join the batch for up to flush_interval
+                self._full.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing health data: {e}")
+
+    def flush(self):
+        with self._lock:
+            if not (self._entries or self._tags or self._sync_state):
+                self._dirty.clear()
+                return
+        with self.lock(), self._flush_lock:
+            with self._lock:
+                entries, fields, tags, sync_state = self._entries, self._fields, self._tags, self._sync_state
+                self._entries, self._fields, self._tags, self._sync_state = {}, {}, [], {}
+                self._dirty.clear()
+                self._full.clear()
+            if not (entries or tags or sync_state):
+                return
+            try:
+                rows = list(entries.values())
+                if self.backend.fingerprint() != self._flushed_fingerprint:
+                    # Someone else committed since our last flush: merge onto what is stored now
+                    rows, sync_state = _rebase(self.backend.load(), entries, fields, sync_state)
+                self.backend.commit(entries=rows, tags=tags, sync_state=sync_state)
+            except Exception:
+                with self._lock:
+                    # Put the batch back underneath anything committed since
+                    for date, entry in entries.items():
+                        if date in self._entries:
+                            later = self._fields.get(date)
+                            earlier = fields.get(date)
+                            self._fields[date] = None if later is None or earlier is None else earlier | later
+                        else:
+                            self._entries[date] = entry
+                            self._fields[date] = fields.get(date)
+                    self._tags = tags + self._tags
+                    self._sync_state = dict(sync_state, **self._sync_state)
+                    self._dirty.set()
+                raise
+            fingerprint = self.backend.fingerprint()
+            with self._lock:
+                self._own_fingerprint = fingerprint
+                self._flushed_fingerprint = fingerprint
+
+    def fingerprint(self):
+        # Our own background flushes change the wrapped backend's
+        # fingerprint too; only report changes made by someone else
+        current = self.backend.fingerprint()
+        if current is None:
+            return None
+        with self._lock:
+            if current != self._own_fingerprint:
+                self._own_fingerprint = current
+                self._external_changes += 1
+            return self._external_changes
+
+    @contextlib.contextmanager
+    def lock(self):
+        """The wrapped backend's lock, re-entrant for the threads of this process"""
+        with self._process_lock:
+            if self._lock_depth == 0:
+                held = self.backend.lock()
+                held.__enter__()
+                self._held_lock = held
+            self._lock_depth += 1
+            try:
+                yield self
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    held, self._held_lock = self._held_lock, None
+                    held.__exit__(None, None, None)
+
+    def is_empty(self):
+        self.flush()
+        return self.backend.is_empty()
+
+    def close(self):
+        self._closing = True
+        self._dirty.set()
+        self._full.set()
+        # The worker exits after its current flush; whatever it leaves is flushed here
+        self._thread.join(timeout=max(5.0, 2 * self.flush_interval))
+        self.flush()
+        atexit.unregister(self.flush)
+        self.backend.close()
+
+
+def _changed_fields(entry, base):
+    """
+    Fields of entry that differ from the entry it was derived from
+
+    For a new day (no base), the zero / None placeholders that fill the
+    fields nobody set do not count as changes.
+    """
+    if base is None:
+        return {key for key, value in entry.items() if key != 'timestamp' and value not in (None, 0)}
+    return {key for key, value in entry.items() if key != 'timestamp' and base.get(key) != value}
+
+
+def _rebase(stored, entries, fields, sync_state):
+    """
+    Pending entries and marks merged onto the data as it is stored now
+
+    Returns:
+        tuple: (entries to commit, sync state to commit)
+    """
+    current = {entry['date']: entry for entry in stored['daily_entries']}
+    rows = []
+    for date, entry in entries.items():
+        names = fields.get(date)
+        existing = current.get(date)
+        if existing is None or names is None:
+            rows.append(entry)
+            continue
+        rows.append(dict(existing, **{name: entry[name] for name in names},
+                         timestamp=entry.get('timestamp', existing.get('timestamp'))))
+    stored_state = stored.get('sync_state', {})
+    marks = {collection: max(mark, stored_state.get(collection) or mark)
+             for collection, mark in sync_state.items()}
+    return rows, marks
+
+
+BACKENDS = {
+    'sqlite': (SQLiteBackend, '.db'),
+    'journal': (JournalBackend, '.jsonl'),
+    'json': (JSONFileBackend, '.json'),
+}
+
+
+def migrate_json_file(json_filename, backend):
+    """
+    One-shot migration of a legacy health_data.json into a backend
+
+    Runs only when the backend is empty and the JSON file exists. The
+    JSON file is renamed to *.migrated afterwards so it is not imported
+    twice.
+
+    Returns:
+        bool: True if data was migrated
+    """
+    if isinstance(backend, JSONFileBackend) or not os.path.exists(json_filename):
+        return False
+    if not backend.is_empty():
+        return False
+
+    legacy = JSONFileBackend(json_filename).load()
+    backend.commit(legacy['daily_entries'], legacy['tags'], legacy['sync_state'])
+    os.replace(json_filename, f"{json_filename}.migrated")
+    print(f"Migrated {len(legacy['daily_entries'])} entries from {json_filename}")
+    return True
+
+
+def make_backend(kind, filename):
+    """
+    Build a backend of the given kind next to the legacy JSON filename
+
+    e.g. make_backend('sqlite', 'health_data.json') -> health_data.db,
+    migrating health_data.json into it on first use.
+    """
+    backend_class, extension = BACKENDS[kind]
+    base = os.path.splitext(filename)[0]
+    backend = backend_class(base + extension)
+    with backend.lock():
+        migrate_json_file(filename, backend)
+    return backend
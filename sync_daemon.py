@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Headless Oura sync
+
+Keeps each user's storage, heart-rate files and today's metrics current
+whether or not anyone has the dashboard open. One run of a shard (see
+user_shards.py) syncs the daily collections and intraday heart rate into
+storage, fetches today's metrics and writes them, with the outcome of
+the run, to <shard>/.oura_sync.json. While that file is fresh the
+dashboard renders from it and makes no API calls of its own.
+
+Every shard is synced every INTERVAL seconds, lengthened or shortened by
+up to JITTER so many users (or several daemons) do not hit the API in
+lockstep; after a failure the wait doubles, up to MAX_BACKOFF. A run
+holds <shard>/.oura_sync.lock. A run that finds the lock taken, by
+another daemon or by the dashboard, is skipped instead of queued, so
+overlapping runs coalesce into one. Requests go through http_client,
+which rate-limits per host and honours Retry-After.
+
+Shards are found by their token files: the single-user .oura_tokens.json
+(or a token in .env) and user_data/<user id>/.oura_tokens.json, which
+the dashboard writes on a user's first login. New users are picked up
+while the daemon runs.
+
+Usage:
+    python sync_daemon.py                 # run until interrupted
+    python sync_daemon.py --once          # sync every shard once and exit
+    python sync_daemon.py --interval 900 --jitter 0.2
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import ExitStack
+
+import user_shards
+from file_lock import FileLock
+
+# Seconds between runs of one shard, and the +/- fraction they vary by
+INTERVAL = int(os.getenv('OURA_SYNC_INTERVAL', 30 * 60))
+JITTER = 0.1
+
+# Longest wait after repeated failures
+MAX_BACKOFF = 6 * 3600
+
+# Seconds between looks for newly added shards
+DISCOVER_INTERVAL = 60
+
+STATE_FILE = '.oura_sync.json'
+LOCK_FILE = '.oura_sync.lock'
+
+# Score field that shows whether a stored day has a document of each
+# collection the snapshot reports
+SNAPSHOT_FIELDS = {
+    'daily_sleep': 'sleep_score',
+    'daily_readiness': 'readiness_score',
+    'daily_activity': 'activity_score',
+}
+
+
+def state_path(shard):
+    return os.path.join(shard.directory, STATE_FILE)
+
+
+def read_state(shard):
+    """Outcome of the shard's last run, or None if it was never synced"""
+    try:
+        with open(state_path(shard)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def state_version(shard):
+    """Modification time of the state file (a cache key), or None"""
+    try:
+        return os.stat(state_path(shard)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def snapshot_fresh(shard, now=None):
+    """Whether the last sync's snapshot is still within its fresh_until time"""
+    return read_snapshot(shard, now) is not None
+
+
+def read_snapshot(shard, now=None):
+    """
+    Today's metrics from the last successful run, if still fresh
+
+    Returns:
+        dict: get_oura_data() result, or None if there is none or it has
+        passed its fresh_until time
+    """
+    state = read_state(shard)
+    if not state or state.get('data') is None:
+        return None
+    if (now or time.time()) >= state.get('fresh_until', 0):
+        return None
+    return state['data']
+
+
+def _write_state(shard, state):
+    path = state_path(shard)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def sync_shard(shard, storage=None, hr_store=None, fresh_for=2 * INTERVAL, wait=False):
+    """
+    Sync one shard and record today's metrics in its state file
+
+    Args:
+        storage: The shard's HealthDataStorage; opened for this run if None
+        hr_store: The shard's HeartRateStore; opened for this run if None
+        fresh_for (float): Seconds the dashboard may use the result for
+        wait (bool): If another run holds the lock, wait for it to finish
+            and return its outcome instead of skipping
+
+    Returns:
+        dict: The new state, or None if the run was skipped because
+        another one was in progress
+    """
+    lock_path = os.path.join(shard.directory, LOCK_FILE)
+    requested = time.time()
+    with ExitStack() as held:
+        try:
+            held.enter_context(FileLock(lock_path, blocking=False))
+        except BlockingIOError:
+            if not wait:
+                return None
+            # That run started before we asked, and its result is as new as ours would be
+            with FileLock(lock_path):
+                return read_state(shard)
+
+        from oura_auth import get_oura_data
+        from oura_sync import sync_storage
+        if storage is None:
+            from data_storage import HealthDataStorage
+            storage = HealthDataStorage(shard.storage_file)
+        if hr_store is None:
+            from hr_store import HeartRateStore
+            hr_store = HeartRateStore(shard.hr_directory)
+
+        state = read_state(shard) or {}
+        state.update(started_at=requested, error=None)
+        try:
+            access_token = shard.access_token()
+            storage.reload_if_changed()
+            state['written'] = sync_storage(storage, access_token=access_token, hr_store=hr_store)
+            data = get_oura_data(access_token, hr_store)
+            # get_oura_data reports failed requests as N/A rather than raising
+            if all(value == 'N/A' for value in data.values()):
+                raise ValueError("Oura returned no data for today")
+            state.update(data=data, fetched_at=time.time(), fresh_until=time.time() + fresh_for,
+                         failures=0, document_days=_document_days(storage))
+        except Exception as e:
+            print(f"Sync of {shard.user_id or 'default user'} failed: {e}")
+            state.update(error=str(e), failures=state.get('failures', 0) + 1)
+        state['finished_at'] = time.time()
+        _write_state(shard, state)
+        return state
+
+
+def _document_days(storage):
+    """
+    Day of the newest stored document of each collection
+
+    get_oura_data shows the latest document of the last two days, so
+    these are the days the snapshot's values were taken from.
+    """
+    days = {}
+    for entry in reversed(storage.get_recent_entries(2)):
+        for collection, field in SNAPSHOT_FIELDS.items():
+            if collection not in days and entry.get(field):
+                days[collection] = entry['date']
+    return days
+
+
+def merge_into_snapshot(shard, collection, day, fields):
+    """
+    Fold one changed document (e.g. from a webhook) into the snapshot
+
+    The snapshot shows the latest document of each collection, so the
+    fields only replace its values if `day` is at least as recent as the
+    day those values came from (an update to yesterday's document counts
+    while yesterday's is the one shown). Its freshness is left alone, and
+    nothing happens while there is no snapshot yet.
+
+    Returns:
+        bool: Whether the snapshot changed
+    """
+    with FileLock(os.path.join(shard.directory, LOCK_FILE)):
+        state = read_state(shard)
+        if not state or state.get('data') is None:
+            return False
+        days = state.setdefault('document_days', {})
+        if day < days.get(collection, day):
+            return False
+        days[collection] = day
+        state['data'].update(fields)
+        _write_state(shard, state)
+        return True
+
+
+def discover_shards(data_dir=user_shards.DATA_DIR):
+    """Every shard that has tokens to sync with"""
+    shards = [user_shards.default_shard()]
+    try:
+        names = sorted(os.listdir(data_dir))
+    except OSError:
+        names = []
+    for name in names:
+        if os.path.isdir(os.path.join(data_dir, name)):
+            shards.append(user_shards.known_shard(name, data_dir))
+    return [shard for shard in shards if shard is not None]
+
+
+class SyncScheduler:
+    """
+    Runs sync_shard for every discovered shard on a jittered schedule
+
+    Args:
+        interval (float): Seconds between runs of one shard
+        jitter (float): Fraction each wait is randomly varied by
+        data_dir (str): Where the user shards live
+    """
+
+    def __init__(self, interval=INTERVAL, jitter=JITTER, data_dir=user_shards.DATA_DIR, seed=None):
+        self.interval = interval
+        self.jitter = jitter
+        self.data_dir = data_dir
+        self._rng = random.Random(seed)
+        self._due = {}  # shard directory -> (shard, next run time)
+        self._open_stores = {}
+        self._discovered_at = None
+        self._stop = threading.Event()
+
+    def _delay(self, failures=0):
+        """Jittered seconds until the next run, doubled per consecutive failure"""
+        base = min(self.interval * 2 ** failures, MAX_BACKOFF)
+        return base * (1 + self._rng.uniform(-self.jitter, self.jitter))
+
+    def _first_due(self, shard, now):
+        """Resume where an earlier daemon (or the dashboard) left off"""
+        state = read_state(shard) or {}
+        if state.get('finished_at'):
+            return state['finished_at'] + self._delay(state.get('failures', 0))
+        # Never synced: start soon, but spread new shards out
+        return now + self._rng.uniform(0, self.interval * self.jitter)
+
+    def discover(self, now=None):
+        now = now or time.time()
+        for shard in discover_shards(self.data_dir):
+            if shard.directory not in self._due:
+                self._due[shard.directory] = (shard, self._first_due(shard, now))
+        self._discovered_at = now
+
+    def _stores(self, shard):
+        """Storage and heart-rate store kept open across a shard's runs"""
+        stores = self._open_stores.get(shard.directory)
+        if stores is None:
+            from data_storage import HealthDataStorage
+            from hr_store import HeartRateStore
+            stores = (HealthDataStorage(shard.storage_file), HeartRateStore(shard.hr_directory))
+            self._open_stores[shard.directory] = stores
+        return stores
+
+    def run_due(self, now=None, force=False):
+        """
+        Sync every shard whose time has come (every shard with force)
+
+        Returns:
+            list: (shard, state or None if skipped) for each shard run
+        """
+        now = now or time.time()
+        if self._discovered_at is None or now - self._discovered_at >= DISCOVER_INTERVAL:
+            self.discover(now)
+        ran = []
+        for key, (shard, due) in list(self._due.items()):
+            if not force and due > now:
+                continue
+            storage, hr_store = self._stores(shard)
+            fresh_for = 2 * self.interval * (1 + self.jitter)
+            state = sync_shard(shard, storage, hr_store, fresh_for=fresh_for)
+            if state is None:
+                # Someone else is syncing this shard; their run counts as ours
+                print(f"Sync of {shard.user_id or 'default user'} already in progress, skipped")
+                failures = 0
+            else:
+                failures = state.get('failures', 0)
+            self._due[key] = (shard, time.time() + self._delay(failures))
+            ran.append((shard, state))
+        if ran:
+            from oura_client import purge_response_cache
+            purge_response_cache()
+        return ran
+
+    def next_wakeup(self):
+        """When run_due next has something to do"""
+        wakeups = [due for _, due in self._due.values()]
+        wakeups.append((self._discovered_at or 0) + DISCOVER_INTERVAL)
+        return min(wakeups)
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            self.run_due()
+            self._stop.wait(max(0.0, self.next_wakeup() - time.time()))
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--once', action='store_true', help='Sync every shard once and exit')
+    parser.add_argument('--interval', type=float, default=INTERVAL, help='Seconds between syncs of a shard')
+    parser.add_argument('--jitter', type=float, default=JITTER,
+                        help='Fraction each interval is randomly varied by')
+    parser.add_argument('--data-dir', default=user_shards.DATA_DIR)
+    args = parser.parse_args()
+
+    scheduler = SyncScheduler(args.interval, args.jitter, args.data_dir)
+    if args.once:
+        ran = scheduler.run_due(force=True)
+        if not ran:
+            print("No Oura tokens found. Run oura_auth.py or log in to the dashboard first.")
+        return 1 if any(state and state.get('error') for _, state in ran) else 0
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
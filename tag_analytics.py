@@ -0,0 +1,160 @@
+"""
+Tag Impact Analytics
+
+Measures how tagged events (alcohol, late meal, travel, ...) shift the
+metrics in the days that follow them. Daily metrics are laid out on a
+dense day grid so each tag's follow-up window is a single fancy-index
+lookup, and each window is compared against the user's own rolling
+baseline from the days before the tag. Per tag and category the mean
+delta is reported with a bootstrap confidence interval.
+"""
+
+import numpy as np
+
+# Scores of 0 are placeholders for "no data" in storage
+SCORE_METRICS = ('sleep_score', 'readiness_score', 'activity_score')
+
+# Random draws held in memory at once while bootstrapping; resamples are
+# generated in chunks of iterations that fit, however many tags there are
+BOOTSTRAP_CHUNK_DRAWS = 1 << 20
+
+
+class TagImpactAnalyzer:
+    """Vectorized tag -> next-days impact analysis with cached results"""
+
+    def __init__(self, storage, n_bootstrap=1000, confidence=0.95, seed=0):
+        self.storage = storage
+        self.n_bootstrap = n_bootstrap
+        self.confidence = confidence
+        self.seed = seed
+        self._cache = {}
+        self._cache_version = None
+
+    def _grid(self, metric):
+        """Scatter a metric column onto a dense daily grid starting at origin"""
+        columns = self.storage.get_columns()
+        dates = columns.dates.astype('int64')
+        values = columns.column(metric).copy()
+        if metric in SCORE_METRICS:
+            values[values <= 0] = np.nan
+        origin = dates[0]
+        grid = np.full(dates[-1] - origin + 1, np.nan)
+        grid[dates - origin] = values
+        return origin, grid
+
+    @staticmethod
+    def _rolling_baseline(grid, days):
+        """Mean of the `days` values before each grid day, ignoring NaN"""
+        valid = ~np.isnan(grid)
+        sums = np.concatenate(([0.0], np.cumsum(np.where(valid, grid, 0.0))))
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        idx = np.arange(len(grid))
+        lo = np.maximum(idx - days, 0)
+        n = counts[idx] - counts[lo]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(n > 0, (sums[idx] - sums[lo]) / n, np.nan)
+
+    def _bootstrap(self, deltas, groups, sizes, rng):
+        """
+        Percentile bootstrap CI of each group's mean delta, all groups at once
+
+        Each resample draws, for every member of a group, a random member of
+        the same group; np.add.reduceat then sums the draws group by group.
+        Resamples are drawn in chunks so memory stays bounded by
+        BOOTSTRAP_CHUNK_DRAWS rather than n_bootstrap * len(deltas).
+        """
+        order = np.argsort(groups, kind='stable')
+        sorted_deltas = deltas[order]
+        sorted_groups = groups[order]
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+        starts = offsets[sorted_groups]
+        member_counts = sizes[sorted_groups]
+        means = np.empty((self.n_bootstrap, len(sizes)))
+        chunk = max(1, BOOTSTRAP_CHUNK_DRAWS // len(deltas))
+        for first in range(0, self.n_bootstrap, chunk):
+            rows = min(chunk, self.n_bootstrap - first)
+            draws = rng.random((rows, len(deltas)))
+            idx = starts + (draws * member_counts).astype(np.int64)
+            means[first:first + rows] = np.add.reduceat(sorted_deltas[idx], offsets, axis=1) / sizes
+
+        tail = (1 - self.confidence) / 2 * 100
+        ci_low, ci_high = np.percentile(means, [tail, 100 - tail], axis=0)
+        too_small = sizes < 2
+        ci_low[too_small] = np.nan
+        ci_high[too_small] = np.nan
+        return ci_low, ci_high
+
+    def analyze(self, metric='readiness_score', window_days=1, baseline_days=28, tag_category=None):
+        """
+        Impact of each tag on a metric over the window_days after it
+
+        Returns:
+            list[dict]: One row per (tag, category) with n, baseline,
+            window_mean, mean_delta, ci_low and ci_high, sorted by
+            mean_delta
+        """
+        version = self.storage.version
+        if version != self._cache_version:
+            self._cache = {}
+            self._cache_version = version
+        key = (metric, window_days, baseline_days, tag_category)
+        if key not in self._cache:
+            self._cache[key] = self._analyze(metric, window_days, baseline_days, tag_category)
+        return self._cache[key]
+
+    def _analyze(self, metric, window_days, baseline_days, tag_category):
+        tags = self.storage.data['tags']
+        if tag_category is not None:
+            tags = [t for t in tags if t['tag_category'] == tag_category]
+        if not tags or self.storage.get_columns().size == 0:
+            return []
+
+        origin, grid = self._grid(metric)
+        baseline = self._rolling_baseline(grid, baseline_days)
+
+        tag_days = np.array([t['date'][:10] for t in tags], dtype='datetime64[D]').astype('int64') - origin
+        keys = np.array([f"{t['tag_name']}\x00{t['tag_category']}" for t in tags])
+
+        # (tags x window) day indices for the days after each tag
+        window_idx = tag_days[:, None] + np.arange(1, window_days + 1)
+        in_range = (window_idx >= 0) & (window_idx < len(grid))
+        windows = np.where(in_range, grid[np.clip(window_idx, 0, len(grid) - 1)], np.nan)
+
+        tag_in_range = (tag_days >= 0) & (tag_days < len(grid))
+        tag_baseline = np.where(tag_in_range, baseline[np.clip(tag_days, 0, len(grid) - 1)], np.nan)
+
+        with np.errstate(invalid='ignore'):
+            window_counts = (~np.isnan(windows)).sum(axis=1)
+            window_means = np.where(window_counts > 0,
+                                    np.nansum(windows, axis=1) / np.maximum(window_counts, 1),
+                                    np.nan)
+        deltas = window_means - tag_baseline
+        usable = ~np.isnan(deltas)
+
+        if not usable.any():
+            return []
+
+        unique_keys, groups = np.unique(keys[usable], return_inverse=True)
+        sizes = np.bincount(groups)
+        mean_delta = np.bincount(groups, weights=deltas[usable]) / sizes
+        mean_window = np.bincount(groups, weights=window_means[usable]) / sizes
+        mean_baseline = np.bincount(groups, weights=tag_baseline[usable]) / sizes
+        ci_low, ci_high = self._bootstrap(deltas[usable], groups, sizes,
+                                          np.random.default_rng(self.seed))
+
+        results = []
+        for i, group_key in enumerate(unique_keys):
+            tag_name, category = str(group_key).split('\x00', 1)
+            results.append({
+                'tag': tag_name,
+                'category': category,
+                'metric': metric,
+                'n': int(sizes[i]),
+                'baseline': round(float(mean_baseline[i]), 1),
+                'window_mean': round(float(mean_window[i]), 1),
+                'mean_delta': round(float(mean_delta[i]), 2),
+                'ci_low': None if np.isnan(ci_low[i]) else round(float(ci_low[i]), 2),
+                'ci_high': None if np.isnan(ci_high[i]) else round(float(ci_high[i]), 2),
+            })
+        return sorted(results, key=lambda r: r['mean_delta'])
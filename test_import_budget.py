@@ -0,0 +1,28 @@
+"""
+The dashboard's cold-start import budget (see import_budget.py)
+
+Forbidden modules are always checked. Wall-clock times vary too much on
+a loaded or cold machine, so they are only reported unless
+IMPORT_BUDGET_TIMING=1 is set.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import import_budget
+
+
+def test_dashboard_stays_within_its_import_budget():
+    command = [sys.executable, os.path.join(import_budget.HERE, 'import_budget.py'), '--json']
+    if os.getenv('IMPORT_BUDGET_TIMING') != '1':
+        command.append('--no-timing')
+    result = subprocess.run(command, capture_output=True, text=True, timeout=600)
+    report = json.loads(result.stdout)
+
+    assert set(report) == set(import_budget.BUDGETS_MS)
+    for stage, row in report.items():
+        print(f"{stage}: {row['ms']} ms (budget {row['budget_ms']} ms)")
+        assert row['problems'] == [], f"{stage}: {'; '.join(row['problems'])}"
+    assert result.returncode == 0
@@ -0,0 +1,77 @@
+"""
+Streaming answers from FakePerplexityServer through stream_health_question
+"""
+
+import threading
+
+import pytest
+
+import perplexity_integration
+from disk_cache import DiskCache
+from mock_servers import FakePerplexityServer
+
+ANSWER = "Sleep a little longer and keep dinner light"
+
+
+@pytest.fixture
+def make_client(tmp_path, monkeypatch):
+    """Start a fake server with the given options and return a client for it"""
+    servers = []
+    monkeypatch.setattr(perplexity_integration.st, 'secrets', {'PERPLEXITY_API_KEY': 'test-key'})
+    monkeypatch.setattr(perplexity_integration, '_cache', DiskCache(str(tmp_path / 'perplexity.db')))
+
+    def make(**kwargs):
+        server = FakePerplexityServer(**dict({'answer': ANSWER, 'token_delay': 0.0}, **kwargs)).start()
+        servers.append(server)
+        monkeypatch.setenv('PERPLEXITY_BASE_URL', server.completions_url)
+        return server, perplexity_integration.PerplexityClient()
+
+    yield make
+    for server in servers:
+        server.stop()
+
+
+def test_chunks_are_assembled_in_order(make_client):
+    server, client = make_client()
+    parts = list(client.stream_health_question("How can I sleep better?"))
+
+    assert parts == ["Sleep", " a", " little", " longer", " and", " keep", " dinner", " light"]
+    assert ''.join(parts) == ANSWER
+    assert server.requests[0]['stream'] is True
+
+
+def test_done_ends_the_stream_and_the_answer_is_cached(make_client):
+    server, client = make_client()
+    first = ''.join(client.stream_health_question("How can I sleep better?"))
+    again = list(client.stream_health_question("  how can I SLEEP better? "))
+
+    assert "[DONE]" not in first
+    assert again == [ANSWER]
+    assert len(server.requests) == 1
+
+
+def test_disconnect_mid_stream_reports_an_error_and_is_not_cached(make_client):
+    server, client = make_client(disconnect_after=3)
+    parts = list(client.stream_health_question("How can I sleep better?"))
+
+    assert ''.join(parts[:3]) == "Sleep a little"
+    assert parts[-1].startswith("Error communicating with Perplexity API")
+    list(client.stream_health_question("How can I sleep better?"))
+    assert len(server.requests) == 2
+
+
+def test_identical_streams_in_flight_share_one_request(make_client):
+    server, client = make_client(token_delay=0.02)
+    results = [None] * 3
+
+    def ask(i):
+        results[i] = ''.join(client.stream_health_question("How can I sleep better?"))
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [ANSWER] * 3
+    assert len(server.requests) == 1
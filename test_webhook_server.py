@@ -0,0 +1,142 @@
+"""
+Webhook receiver: verification, signatures, coalescing and the round trip
+from a changed Oura document into storage
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from datetime import date
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import pytest
+
+import oura_auth
+import oura_client
+import user_shards
+import webhook_server
+from data_storage import HealthDataStorage
+from mock_servers import FakeOuraServer, post_webhook_event
+
+EVENT = {'event_type': 'update', 'data_type': 'daily_sleep', 'object_id': 'sleep-2024-03-01', 'user_id': 'u1'}
+
+
+def _get_json(url):
+    try:
+        with urlopen(url, timeout=10) as response:
+            return response.status, json.load(response)
+    except HTTPError as e:
+        return e.code, json.load(e)
+
+
+class _RecordingReceiver(webhook_server.WebhookReceiver):
+    """Records applied events instead of fetching them; can hold the worker"""
+
+    def __init__(self, data_dir):
+        super().__init__(data_dir)
+        self.applied = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def apply(self, event):
+        self.started.set()
+        self.release.wait(10)
+        self.applied.append(event)
+        return True
+
+
+@pytest.fixture
+def receiver(tmp_path):
+    return _RecordingReceiver(str(tmp_path / 'user_data'))
+
+
+@pytest.fixture
+def hook(receiver):
+    with webhook_server.WebhookServer(receiver, port=0, verification_token='vt', secret='sec') as server:
+        yield server
+
+
+def test_verification_challenge_is_echoed_for_the_right_token(hook):
+    ok = _get_json(f"{hook.url}/?{urlencode({'verification_token': 'vt', 'challenge': 'abc123'})}")
+    wrong = _get_json(f"{hook.url}/?{urlencode({'verification_token': 'nope', 'challenge': 'abc123'})}")
+
+    assert ok == (200, {'challenge': 'abc123'})
+    assert wrong[0] == 401
+
+
+def test_bad_signatures_are_rejected(hook, receiver):
+    unsigned = post_webhook_event(hook.url, EVENT)
+    wrong_secret = post_webhook_event(hook.url, EVENT, secret='nope')
+    receiver.join()
+
+    assert unsigned == (401, {'detail': 'Bad signature'})
+    assert wrong_secret == (401, {'detail': 'Bad signature'})
+    assert receiver.applied == []
+
+
+def test_server_refuses_to_start_without_a_secret(receiver):
+    with pytest.raises(ValueError):
+        webhook_server.WebhookServer(receiver, port=0, verification_token='vt', secret=None)
+    server = webhook_server.WebhookServer(receiver, port=0, verification_token='vt', secret=None,
+                                          allow_unsigned=True)
+    server.httpd.server_close()
+
+
+def test_old_signatures_are_rejected():
+    body = json.dumps(EVENT).encode()
+    sent = str(int(time.time()) - webhook_server.MAX_CLOCK_SKEW - 60)
+    signature = hmac.new(b'sec', sent.encode() + body, hashlib.sha256).hexdigest()
+
+    assert webhook_server.verify_signature('sec', sent, body, signature, now=int(sent) + 1)
+    assert not webhook_server.verify_signature('sec', sent, body, signature)
+
+
+def test_duplicate_events_for_a_waiting_document_coalesce(hook, receiver):
+    receiver.release.clear()
+    first = post_webhook_event(hook.url, EVENT, secret='sec')
+    # The worker has taken the first event, so the next one queues behind it
+    assert receiver.started.wait(10)
+    burst = [post_webhook_event(hook.url, EVENT, secret='sec')[1]['status'] for _ in range(3)]
+    other = post_webhook_event(hook.url, dict(EVENT, object_id='sleep-2024-03-02'), secret='sec')
+    receiver.release.set()
+    receiver.join()
+
+    assert first == (200, {'status': 'queued'})
+    assert burst == ['queued', 'coalesced', 'coalesced']
+    assert other[1]['status'] == 'queued'
+    assert [event['object_id'] for event in receiver.applied] == [
+        'sleep-2024-03-01', 'sleep-2024-03-01', 'sleep-2024-03-02']
+
+
+def test_notified_document_is_fetched_into_storage(tmp_path, monkeypatch):
+    data_dir = str(tmp_path / 'user_data')
+    monkeypatch.setattr(oura_auth, '_token_managers', {})
+    monkeypatch.setattr(oura_auth, 'CLIENT_ID', 'client-id')
+    monkeypatch.setattr(oura_auth, 'CLIENT_SECRET', 'client-secret')
+    shard = user_shards.shard_for('u1', data_dir)
+    with open(os.path.join(shard.directory, user_shards.SHARD_TOKEN_FILE), 'w') as f:
+        json.dump({'access_token': 'tok-u1', 'refresh_token': None, 'expires_at': time.time() + 86400}, f)
+    day = str(date.today())
+
+    with FakeOuraServer(users={'tok-u1': 'u1'}) as oura, webhook_server.WebhookServer(
+            webhook_server.WebhookReceiver(data_dir), port=0, verification_token='vt',
+            secret='client-secret') as hook:
+        monkeypatch.setattr(oura_client, 'BASE_URL', oura.base_url)
+        # Oura checks the callback with the GET challenge before subscribing,
+        # and signs events with the client secret
+        webhook_server.subscribe(hook.url, 'vt', data_types=['daily_sleep'], event_types=['update'])
+        object_id = oura.set_record('daily_sleep', day, score=91, average_hrv=64)
+        responses = oura.notify('update', 'daily_sleep', object_id, 'u1')
+        hook.receiver.join()
+
+    assert responses == [(200, {'status': 'queued'})]
+    assert (f"/v2/usercollection/daily_sleep/{object_id}", {}) in oura.requests
+    entry = HealthDataStorage(shard.storage_file).get_entry(day)
+    assert entry['sleep_score'] == 91
+    assert entry['hrv'] == 64
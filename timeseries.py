@@ -0,0 +1,123 @@
+"""
+Columnar time-series view of daily entries
+
+Holds one datetime64[D] date array and one float64 array per metric,
+sorted by date, so trend queries slice arrays instead of walking lists
+of dicts. Missing values ('N/A', None) are stored as NaN.
+"""
+
+import numpy as np
+import pandas as pd
+
+METRICS = (
+    'sleep_score',
+    'readiness_score',
+    'activity_score',
+    'heart_rate',
+    'hrv',
+    'temperature',
+    'total_sleep',
+)
+
+# Deviations from a baseline, where zero and negative readings are real
+SIGNED_METRICS = ('temperature',)
+
+
+def valid_mask(metric, values):
+    """
+    Which values are readings rather than gaps
+
+    Scores, heart rate and sleep use 0 for "not recorded", so only
+    positive values count; for signed metrics any number does.
+    """
+    values = np.asarray(values)
+    if metric in SIGNED_METRICS:
+        return ~np.isnan(values)
+    return values > 0
+
+
+def _to_float(value):
+    """Convert a stored metric (int, float, '+0.12', 'N/A', None) to float"""
+    if value is None or value == 'N/A':
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class ColumnarSeries:
+    """Date-sorted column arrays, updated in place as entries change"""
+
+    def __init__(self, entries=()):
+        """
+        Args:
+            entries: Daily entries sorted by date
+        """
+        entries = list(entries)
+        self.size = len(entries)
+        capacity = max(16, self.size * 2)
+        self._dates = np.empty(capacity, dtype='datetime64[D]')
+        self._dates[:self.size] = np.array([e['date'] for e in entries], dtype='datetime64[D]')
+        self._columns = {}
+        for metric in METRICS:
+            column = np.full(capacity, np.nan)
+            column[:self.size] = [_to_float(e.get(metric)) for e in entries]
+            self._columns[metric] = column
+
+    @property
+    def dates(self):
+        return self._dates[:self.size]
+
+    def column(self, metric):
+        return self._columns[metric][:self.size]
+
+    def _grow(self):
+        capacity = len(self._dates) * 2
+        dates = np.empty(capacity, dtype='datetime64[D]')
+        dates[:self.size] = self.dates
+        self._dates = dates
+        for metric, old in self._columns.items():
+            column = np.full(capacity, np.nan)
+            column[:self.size] = old[:self.size]
+            self._columns[metric] = column
+
+    def upsert(self, entry):
+        """
+        Insert or replace one entry; appending the newest day is O(1) amortized
+
+        Returns:
+            tuple: (index, inserted) - the entry's row and whether it is new
+        """
+        date = np.datetime64(entry['date'], 'D')
+        i = int(np.searchsorted(self.dates, date))
+        if i < self.size and self._dates[i] == date:
+            for metric, column in self._columns.items():
+                column[i] = _to_float(entry.get(metric))
+            return i, False
+
+        if self.size == len(self._dates):
+            self._grow()
+        # Shift the tail right by one (a no-op when appending)
+        self._dates[i + 1:self.size + 1] = self._dates[i:self.size]
+        self._dates[i] = date
+        for metric, column in self._columns.items():
+            column[i + 1:self.size + 1] = column[i:self.size]
+            column[i] = _to_float(entry.get(metric))
+        self.size += 1
+        return i, True
+
+    def bounds(self, start=None, end=None):
+        """Index range [lo, hi) of dates with start <= date <= end"""
+        dates = self.dates
+        lo = 0 if start is None else int(np.searchsorted(dates, np.datetime64(str(start), 'D'), 'left'))
+        hi = self.size if end is None else int(np.searchsorted(dates, np.datetime64(str(end), 'D'), 'right'))
+        return lo, hi
+
+    def frame(self, start=None, end=None):
+        """DataFrame with a datetime64 'date' column and one float column per metric"""
+        lo, hi = self.bounds(start, end)
+        data = {'date': self.dates[lo:hi].astype('datetime64[ns]')}
+        for metric in METRICS:
+            data[metric] = self.column(metric)[lo:hi]
+        return pd.DataFrame(data, copy=True)
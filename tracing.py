@@ -0,0 +1,280 @@
+"""
+Lightweight tracing: timed spans, counters and cache hit rates
+
+Off unless OURA_TRACING=1 is set (or enable() is called). While off,
+span() returns one shared no-op context manager and count() / cache()
+return immediately, so instrumented hot paths pay a global lookup and a
+function call.
+
+Each span name + label set keeps a lifetime count and total plus a
+bounded window of recent durations, which p50 / p95 are computed from.
+snapshot() returns everything as plain data, to_json() and
+to_prometheus() render it for export, and start_metrics_server() serves
+both over HTTP when OURA_METRICS_PORT is set.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+ENABLED = os.getenv('OURA_TRACING', '').lower() in ('1', 'true', 'yes', 'on')
+
+# Recent durations kept per span for the percentiles
+WINDOW = 1024
+
+METRICS_HOST = os.getenv('OURA_METRICS_HOST', '127.0.0.1')
+METRICS_PORT = os.getenv('OURA_METRICS_PORT')
+
+_lock = threading.Lock()
+_spans = {}     # (name, labels) -> _SpanStats
+_counters = {}  # (name, labels) -> int
+_caches = {}    # name -> [hits, misses]
+_server = None
+
+
+class _SpanStats:
+    __slots__ = ('count', 'errors', 'total', 'max', 'recent')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=WINDOW)
+
+
+class _NullSpan:
+    """What span() returns while tracing is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('key', 'started')
+
+    def __init__(self, key):
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        elapsed = time.perf_counter() - self.started
+        with _lock:
+            stats = _spans.get(self.key)
+            if stats is None:
+                stats = _spans[self.key] = _SpanStats()
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.recent.append(elapsed)
+            if exc_type is not None:
+                stats.errors += 1
+        return False
+
+    def start(self):
+        """Start timing outside a with block; returns the span"""
+        return self.__enter__()
+
+    def stop(self):
+        self.__exit__(None, None, None)
+
+
+def enable(flag=True):
+    """Turn tracing on or off at runtime"""
+    global ENABLED
+    ENABLED = flag
+
+
+def span(name, **labels):
+    """
+    Context manager that times its body under a name and labels
+
+    e.g. with tracing.span('http.request', host=host): ...
+    A body that raises is still timed and also counted as an error. For
+    code that does not fit in a with block, span(...).start() / .stop().
+    """
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span((name, tuple(sorted(labels.items()))))
+
+
+def traced(name):
+    """Decorator form of span(); the enabled check happens on each call"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _Span((name, ())):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1, **labels):
+    """Add n to a counter"""
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def cache(name, hit):
+    """Record one lookup in a named cache as a hit or a miss"""
+    if not ENABLED:
+        return
+    with _lock:
+        stats = _caches.setdefault(name, [0, 0])
+        stats[0 if hit else 1] += 1
+
+
+def reset():
+    """Forget everything recorded so far"""
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _caches.clear()
+
+
+def _percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def snapshot():
+    """
+    Current spans, counters and caches as plain data
+
+    Returns:
+        dict: {'enabled', 'spans', 'counters', 'caches'}; durations in ms,
+        spans sorted by total time spent
+    """
+    with _lock:
+        spans = [(key, stats.count, stats.errors, stats.total, stats.max, sorted(stats.recent))
+                 for key, stats in _spans.items()]
+        counters = dict(_counters)
+        caches = {name: tuple(stats) for name, stats in _caches.items()}
+
+    span_rows = []
+    for (name, labels), n, errors, total, longest, ordered in spans:
+        span_rows.append({
+            'name': name,
+            'labels': dict(labels),
+            'count': n,
+            'errors': errors,
+            'total_ms': round(total * 1000, 3),
+            'p50_ms': round(_percentile(ordered, 0.50) * 1000, 3),
+            'p95_ms': round(_percentile(ordered, 0.95) * 1000, 3),
+            'max_ms': round(longest * 1000, 3),
+        })
+    span_rows.sort(key=lambda row: row['total_ms'], reverse=True)
+    return {
+        'enabled': ENABLED,
+        'spans': span_rows,
+        'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                     for (name, labels), value in sorted(counters.items())],
+        'caches': [{'name': name, 'hits': hits, 'misses': misses,
+                    'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None}
+                   for name, (hits, misses) in sorted(caches.items())],
+    }
+
+
+def to_json():
+    return json.dumps(snapshot(), indent=2)
+
+
+def _labels(**labels):
+    """Prometheus label set, e.g. {span="http.request",host="x"}"""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+def to_prometheus():
+    """Snapshot in the Prometheus text exposition format"""
+    data = snapshot()
+    lines = ['# TYPE oura_span_seconds summary']
+    for row in data['spans']:
+        labels = dict(span=row['name'], **row['labels'])
+        for quantile, key in (('0.5', 'p50_ms'), ('0.95', 'p95_ms')):
+            lines.append(f"oura_span_seconds{_labels(**labels, quantile=quantile)} {round(row[key] / 1000, 6)}")
+        lines.append(f"oura_span_seconds_sum{_labels(**labels)} {round(row['total_ms'] / 1000, 6)}")
+        lines.append(f"oura_span_seconds_count{_labels(**labels)} {row['count']}")
+    lines.append('# TYPE oura_span_errors_total counter')
+    for row in data['spans']:
+        lines.append(f"oura_span_errors_total{_labels(span=row['name'], **row['labels'])} {row['errors']}")
+    lines.append('# TYPE oura_events_total counter')
+    for row in data['counters']:
+        lines.append(f"oura_events_total{_labels(event=row['name'], **row['labels'])} {row['value']}")
+    lines.append('# TYPE oura_cache_lookups_total counter')
+    for row in data['caches']:
+        lines.append(f"oura_cache_lookups_total{_labels(cache=row['name'], result='hit')} {row['hits']}")
+        lines.append(f"oura_cache_lookups_total{_labels(cache=row['name'], result='miss')} {row['misses']}")
+    return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(port=None, host=None):
+    """
+    Serve /metrics (Prometheus text) and /metrics.json on a daemon thread
+
+    Only the first call starts a server; later calls return it.
+
+    Args:
+        port (int): Port to listen on; defaults to OURA_METRICS_PORT
+        host (str): Interface to bind; defaults to OURA_METRICS_HOST (127.0.0.1)
+
+    Returns:
+        ThreadingHTTPServer, or None if no port is configured
+    """
+    global _server
+    port = port if port is not None else METRICS_PORT
+    if port is None:
+        return None
+    with _lock:
+        if _server is not None:
+            return _server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = to_json(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        _server = ThreadingHTTPServer((host or METRICS_HOST, int(port)), MetricsHandler)
+        threading.Thread(target=_server.serve_forever, daemon=True, name='metrics-server').start()
+        return _server
@@ -0,0 +1,203 @@
+"""
+Per-user storage shards
+
+One deployment can serve several ring owners. Each Oura user gets a
+directory of their own under DATA_DIR holding their health data, heart
+rate files and OAuth tokens:
+
+    user_data/<oura user id>/health_data.db
+    user_data/<oura user id>/hr_data/
+    user_data/<oura user id>/.oura_tokens.json
+
+Users never share a file, lock or HealthDataStorage instance, so their
+reads and writes proceed independently. Which shard a token belongs to
+is decided by the id the Oura personal_info endpoint returns for it;
+the answer is kept in DATA_DIR/users.json (by token fingerprint, never
+the token itself), so it is looked up once per token.
+
+Single-user deployments keep the original layout: shard_for(None) is
+the working directory, as before.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+from file_lock import FileLock
+
+DATA_DIR = os.getenv('OURA_DATA_DIR', 'user_data')
+USERS_FILE = 'users.json'
+SHARD_TOKEN_FILE = '.oura_tokens.json'
+
+_directories = {}
+_shards = {}
+_lock = threading.Lock()
+
+
+def token_fingerprint(access_token):
+    """Short hash that identifies a token without storing it"""
+    return hashlib.sha256(access_token.encode()).hexdigest()[:16]
+
+
+def fetch_user_id(access_token):
+    """
+    Ask the Oura personal_info endpoint whose token this is
+
+    Raises:
+        requests.exceptions.HTTPError: If the token is rejected
+    """
+    import http_client
+    import oura_client
+    response = http_client.get(
+        f'{oura_client.BASE_URL}/personal_info',
+        headers={'Authorization': f'Bearer {access_token}'},
+        timeout=oura_client.REQUEST_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()['id']
+
+
+class UserDirectory:
+    """Token fingerprint -> Oura user id, shared by every process using data_dir"""
+
+    def __init__(self, data_dir=DATA_DIR, fetch=fetch_user_id):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, USERS_FILE)
+        self.fetch = fetch
+        self._known = {}
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def user_id(self, access_token):
+        """Oura user id for a token, calling personal_info only for unseen tokens"""
+        key = token_fingerprint(access_token)
+        user_id = self._known.get(key)
+        if user_id is not None:
+            return user_id
+
+        with self._lock:
+            user_id = self._read().get(key)
+            if user_id is None:
+                user_id = self.fetch(access_token)
+                os.makedirs(self.data_dir, exist_ok=True)
+                with FileLock(f"{self.path}.lock"):
+                    # Merge with what other processes added meanwhile
+                    known = self._read()
+                    known[key] = user_id
+                    tmp_path = f"{self.path}.tmp"
+                    with open(tmp_path, 'w') as f:
+                        json.dump(known, f, indent=2)
+                    os.replace(tmp_path, self.path)
+            self._known[key] = user_id
+        return user_id
+
+
+class UserShard:
+    """
+    File locations and credentials for one user's data
+
+    Args:
+        user_id (str): Oura user id, or None for the single-user layout
+        directory (str): Directory the shard's files live in
+        initial_tokens (dict): Tokens to seed an empty token file with
+    """
+
+    def __init__(self, user_id, directory, initial_tokens=None):
+        self.user_id = user_id
+        self.directory = directory
+        self.initial_tokens = initial_tokens
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def storage_file(self):
+        """Filename to pass to HealthDataStorage"""
+        return os.path.join(self.directory, 'health_data.json')
+
+    @property
+    def hr_directory(self):
+        return os.path.join(self.directory, 'hr_data')
+
+    @property
+    def token_file(self):
+        if self.user_id is None:
+            from oura_auth import TOKEN_FILE
+            return TOKEN_FILE
+        return os.path.join(self.directory, SHARD_TOKEN_FILE)
+
+    def token_manager(self):
+        from oura_auth import get_token_manager
+        return get_token_manager(self.user_id, self.token_file, self.initial_tokens)
+
+    def access_token(self):
+        """A valid access token for this user, refreshed if needed"""
+        return self.token_manager().get_access_token()
+
+
+def _directory_name(user_id):
+    """Filesystem-safe directory name for a user id"""
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', str(user_id))
+    if name.strip('.') == '':
+        raise ValueError(f"Unusable Oura user id: {user_id!r}")
+    return name
+
+
+def shard_for(user_id, data_dir=DATA_DIR, initial_tokens=None):
+    """
+    Return the (process-wide) shard for a user id
+
+    None gives the single-user layout in the working directory.
+    """
+    key = (user_id, data_dir)
+    shard = _shards.get(key)
+    if shard is None:
+        with _lock:
+            shard = _shards.get(key)
+            if shard is None:
+                directory = '.' if user_id is None else os.path.join(data_dir, _directory_name(user_id))
+                shard = UserShard(user_id, directory, initial_tokens)
+                _shards[key] = shard
+    return shard
+
+
+def known_shard(user_id, data_dir=DATA_DIR):
+    """The shard of a user who has logged in before (it has a token file), or None"""
+    if not os.path.exists(os.path.join(data_dir, _directory_name(user_id), SHARD_TOKEN_FILE)):
+        return None
+    return shard_for(user_id, data_dir)
+
+
+def default_shard():
+    """The single-user shard, or None if no single-user token is set up"""
+    from oura_auth import TOKEN_FILE, _configured_tokens
+    if os.path.exists(TOKEN_FILE) or _configured_tokens():
+        return shard_for(None)
+    return None
+
+
+def get_user_directory(data_dir=DATA_DIR):
+    """Return the shared token -> user id directory for a data dir"""
+    directory = _directories.get(data_dir)
+    if directory is None:
+        with _lock:
+            directory = _directories.setdefault(data_dir, UserDirectory(data_dir))
+    return directory
+
+
+def shard_for_tokens(tokens, data_dir=DATA_DIR):
+    """
+    Return the shard of whoever owns these tokens
+
+    Args:
+        tokens (dict): At least 'access_token'; 'refresh_token' too if the
+            shard's token file still needs seeding
+    """
+    user_id = get_user_directory(data_dir).user_id(tokens['access_token'])
+    return shard_for(user_id, data_dir, initial_tokens=tokens)
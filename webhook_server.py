@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Oura webhook receiver
+
+Oura can notify a callback URL whenever one of a user's documents is
+created or updated, instead of being polled for changes. This server
+takes those notifications and fetches only the document each one names
+(GET /v2/usercollection/<data_type>/<object_id>) with its owner's
+token. The document goes into that user's storage and, when it is the
+newest of its kind, into the snapshot the dashboard renders from (see
+sync_daemon.py). A day on which nothing changes costs no API calls; run
+sync_daemon.py with a long interval (e.g. --interval 86400) alongside it
+to catch any notification that never arrived.
+
+- GET  <callback>?verification_token=...&challenge=...
+  Oura's check when a subscription is created; answered with
+  {"challenge": ...} if the token matches OURA_WEBHOOK_VERIFICATION_TOKEN.
+- POST <callback> with {event_type, data_type, object_id, user_id}
+  Queued and answered straight away; a worker thread applies it. A
+  notification for a document that is still waiting in the queue is
+  dropped.
+- A POST must carry x-oura-timestamp (Unix seconds) and
+  x-oura-signature, the hex HMAC-SHA256 of timestamp + body under the
+  app's CLIENT_SECRET (or OURA_WEBHOOK_SECRET if set), or it is refused
+  with 401. Every accepted event spends the user's token and rate limit
+  on a fetch, so the server will not start without a secret unless
+  --allow-unsigned is given (for local testing only).
+
+The server binds to localhost; expose the callback through your HTTPS
+reverse proxy or tunnel. Events are routed to the shard of the Oura
+user id they carry (see user_shards.py).
+
+Usage:
+    python webhook_server.py serve --port 8090
+    python webhook_server.py serve --allow-unsigned   # no secret, local testing
+    python webhook_server.py subscribe https://example.com/oura/webhook
+    python webhook_server.py list
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from dotenv import load_dotenv
+
+import sync_daemon
+import tracing
+import user_shards
+from oura_auth import CLIENT_SECRET
+from oura_sync import COLLECTIONS
+
+load_dotenv()
+
+HOST = os.getenv('OURA_WEBHOOK_HOST', '127.0.0.1')
+PORT = int(os.getenv('OURA_WEBHOOK_PORT', 8090))
+VERIFICATION_TOKEN = os.getenv('OURA_WEBHOOK_VERIFICATION_TOKEN')
+# Oura signs events with the app's client secret
+SECRET = os.getenv('OURA_WEBHOOK_SECRET') or CLIENT_SECRET
+
+# What `subscribe` asks for; deletions are left to the next full sync
+DATA_TYPES = tuple(COLLECTIONS)
+EVENT_TYPES = ('create', 'update')
+
+EVENT_FIELDS = ('event_type', 'data_type', 'object_id', 'user_id')
+
+# Largest POST body accepted, and how old a signed request may be
+MAX_BODY = 64 * 1024
+MAX_CLOCK_SKEW = 5 * 60
+
+
+def verify_signature(secret, timestamp, body, signature, now=None):
+    """
+    Whether signature is the HMAC-SHA256 of timestamp + body under secret
+    and timestamp is within MAX_CLOCK_SKEW of now
+    """
+    if not timestamp or not signature:
+        return False
+    try:
+        sent = float(timestamp)
+    except ValueError:
+        return False
+    if abs((now or time.time()) - sent) > MAX_CLOCK_SKEW:
+        return False
+    expected = hmac.new(secret.encode(), timestamp.encode() + body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected.encode(), signature.strip().lower().encode())
+
+
+class WebhookReceiver:
+    """
+    Applies webhook events to the shard of the user they are about
+
+    Events wait in a queue for a single worker thread, so the HTTP
+    handler can answer at once and fetches never overlap.
+
+    Args:
+        data_dir (str): Where the user shards live
+    """
+
+    def __init__(self, data_dir=user_shards.DATA_DIR):
+        self.data_dir = data_dir
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._open_stores = {}
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, event):
+        """
+        Queue an event for the worker
+
+        Returns:
+            bool: False if the same document was already waiting
+        """
+        key = (event['user_id'], event['data_type'], event['object_id'])
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, daemon=True, name='webhook-worker')
+                self._worker.start()
+        self._queue.put(event)
+        return True
+
+    def join(self):
+        """Wait until every queued event has been applied"""
+        self._queue.join()
+
+    def _work(self):
+        while True:
+            event = self._queue.get()
+            key = (event['user_id'], event['data_type'], event['object_id'])
+            # Forget it before fetching: a change that arrives meanwhile needs its own fetch
+            with self._lock:
+                self._pending.discard(key)
+            try:
+                self.apply(event)
+            except Exception as e:
+                print(f"Webhook event {key} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def shard_for(self, user_id):
+        """The shard events for an Oura user id belong to, or None"""
+        shard = user_shards.known_shard(user_id, self.data_dir)
+        if shard is None:
+            # The single-user shard is not named after its user; ask whose
+            # token it holds (looked up once, then kept in users.json)
+            default = user_shards.default_shard()
+            if default is not None:
+                directory = user_shards.get_user_directory(self.data_dir)
+                if directory.user_id(default.access_token()) == user_id:
+                    shard = default
+        return shard
+
+    def _storage(self, shard):
+        storage = self._open_stores.get(shard.directory)
+        if storage is None:
+            from data_storage import HealthDataStorage
+            storage = self._open_stores[shard.directory] = HealthDataStorage(shard.storage_file)
+        return storage
+
+    def apply(self, event):
+        """
+        Fetch the document an event names and store it
+
+        Returns:
+            bool: Whether anything was stored
+        """
+        from oura_client import fetch_document
+
+        data_type = event['data_type']
+        shard = self.shard_for(event['user_id'])
+        if shard is None:
+            print(f"Webhook for unknown Oura user {event['user_id']} ignored")
+            return False
+        if event['event_type'] not in EVENT_TYPES:
+            return False
+
+        record = fetch_document(shard.access_token(), data_type, event['object_id'])
+        day = record.get('day')
+        if not day:
+            return False
+        fields = COLLECTIONS[data_type](record)
+        storage = self._storage(shard)
+        storage.reload_if_changed()
+        storage.upsert_daily_fields({day: fields})
+        sync_daemon.merge_into_snapshot(shard, data_type, day, fields)
+        tracing.count('webhook.applied', data_type=data_type)
+        return True
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server.owner
+        query = {key: values[-1] for key, values in parse_qs(urlsplit(self.path).query).items()}
+        challenge = query.get('challenge')
+        token = query.get('verification_token', '')
+        if (not server.verification_token or not challenge
+                or not hmac.compare_digest(token.encode(), server.verification_token.encode())):
+            self._send_json(401, {'detail': 'Verification failed'})
+            return
+        self._send_json(200, {'challenge': challenge})
+
+    def do_POST(self):
+        server = self.server.owner
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY:
+            self.close_connection = True
+            self._send_json(413 if length > MAX_BODY else 400, {'detail': 'Bad Content-Length'})
+            return
+        body = self.rfile.read(length)
+
+        if server.secret and not verify_signature(server.secret, self.headers.get('x-oura-timestamp'),
+                                                  body, self.headers.get('x-oura-signature')):
+            tracing.count('webhook.events', result='bad_signature')
+            self._send_json(401, {'detail': 'Bad signature'})
+            return
+        try:
+            event = json.loads(body)
+        except ValueError:
+            event = None
+        if not isinstance(event, dict) or not all(isinstance(event.get(field), str) for field in EVENT_FIELDS):
+            self._send_json(400, {'detail': f"Expected JSON with {', '.join(EVENT_FIELDS)}"})
+            return
+
+        if event['data_type'] not in COLLECTIONS:
+            result = 'ignored'
+        else:
+            result = 'queued' if server.receiver.submit(event) else 'coalesced'
+        tracing.count('webhook.events', data_type=event['data_type'], result=result)
+        self._send_json(200, {'status': result})
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebhookServer:
+    """
+    HTTP endpoint in front of a WebhookReceiver; usable as a context manager
+
+    Args:
+        receiver (WebhookReceiver): Applies the events; a new one if None
+        verification_token (str): Expected in Oura's verification GET
+        secret (str): Signing secret events must be signed with
+        allow_unsigned (bool): Accept unsigned events when there is no
+            secret instead of refusing to start
+
+    Raises:
+        ValueError: If there is no secret and allow_unsigned is False
+    """
+
+    def __init__(self, receiver=None, host=HOST, port=PORT, verification_token=VERIFICATION_TOKEN,
+                 secret=SECRET, allow_unsigned=False):
+        if not secret and not allow_unsigned:
+            raise ValueError("No webhook secret: set CLIENT_SECRET (or OURA_WEBHOOK_SECRET), "
+                             "or allow unsigned events explicitly")
+        self.receiver = receiver or WebhookReceiver()
+        self.verification_token = verification_token
+        self.secret = secret
+        self.httpd = ThreadingHTTPServer((host, port), _WebhookHandler)
+        self.httpd.owner = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name='webhook-server')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def subscription_url():
+    """Oura's webhook subscription endpoint, on the same host as the usercollection API"""
+    import oura_client
+    return oura_client.BASE_URL.rsplit('/usercollection', 1)[0] + '/webhook/subscription'
+
+
+def _client_headers():
+    from oura_auth import CLIENT_ID, CLIENT_SECRET
+    if not CLIENT_ID or not CLIENT_SECRET:
+        raise ValueError("CLIENT_ID and CLIENT_SECRET must be set to manage webhook subscriptions")
+    return {'x-client-id': CLIENT_ID, 'x-client-secret': CLIENT_SECRET}
+
+
+def subscribe(callback_url, verification_token=VERIFICATION_TOKEN, data_types=DATA_TYPES,
+              event_types=EVENT_TYPES):
+    """
+    Subscribe a callback URL to every data type / event type pair
+
+    Oura verifies the callback before creating a subscription, so the
+    server must already be reachable there with the same verification
+    token.
+
+    Returns:
+        list: The created subscriptions
+
+    Raises:
+        requests.exceptions.HTTPError: If Oura refuses a subscription
+    """
+    import http_client
+    if not verification_token:
+        raise ValueError("Set OURA_WEBHOOK_VERIFICATION_TOKEN (the server needs the same value)")
+    created = []
+    for data_type in data_types:
+        for event_type in event_types:
+            response = http_client.post(subscription_url(), headers=_client_headers(), json={
+                'callback_url': callback_url,
+                'verification_token': verification_token,
+                'event_type': event_type,
+                'data_type': data_type,
+            }, timeout=30)
+            response.raise_for_status()
+            created.append(response.json())
+    return created
+
+
+def list_subscriptions():
+    """Webhook subscriptions registered for this app"""
+    import http_client
+    response = http_client.get(subscription_url(), headers=_client_headers(), timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='Receive webhook events')
+    serve.add_argument('--host', default=HOST)
+    serve.add_argument('--port', type=int, default=PORT)
+    serve.add_argument('--data-dir', default=user_shards.DATA_DIR)
+    serve.add_argument('--allow-unsigned', action='store_true',
+                       help='Accept unsigned events if no secret is set (local testing only)')
+    add = commands.add_parser('subscribe', help='Subscribe a callback URL to daily document changes')
+    add.add_argument('callback_url')
+    add.add_argument('--data-types', nargs='+', default=list(DATA_TYPES), choices=DATA_TYPES)
+    commands.add_parser('list', help='Show existing subscriptions')
+    args = parser.parse_args()
+
+    if args.command == 'subscribe':
+        for subscription in subscribe(args.callback_url, data_types=args.data_types):
+            print(json.dumps(subscription))
+        return 0
+    if args.command == 'list':
+        print(json.dumps(list_subscriptions(), indent=2))
+        return 0
+
+    if not SECRET and not args.allow_unsigned:
+        print("Error: CLIENT_SECRET (or OURA_WEBHOOK_SECRET) must be set to check event "
+              "signatures; pass --allow-unsigned to run without one")
+        return 2
+    if not VERIFICATION_TOKEN:
+        print("Warning: OURA_WEBHOOK_VERIFICATION_TOKEN is not set; subscription checks will fail")
+    server = WebhookServer(WebhookReceiver(args.data_dir), args.host, args.port,
+                           allow_unsigned=args.allow_unsigned)
+    print(f"Receiving Oura webhooks on {server.url} (Ctrl+C to stop)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())